@@ -12,21 +12,136 @@ marker-pdfを使用してMarkdown形式に変換します。
 - 画像参照の検証
 - 特定ファイルのみの処理
 - バックアップ機能
+- 並列処理と処理履歴に基づくスケジューリング
+- ワーカーごとのCPUスレッド数の割り当てとベンチマーク
+- メモリ予算に基づく同時変換数の制御
+- 変換ごとのタイムアウト監視（ウォッチドッグ）
+- 一時ファイルを使わないメモリ上でのダウンロード・変換
+- テキストレイヤーのあるページの高速抽出（モデル処理のスキップ）
+- 速度と品質を切り替える変換プロファイル（PDFごとに指定可能）
+- 小さいPDFをまとめて変換するバッチ処理
+- レイアウト・OCR結果のキャッシュによる再レンダリング
+- 画像の抽出を行わないテキストのみの変換
+- モデルのウォームアップとオフライン動作の確認
+- 処理ステージごとのプロファイリング（cProfile・tracemalloc）
+- 処理ステージの階層的なトレース（Chromeトレース形式で出力）
+- 間引きした進捗表示と、quiet/JSONイベント出力モード
+- 実行履歴のSQLiteデータベースへの記録と処理時間の推移・劣化の検出
+- 変換済みMarkdownの全文検索（見出し単位・文字n-gramの転置インデックス）
+- セクション単位のSQLite（FTS5）へのエクスポート
+- 版どうしのセクション・段落単位の差分
+- TF-IDFの類似度行列による版をまたいだセクションの対応付け
+- RAG用の見出し単位のチャンクのJSONL出力
+- 見出しごとのバイト位置の索引（サイドカー）による章単位の読み込み
+- 大きなガイドの章ごとのファイルと目次ページへの分割
+- 段落の重複率の集計と、共通段落を1回だけ保存するコーパスの出力
+- MinHash LSHによる版をまたいだほぼ同じ内容のセクションの検出
+- 検索インデックス付きの静的HTMLサイトの差分ビルド
 """
 
 import argparse
+import cProfile
+import difflib
+import hashlib
+import html
+import io
 import json
+import math
+import multiprocessing
+import multiprocessing.connection
 import os
+import pickle
+import pstats
 import re
 import shutil
+import sqlite3
 import sys
+import threading
 import time
+import tracemalloc
+import unicodedata
+import zlib
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
 from datetime import datetime
 import requests
 from marker.converters.pdf import PdfConverter
 from marker.models import create_model_dict
 from marker.output import text_from_rendered
+from marker.renderers.markdown import MarkdownRenderer
+
+
+OUTPUT_MODES = ("text", "quiet", "json")
+PROGRESS_INTERVAL = 0.5
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# quietモードでも表示するレベル
+QUIET_LEVELS = ("result", "warning", "error")
+
+# 出力の状態（configure_outputで設定）
+_output = {"mode": "text", "progress_interval": PROGRESS_INTERVAL, "progress": {}}
+
+
+def configure_output(mode: str = "text", progress_interval: float = PROGRESS_INTERVAL) -> None:
+    """出力モード（text: 通常表示, quiet: 結果と警告・エラーのみ, json: JSON Linesのイベント）を設定する"""
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"不明な出力モード: {mode}")
+    _output.update({"mode": mode, "progress_interval": progress_interval, "progress": {}})
+
+
+def _write_line(line: str) -> None:
+    # 並列ワーカーの出力が行の途中で混ざらないよう、1回の書き込みで出力する
+    sys.stdout.write(line + "\n")
+    sys.stdout.flush()
+
+
+def report(message: str, event: str = "log", level: str = "info", **fields) -> None:
+    """進捗・結果を出力する
+
+    textモードではメッセージをそのまま表示し、quietモードではresult・warning・error
+    レベルのみ表示する。jsonモードではイベント名・レベル・フィールドを含む
+    JSONを1行ずつ出力する。
+    """
+    mode = _output["mode"]
+    if mode == "json":
+        text = message.strip()
+        # 区切り線などの装飾のみの行はイベントにしない
+        if not text.strip("=-") and event == "log":
+            return
+        record = {"event": event, "level": level,
+                  "time": datetime.now().isoformat(timespec='milliseconds'), "pid": os.getpid()}
+        if text:
+            record["message"] = text
+        record.update(fields)
+        _write_line(json.dumps(record, ensure_ascii=False, default=str))
+    elif mode == "text" or level in QUIET_LEVELS:
+        _write_line(message)
+
+
+def report_progress(task: str, done: int, total: int = 0, final: bool = False) -> None:
+    """進捗を間引いて出力する（前回の出力からprogress_interval秒以上経過した場合と完了時のみ）"""
+    mode = _output["mode"]
+    if mode == "quiet":
+        return
+    
+    now = time.monotonic()
+    last = _output["progress"].get(task)
+    if not final and last is not None and now - last < _output["progress_interval"]:
+        return
+    _output["progress"][task] = now
+    if final:
+        _output["progress"].pop(task, None)
+    
+    if mode == "json":
+        report("", event="progress", task=task, done=done, total=total, final=final)
+        return
+    
+    if total > 0:
+        text = f"\r  進捗: {done / total * 100:.1f}%"
+    else:
+        text = f"\r  進捗: {done / (1024 * 1024):.2f} MB"
+    sys.stdout.write(text + ("\n" if final else ""))
+    sys.stdout.flush()
 
 
 def load_config(config_path: str = "config.json") -> dict:
@@ -35,10 +150,10 @@ def load_config(config_path: str = "config.json") -> dict:
         with open(config_path, "r", encoding="utf-8") as f:
             return json.load(f)
     except FileNotFoundError:
-        print(f"❌ エラー: {config_path} が見つかりません")
+        report(f"❌ エラー: {config_path} が見つかりません", level="error")
         sys.exit(1)
     except json.JSONDecodeError as e:
-        print(f"❌ エラー: {config_path} の解析に失敗しました: {e}")
+        report(f"❌ エラー: {config_path} の解析に失敗しました: {e}", level="error")
         sys.exit(1)
 
 
@@ -52,36 +167,85 @@ def ensure_directories(config: dict) -> None:
     ]
     for dir_path in dirs:
         Path(dir_path).mkdir(parents=True, exist_ok=True)
-    print(f"✅ ディレクトリを作成しました: {', '.join(dirs)}")
+    report(f"✅ ディレクトリを作成しました: {', '.join(dirs)}")
+
+
+def _stream_pdf(url: str, write) -> str:
+    """PDFをストリーミングで取得してチャンクごとにwriteへ渡し、SHA-256を返す"""
+    response = requests.get(url, timeout=60, stream=True)
+    response.raise_for_status()
+    
+    total_size = int(response.headers.get('content-length', 0))
+    downloaded_size = 0
+    digest = hashlib.sha256()
+    
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        if chunk:
+            write(chunk)
+            digest.update(chunk)
+            downloaded_size += len(chunk)
+            report_progress(url, downloaded_size, total_size)
+    
+    report_progress(url, downloaded_size, total_size, final=True)
+    return digest.hexdigest()
 
 
-def download_pdf(url: str, output_path: str) -> None:
-    """PDFファイルをダウンロードする"""
+def download_pdf(url: str, output_path: str) -> str:
+    """PDFファイルをダウンロードする（SHA-256を返す）"""
     try:
-        print(f"  📥 ダウンロード中: {url}")
-        response = requests.get(url, timeout=60, stream=True)
-        response.raise_for_status()
-        
-        total_size = int(response.headers.get('content-length', 0))
-        downloaded_size = 0
-        
+        report(f"  📥 ダウンロード中: {url}")
         with open(output_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    downloaded_size += len(chunk)
-                    if total_size > 0:
-                        progress = (downloaded_size / total_size) * 100
-                        print(f"\r  進捗: {progress:.1f}%", end="", flush=True)
-        
-        print()  # 改行
+            sha256 = _stream_pdf(url, f.write)
+        
         file_size = os.path.getsize(output_path) / (1024 * 1024)
-        print(f"  ✅ ダウンロード完了 ({file_size:.2f} MB)")
+        report(f"  ✅ ダウンロード完了 ({file_size:.2f} MB)", event="download_complete",
+               url=url, bytes=os.path.getsize(output_path))
+        return sha256
+    except requests.exceptions.RequestException as e:
+        report(f"\n  ❌ ダウンロードエラー: {e}", level="error")
+        raise
+
+
+def download_pdf_to_memory(url: str) -> tuple[io.BytesIO, str]:
+    """PDFファイルをメモリ上にダウンロードする（バッファとSHA-256を返す）"""
+    try:
+        report(f"  📥 ダウンロード中（メモリ）: {url}")
+        buffer = io.BytesIO()
+        sha256 = _stream_pdf(url, buffer.write)
+        buffer.seek(0)
+        
+        file_size = buffer.getbuffer().nbytes / (1024 * 1024)
+        report(f"  ✅ ダウンロード完了 ({file_size:.2f} MB)", event="download_complete",
+               url=url, bytes=buffer.getbuffer().nbytes)
+        return buffer, sha256
     except requests.exceptions.RequestException as e:
-        print(f"\n  ❌ ダウンロードエラー: {e}")
+        report(f"\n  ❌ ダウンロードエラー: {e}", level="error")
         raise
 
 
+@contextmanager
+def memory_pdf_source(buffer: io.BytesIO):
+    """メモリ上のPDFを変換器に渡せる形で提供する
+
+    Linuxではmemfd（ファイルシステムに現れないメモリ上のファイル）を作成し、
+    そのパスを返す。memfdが使えない環境ではBytesIOをそのまま返す
+    （marker-pdfがBytesIOを受け付ける）。
+    """
+    if not hasattr(os, "memfd_create") or not os.path.isdir("/proc/self/fd"):
+        buffer.seek(0)
+        yield buffer
+        return
+    
+    fd = os.memfd_create("scrum-guide-pdf")
+    try:
+        with os.fdopen(os.dup(fd), "wb") as f:
+            f.write(buffer.getbuffer())
+        # pdftextのワーカープロセスからも開けるよう、PID付きのパスを渡す
+        yield f"/proc/{os.getpid()}/fd/{fd}"
+    finally:
+        os.close(fd)
+
+
 def optimize_markdown_content(content: str) -> str:
     """Markdownコンテンツを最適化"""
     lines = content.split('\n')
@@ -139,7 +303,7 @@ def optimize_markdown_file(md_path: str) -> tuple[int, int]:
     path = Path(md_path)
     
     if not path.exists():
-        print(f"  ⚠️  ファイルが見つかりません: {md_path}")
+        report(f"  ⚠️  ファイルが見つかりません: {md_path}", level="warning")
         return 0, 0
     
     # 元のサイズを取得
@@ -147,7 +311,7 @@ def optimize_markdown_file(md_path: str) -> tuple[int, int]:
     
     # バックアップを作成
     backup_path = backup_markdown_file(md_path)
-    print(f"  💾 バックアップ作成: {backup_path}")
+    report(f"  💾 バックアップ作成: {backup_path}")
     
     # ファイルを読み込み
     with open(path, 'r', encoding='utf-8') as f:
@@ -160,12 +324,222 @@ def optimize_markdown_file(md_path: str) -> tuple[int, int]:
     with open(path, 'w', encoding='utf-8') as f:
         f.write(optimized_content)
     
+    # 見出しごとのバイト位置の索引を内容に合わせて更新
+    write_section_index(path)
+    
     # 新しいサイズを取得
     new_size = path.stat().st_size
     
     return original_size, new_size
 
 
+CHAPTER_INDEX_NAME = "index.md"
+ANCHOR_ID_RE = re.compile(r'\bid="([^"]+)"')
+ANCHOR_LINK_RE = re.compile(r'\]\(#([^)\s]+)\)')
+
+
+def should_split_chapters(pdf_info: dict, args) -> bool:
+    """章ごとに分割するか（--split-chapters、またはconfig.jsonのsplit_chapters）"""
+    return bool(getattr(args, "split_chapters", False) or pdf_info.get("split_chapters", False))
+
+
+def get_chapter_dir(md_path: str | Path) -> Path:
+    """分割した章のファイルを置くディレクトリ（Markdownと同じ場所の同名ディレクトリ）"""
+    path = Path(md_path)
+    return path.with_name(path.stem)
+
+
+def list_chapter_files(md_path: str | Path) -> list[Path]:
+    """分割済みの目次ページと章のファイルを返す（分割していない場合は空）"""
+    chapter_dir = get_chapter_dir(md_path)
+    if not (chapter_dir / CHAPTER_INDEX_NAME).exists():
+        return []
+    return sorted(chapter_dir.glob("*.md"))
+
+
+def _chapter_level(sections: list[dict]) -> int | None:
+    """2つ以上の見出しがある最も浅いレベルを章のレベルとする"""
+    levels = [s["level"] for s in sections if s["level"]]
+    return next((level for level in sorted(set(levels)) if levels.count(level) >= 2), None)
+
+
+def _rebase_image_paths(text: str, source_dir: Path, target_dir: Path) -> str:
+    """画像の相対パスを、移動先のファイルからの相対パスに書き換える"""
+    def rebase(match):
+        alt, ref = match.group(1), match.group(2)
+        if re.match(r'^[a-z][a-z0-9+.-]*:|^/', ref, re.IGNORECASE):
+            return match.group(0)
+        return f"![{alt}]({Path(os.path.relpath(source_dir / ref, target_dir)).as_posix()})"
+    return IMAGE_REF_RE.sub(rebase, text)
+
+
+def get_document_title(config: dict, md_path: str | Path) -> str | None:
+    """config.jsonで出力ファイル名に対応するPDFの名前を取得する"""
+    name = Path(md_path).name
+    return next((p.get("name") for p in config.get("pdfs", []) if p.get("output_filename") == name), None)
+
+
+def split_markdown_chapters(md_path: str | Path, title: str | None = None) -> list[Path]:
+    """Markdownを章ごとのファイルと、各章へのリンクを並べた目次ページに分割する
+
+    分割後のファイルはMarkdownと同名のディレクトリに置き、画像の相対パスと
+    章をまたぐページ内リンク（#id）を書き換える。元のMarkdownはそのまま残す。
+    """
+    path = Path(md_path)
+    sections = split_markdown_sections(path.read_text(encoding="utf-8"))
+    level = _chapter_level(sections)
+    
+    preamble, chapters = [], []
+    for section in sections:
+        if level is not None and section["level"] == level:
+            chapters.append([section])
+        elif chapters and section["level"] > (level or 0):
+            chapters[-1].append(section)
+        elif chapters:
+            # 章より浅い見出しは独立した章として扱う
+            chapters.append([section])
+        else:
+            preamble.append(section)
+    
+    chapter_dir = get_chapter_dir(path)
+    if chapter_dir.exists():
+        for old_file in chapter_dir.glob("*.md"):
+            old_file.unlink()
+    chapter_dir.mkdir(parents=True, exist_ok=True)
+    
+    names = [f"chapter-{number:02d}.md" for number in range(1, len(chapters) + 1)]
+    texts = ["\n".join(s["text"] for s in chapter) for chapter in chapters]
+    anchors = {anchor: name for name, text in zip(names, texts) for anchor in ANCHOR_ID_RE.findall(text)}
+    
+    written = []
+    for name, text in zip(names, texts):
+        text = _rebase_image_paths(text, path.parent, chapter_dir)
+        text = ANCHOR_LINK_RE.sub(
+            lambda m: m.group(0) if anchors.get(m.group(1), name) == name
+            else f"]({anchors[m.group(1)]}#{m.group(1)})", text)
+        (chapter_dir / name).write_text(text.rstrip("\n") + "\n", encoding="utf-8")
+        written.append(chapter_dir / name)
+    
+    # 最初の章より前の部分（表紙・目次など）は目次ページの冒頭に置く
+    intro = "\n".join(s["text"] for s in preamble).strip()
+    lines = [] if intro.startswith("#") else [f"# {title or path.stem}", ""]
+    if intro:
+        lines += [_rebase_image_paths(intro, path.parent, chapter_dir), ""]
+    lines += [f"{number}. [{strip_inline_markup(chapter[0]['heading'])}]({name})"
+              for number, (name, chapter) in enumerate(zip(names, chapters), start=1)]
+    lines += ["", f"[全文]({Path(os.path.relpath(path, chapter_dir)).as_posix()})"]
+    (chapter_dir / CHAPTER_INDEX_NAME).write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return [chapter_dir / CHAPTER_INDEX_NAME, *written]
+
+
+SECTION_INDEX_VERSION = 1
+
+
+def get_section_index_path(md_path: str | Path) -> Path:
+    """Markdownの横に置く見出し索引（サイドカー）のパスを取得する"""
+    path = Path(md_path)
+    return path.with_name(f"{path.stem}.index.json")
+
+
+def build_section_index(data: bytes) -> list[dict]:
+    """Markdownのバイト列から、見出しごとのバイト範囲と行範囲を求める
+
+    byte_end・line_endは次の見出しまで、subtree_byte_end・subtree_line_endは
+    同じか上位のレベルの次の見出しまで（下位の節を含む章全体）の範囲。
+    行番号は1始まりで、終了位置は含まない。
+    """
+    sections = []
+    stack = []
+    in_code = False
+    offset = 0
+    line_count = 0
+    for line_count, raw in enumerate(data.splitlines(keepends=True), start=1):
+        line = raw.decode("utf-8").rstrip("\r\n")
+        if line.lstrip().startswith(("```", "~~~")):
+            in_code = not in_code
+        match = None if in_code else HEADING_RE.match(line)
+        if match:
+            level = len(match.group(1))
+            heading = strip_inline_markup(match.group(2))
+            stack = [h for h in stack if h[0] < level] + [(level, heading)]
+            sections.append({"heading": heading, "level": level,
+                             "path": " > ".join(h for _, h in stack),
+                             "byte_start": offset, "line_start": line_count})
+        offset += len(raw)
+    
+    end = {"byte": offset, "line": line_count + 1}
+    for i, section in enumerate(sections):
+        following = sections[i + 1] if i + 1 < len(sections) else None
+        section["byte_end"] = following["byte_start"] if following else end["byte"]
+        section["line_end"] = following["line_start"] if following else end["line"]
+        subtree_end = next((s for s in sections[i + 1:] if s["level"] <= section["level"]), None)
+        section["subtree_byte_end"] = subtree_end["byte_start"] if subtree_end else end["byte"]
+        section["subtree_line_end"] = subtree_end["line_start"] if subtree_end else end["line"]
+    return sections
+
+
+def write_section_index(md_path: str | Path) -> Path:
+    """見出し索引を書き出す（内容のハッシュと更新日時が同じなら書き換えない）
+
+    内容が同じで更新日時だけが変わった場合は、見出しの範囲を作り直さずに更新日時のみ記録し直す。
+    """
+    path = Path(md_path)
+    mtime_ns = path.stat().st_mtime_ns
+    data = path.read_bytes()
+    sha256 = hashlib.sha256(data).hexdigest()
+    index_path = get_section_index_path(path)
+    existing = load_section_index(path)
+    if existing and existing["sha256"] == sha256:
+        if existing.get("mtime_ns") == mtime_ns:
+            return index_path
+        sections = existing["sections"]
+    else:
+        sections = build_section_index(data)
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SECTION_INDEX_VERSION, "file": path.name, "size": len(data),
+                   "mtime_ns": mtime_ns, "sha256": sha256, "sections": sections},
+                  f, ensure_ascii=False, indent=2)
+    return index_path
+
+
+def load_section_index(md_path: str | Path) -> dict | None:
+    """見出し索引を読み込む（存在しない・壊れている・形式が古い場合はNone）"""
+    try:
+        with open(get_section_index_path(md_path), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not isinstance(index, dict) or index.get("version") != SECTION_INDEX_VERSION:
+        return None
+    return index
+
+
+def read_section(md_path: str | Path, heading: str, subtree: bool = True) -> str | None:
+    """見出し索引を使い、指定した見出し（見出しまたは見出しパス）の範囲だけを読み込む
+
+    索引がない、またはファイルのサイズ・更新日時が索引と異なる場合は、内容のハッシュを
+    確認して索引を作り直す（同じサイズのまま書き換えられた場合に古い範囲を使わないため）。
+    """
+    path = Path(md_path)
+    index = load_section_index(path)
+    stat = path.stat()
+    if index is None or (index["size"], index.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns):
+        write_section_index(path)
+        index = load_section_index(path)
+    key = _heading_key(heading)
+    section = next((s for s in index["sections"] if _heading_key(s["path"]) == key), None) \
+        or next((s for s in index["sections"] if _heading_key(s["heading"]) == key), None)
+    if section is None:
+        return None
+    end = section["subtree_byte_end"] if subtree else section["byte_end"]
+    with open(path, "rb") as f:
+        f.seek(section["byte_start"])
+        return f.read(end - section["byte_start"]).decode("utf-8")
+
+
+IMAGE_REF_RE = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+
 def verify_images(md_path: str, image_dir: str) -> dict:
     """画像参照の検証"""
     result = {
@@ -177,7 +551,7 @@ def verify_images(md_path: str, image_dir: str) -> dict:
     
     with open(md_path, 'r', encoding='utf-8') as f:
         content = f.read()
-        image_refs = re.findall(r'!\[([^\]]*)\]\(([^)]+)\)', content)
+        image_refs = IMAGE_REF_RE.findall(content)
         
         for alt, path in image_refs:
             result['references'].append((alt, path))
@@ -192,200 +566,3801 @@ def verify_images(md_path: str, image_dir: str) -> dict:
     return result
 
 
-def convert_pdf_to_markdown(pdf_path: str, output_md_path: str, image_dir: str) -> None:
-    """marker-pdfを使用してPDFをMarkdownに変換する"""
+def get_page_count(metadata) -> int | None:
+    """marker-pdfのメタデータからページ数を取得する"""
+    if not isinstance(metadata, dict):
+        return None
+    
+    page_stats = metadata.get('page_stats')
+    # marker-pdf 1.x以降はページごとの統計リスト、旧形式は{'pages': N}
+    if isinstance(page_stats, list):
+        return len(page_stats)
+    if isinstance(page_stats, dict):
+        return page_stats.get('pages')
+    return None
+
+
+THREAD_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+)
+
+
+def configure_threads(threads: int) -> None:
+    """torch/OpenMP/MKLのスレッド数を設定する（モデル読み込み前に呼び出す）"""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    
     try:
-        print(f"  🔄 Markdown変換中...")
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def resolve_thread_budget(jobs: int, threads_per_job: int | None,
+                          cpu_budget: int | None = None) -> tuple[int, int]:
+    """並列数とCPUコア予算からワーカーあたりのスレッド数を決定する"""
+    budget = cpu_budget or os.cpu_count() or 1
+    jobs = max(1, jobs)
+    if not threads_per_job:
+        threads_per_job = max(1, budget // jobs)
+    if jobs * threads_per_job > budget:
+        report(f"⚠️  警告: {jobs}ジョブ × {threads_per_job}スレッドが"
+               f"CPUコア予算({budget})を超えています", level="warning")
+    return jobs, threads_per_job
+
+
+# 変換プロファイル（marker-pdfの設定キーに対応。未指定のキーはmarker-pdfの既定値）
+CONVERSION_PROFILES = {
+    "fast": {
+        "mode": "fast",
+        "lowres_image_dpi": 72,
+        "highres_image_dpi": 144,
+        "extract_images": False,
+        "ocr_error_batch_size": 4,
+        "disabled_processors": [
+            "EquationProcessor",
+            "TableProcessor",
+            "DocumentTOCProcessor",
+            "FootnoteProcessor",
+            "LineNumbersProcessor",
+            "ReferenceProcessor",
+            "DebugProcessor",
+        ],
+    },
+    "balanced": {},
+    "accurate": {
+        "mode": "balanced",
+        "lowres_image_dpi": 144,
+        "highres_image_dpi": 288,
+        "extract_images": True,
+        "ocr_error_batch_size": 1,
+    },
+}
+
+
+# 変換設定を受け付けるmarker-pdfの構成要素（既定の処理器はPdfConverter.default_processorsから取得）
+MARKER_SETTING_SOURCES = (
+    ("marker.converters.pdf", "PdfConverter"),
+    ("marker.providers.pdf", "PdfProvider"),
+    ("marker.builders.document", "DocumentBuilder"),
+    ("marker.builders.layout", "LayoutBuilder"),
+    ("marker.builders.line", "LineBuilder"),
+    ("marker.builders.ocr", "OcrBuilder"),
+    ("marker.builders.structure", "StructureBuilder"),
+    ("marker.renderers.markdown", "MarkdownRenderer"),
+)
+_marker_setting_names = None
+
+
+def marker_setting_names() -> set[str] | None:
+    """marker-pdfの構成要素が設定として受け付けるキー（クラス属性の型注釈）の集合を返す
+
+    構成要素を読み込めない場合はNoneを返す。
+    """
+    global _marker_setting_names
+    if _marker_setting_names is None:
+        import importlib
+        try:
+            classes = [getattr(importlib.import_module(module), name) for module, name in MARKER_SETTING_SOURCES]
+        except (ImportError, AttributeError):
+            return None
+        classes += list(getattr(classes[0], "default_processors", ()))
+        _marker_setting_names = {key for cls in classes for klass in cls.__mro__
+                                 for key in vars(klass).get("__annotations__", {})}
+    return _marker_setting_names
+
+
+def unknown_converter_settings(converter_config: dict) -> list[str]:
+    """marker-pdfのどの構成要素にも対応しない設定キーを返す（disabled_processorsは本スクリプトで処理）"""
+    known = marker_setting_names()
+    if known is None:
+        return []
+    return sorted(key for key in converter_config if key != "disabled_processors" and key not in known)
+
+
+def resolve_conversion_profile(pdf_info: dict, args) -> str | None:
+    """PDFに適用する変換プロファイル名を決定する（config.jsonの指定がCLIより優先）"""
+    name = pdf_info.get("profile") or getattr(args, "conversion_profile", None)
+    if name and name not in CONVERSION_PROFILES:
+        raise ValueError(f"不明な変換プロファイル: {name} "
+                         f"(利用可能: {', '.join(CONVERSION_PROFILES)})")
+    return name
+
+
+def build_converter_config(pdf_info: dict, args) -> dict:
+    """marker-pdfの変換器に渡す設定を組み立てる"""
+    converter_config = {}
+    
+    profile = resolve_conversion_profile(pdf_info, args)
+    if profile:
+        converter_config.update(CONVERSION_PROFILES[profile])
+    # config.jsonのconverter_optionsでプロファイルの個別の値を上書きできる
+    converter_config.update(pdf_info.get("converter_options", {}))
+    
+    if getattr(args, "no_images", False):
+        # 画像の切り出し・エンコードを行わない
+        converter_config["extract_images"] = False
+    
+    threads = getattr(args, "threads_per_job", None)
+    if threads:
+        # pdftextのテキスト抽出ワーカー数もスレッド予算に合わせる
+        converter_config["pdftext_workers"] = threads
+    
+    unknown = unknown_converter_settings(converter_config)
+    if unknown:
+        report(f"⚠️  警告: marker-pdfに存在しない設定は無視されます: {', '.join(unknown)}",
+               level="warning", event="unknown_converter_settings", keys=unknown)
+    
+    return converter_config
+
+
+def create_pdf_converter(artifact_dict: dict, converter_config: dict | None = None):
+    """設定からmarker-pdfの変換器を作成する（disabled_processorsの処理器は除外）"""
+    # marker側で設定が書き換えられるためコピーを渡す
+    config = dict(converter_config or {})
+    disabled = config.pop("disabled_processors", None)
+    if not disabled:
+        return PdfConverter(artifact_dict=artifact_dict, config=config)
+    
+    processor_list = [
+        f"{cls.__module__}.{cls.__name__}"
+        for cls in PdfConverter.default_processors
+        if cls.__name__ not in disabled
+    ]
+    return PdfConverter(artifact_dict=artifact_dict, processor_list=processor_list, config=config)
+
+
+def replace_images_with_placeholders(markdown_text: str) -> str:
+    """画像参照と画像の説明文を代替テキストのプレースホルダーに置き換える"""
+    def placeholder(alt: str) -> str:
+        alt = alt.strip()
+        return f"*[画像: {alt}]*" if alt else "*[画像]*"
+    
+    markdown_text = re.sub(r'!\[([^\]]*)\]\([^)]*\)', lambda m: placeholder(m.group(1)), markdown_text)
+    # marker-pdfは画像を抽出しない場合、説明文のみを出力する
+    return re.sub(r'Image \S+ description: ([^\n]+)', lambda m: placeholder(m.group(1)), markdown_text)
+
+
+def save_images(images: dict, output_md_path: str, image_dir: str) -> dict:
+    """画像をPNGとして保存し、PDF内の画像名から保存先パスへの対応を返す"""
+    report(f"  🖼️  画像を保存中... ({len(images)}枚)")
+    Path(image_dir).mkdir(parents=True, exist_ok=True)
+    
+    image_mapping = {}
+    base_name = Path(output_md_path).stem
+    for idx, (img_name, img_data) in enumerate(images.items()):
+        img_filename = f"{base_name}_image_{idx + 1}.png"
+        img_path = os.path.join(image_dir, img_filename)
         
-        # marker-pdfの変換器を初期化
-        converter = PdfConverter(
-            artifact_dict=create_model_dict(),
-        )
+        # img_dataがPIL Imageの場合、bytesに変換
+        if hasattr(img_data, 'save'):
+            # PIL Imageの場合
+            img_data.save(img_path, 'PNG')
+        else:
+            # bytesの場合
+            with open(img_path, "wb") as img_file:
+                img_file.write(img_data)
         
-        # PDFを変換
-        rendered = converter(pdf_path)
-        markdown_text, metadata, images = text_from_rendered(rendered)
+        # マッピングを作成: PDF内の画像名 -> 保存したファイル名
+        image_mapping[img_name] = f"images/{img_filename}"
+    
+    report(f"  ✅ 画像保存完了: {len(images)}枚")
+    return image_mapping
+
+
+def save_markdown_with_images(markdown_text: str, images: dict | None,
+                              output_md_path: str, image_dir: str,
+                              extract_images: bool = True) -> None:
+    """Markdownを保存し、画像の保存と画像参照パスの修正を行う
+
+    extract_imagesがFalseの場合は画像を保存せず、画像参照をプレースホルダーに置き換える。
+    """
+    if not extract_images:
+        markdown_text = replace_images_with_placeholders(markdown_text)
+        images = None
+    
+    # Markdownファイルを保存
+    with open(output_md_path, "w", encoding="utf-8") as f:
+        f.write(markdown_text)
+    
+    report(f"  ✅ Markdown保存完了: {output_md_path}", event="markdown_saved", path=output_md_path)
+    
+    # 画像を保存し、名前マッピングを作成
+    image_mapping = {}
+    if images:
+        with pipeline_stage("images", {"count": len(images)}):
+            image_mapping = save_images(images, output_md_path, image_dir)
+    else:
+        report(f"  ℹ️  画像なし")
+    
+    # Markdown内の画像参照を修正
+    if image_mapping:
+        report(f"  🔧 画像参照を修正中...")
+        with open(output_md_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        
+        # 画像参照のパターンを置換
+        for old_name, new_path in image_mapping.items():
+            pattern = r'!\[\]\(' + re.escape(old_name) + r'\)'
+            replacement = f'![{old_name}]({new_path})'
+            content = re.sub(pattern, replacement, content)
         
-        # Markdownファイルを保存
+        # 更新した内容を保存
         with open(output_md_path, "w", encoding="utf-8") as f:
-            f.write(markdown_text)
+            f.write(content)
         
-        print(f"  ✅ Markdown保存完了: {output_md_path}")
+        report(f"  ✅ 画像参照修正完了")
+
+
+# レンダリングのみに影響し、レイアウト・OCR結果には影響しない設定キー
+RENDER_ONLY_KEYS = (
+    "paginate_output",
+    "page_separator",
+    "html_tables_in_markdown",
+    "inline_math_delimiters",
+    "block_math_delimiters",
+    "pdftext_workers",
+)
+
+
+def get_marker_version() -> str:
+    """インストールされているmarker-pdfのバージョンを取得する"""
+    from importlib.metadata import PackageNotFoundError, version
+    
+    try:
+        return version("marker-pdf")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def get_document_cache_path(config: dict, sha256: str, converter_config: dict | None = None) -> Path:
+    """中間ドキュメントのキャッシュパス（PDFのハッシュ・marker-pdfのバージョン・構築設定ごと）"""
+    build_config = {k: v for k, v in (converter_config or {}).items() if k not in RENDER_ONLY_KEYS}
+    key_source = json.dumps({"marker": get_marker_version(), "config": build_config},
+                            sort_keys=True, default=str)
+    key = hashlib.sha256(key_source.encode("utf-8")).hexdigest()[:16]
+    return Path(config.get("cache_dir", "cache")) / "documents" / f"{sha256}-{key}.pkl"
+
+
+def _document_index_path(config: dict) -> Path:
+    return Path(config.get("cache_dir", "cache")) / "documents" / "index.json"
+
+
+def lookup_document_sha256(config: dict, url: str) -> str | None:
+    """キャッシュ済みの中間ドキュメントからURLに対応するPDFのハッシュを探す"""
+    index_path = _document_index_path(config)
+    if not index_path.exists():
+        return None
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f).get(url)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+def register_document_sha256(config: dict, url: str, sha256: str) -> None:
+    """URLとPDFのハッシュの対応をキャッシュの索引に記録する"""
+    index_path = _document_index_path(config)
+    index = {}
+    if index_path.exists():
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            index = {}
+    index[url] = sha256
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = index_path.with_name(f"{index_path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def save_cached_document(document, cache_path: Path, extract_images: bool = True) -> None:
+    """marker-pdfの中間ドキュメント（レイアウト・認識済みテキスト）を保存する"""
+    for page in document.pages:
+        # 高解像度画像は必要時に元PDFから読み込まれるため、画像抽出時は先に読み込んでおく
+        if extract_images:
+            page.get_image(highres=True)
+        page._highres_loader = None
+    
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(document, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
+
+
+def load_cached_document(cache_path: Path):
+    """保存済みの中間ドキュメントを読み込む（存在しない・壊れている場合はNone）"""
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        report(f"  ⚠️  キャッシュを読み込めません: {e}", level="warning")
+        return None
+
+
+def render_document(document, converter_config: dict | None = None):
+    """中間ドキュメントをMarkdownにレンダリングする（モデルは使用しない）"""
+    return MarkdownRenderer(dict(converter_config or {}))(document)
+
+
+def convert_pdf_to_markdown(pdf_path: str | io.BytesIO | None, output_md_path: str, image_dir: str,
+                            converter_config: dict | None = None,
+                            document_cache: Path | None = None) -> dict:
+    """marker-pdfを使用してPDFをMarkdownに変換する（ページ数・画像数を返す）
+
+    document_cacheが指定された場合、キャッシュ済みの中間ドキュメントがあれば
+    モデルを使わずにレンダリングのみ行い、なければ構築した中間ドキュメントを保存する。
+    """
+    try:
+        document = load_cached_document(document_cache) if document_cache else None
+        loaded_from_cache = document is not None
         
-        # 画像を保存し、名前マッピングを作成
-        image_mapping = {}
-        if images:
-            print(f"  🖼️  画像を保存中... ({len(images)}枚)")
-            Path(image_dir).mkdir(parents=True, exist_ok=True)
-            
-            base_name = Path(output_md_path).stem
-            for idx, (img_name, img_data) in enumerate(images.items()):
-                img_filename = f"{base_name}_image_{idx + 1}.png"
-                img_path = os.path.join(image_dir, img_filename)
-                
-                # img_dataがPIL Imageの場合、bytesに変換
-                if hasattr(img_data, 'save'):
-                    # PIL Imageの場合
-                    img_data.save(img_path, 'PNG')
-                else:
-                    # bytesの場合
-                    with open(img_path, "wb") as img_file:
-                        img_file.write(img_data)
-                
-                # マッピングを作成: PDF内の画像名 -> 保存したファイル名
-                image_mapping[img_name] = f"images/{img_filename}"
-            
-            print(f"  ✅ 画像保存完了: {len(images)}枚")
+        if document is not None:
+            report(f"  ♻️  キャッシュからレンダリング中...")
+            rendered = render_document(document, converter_config)
+        elif document_cache:
+            report(f"  🔄 Markdown変換中...")
+            converter = create_pdf_converter(create_model_dict(), converter_config)
+            with converter.filepath_to_str(pdf_path) as filepath:
+                document = converter.build_document(filepath)
+                save_cached_document(document, document_cache,
+                                     (converter_config or {}).get("extract_images", True))
+            report(f"  💾 中間ドキュメントを保存しました: {document_cache}")
+            rendered = render_document(document, converter_config)
         else:
-            print(f"  ℹ️  画像なし")
-        
-        # Markdown内の画像参照を修正
-        if image_mapping:
-            print(f"  🔧 画像参照を修正中...")
-            with open(output_md_path, "r", encoding="utf-8") as f:
-                content = f.read()
+            report(f"  🔄 Markdown変換中...")
             
-            # 画像参照のパターンを置換
-            for old_name, new_path in image_mapping.items():
-                pattern = r'!\[\]\(' + re.escape(old_name) + r'\)'
-                replacement = f'![{old_name}]({new_path})'
-                content = re.sub(pattern, replacement, content)
+            # marker-pdfの変換器を初期化
+            converter = create_pdf_converter(create_model_dict(), converter_config)
             
-            # 更新した内容を保存
-            with open(output_md_path, "w", encoding="utf-8") as f:
-                f.write(content)
-            
-            print(f"  ✅ 画像参照修正完了")
+            # PDFを変換
+            rendered = converter(pdf_path)
+        markdown_text, metadata, images = text_from_rendered(rendered)
+        
+        # Markdownと画像を保存
+        save_markdown_with_images(markdown_text, images, output_md_path, image_dir,
+                                  (converter_config or {}).get("extract_images", True))
         
         # メタデータ情報を表示
+        page_count = get_page_count(metadata)
         if metadata and isinstance(metadata, dict):
-            print(f"  📊 ページ数: {metadata.get('page_stats', {}).get('pages', 'N/A')}")
+            report(f"  📊 ページ数: {page_count if page_count is not None else 'N/A'}")
         elif metadata:
-            print(f"  📊 メタデータ: {type(metadata)}")
+            report(f"  📊 メタデータ: {type(metadata)}")
+        
+        return {
+            'pages': page_count,
+            'images': len(images) if images else 0,
+            'cache_hit': loaded_from_cache,
+        }
         
     except Exception as e:
-        print(f"  ❌ 変換エラー: {e}")
+        report(f"  ❌ 変換エラー: {e}", level="error")
         raise
 
 
-def format_duration(seconds: float) -> str:
-    """処理時間を人間が読みやすい形式にフォーマットする"""
-    if seconds < 60:
-        return f"{seconds:.1f}秒"
-    elif seconds < 3600:
-        minutes = seconds / 60
-        return f"{minutes:.1f}分"
-    else:
-        hours = seconds / 3600
-        return f"{hours:.1f}時間"
+TEXT_LAYER_MIN_CHARS = 80
+TEXT_LAYER_MAX_IMAGE_RATIO = 0.05
+TEXT_LAYER_MAX_GARBLED_RATIO = 0.02
 
 
-def process_pdf(pdf_info: dict, config: dict, args, index: int, total: int) -> bool:
-    """1つのPDFを処理する"""
-    name = pdf_info["name"]
-    url = pdf_info["url"]
-    output_filename = pdf_info["output_filename"]
-    
-    print(f"\n{'='*70}")
-    print(f"📄 [{index}/{total}] {name}")
-    print(f"{'='*70}")
+def _open_pdfium(pdf_source: str | io.BytesIO):
+    """pypdfium2でPDFを開く（marker-pdfの依存パッケージ）"""
+    import pypdfium2 as pdfium
     
-    start_time = time.time()
+    if isinstance(pdf_source, io.BytesIO):
+        return pdfium.PdfDocument(pdf_source.getvalue())
+    return pdfium.PdfDocument(pdf_source)
+
+
+def classify_pdf_pages(pdf_source: str | io.BytesIO) -> list[dict]:
+    """各ページをテキストレイヤーで抽出できるか（'text'）、モデル処理が必要か（'model'）に分類する
+
+    文字数が少ないページはスキャン画像、文字化けの多いページは
+    テキストレイヤーが壊れているとみなし、一定以上の面積の画像を含む
+    ページは画像抽出が必要なためモデル処理に回す。
+    """
+    import pypdfium2.raw as pdfium_c
     
-    # 一時PDFファイルのパス
-    temp_pdf = os.path.join(config.get("temp_dir", "temp"), f"temp_{index}.pdf")
+    pdf = _open_pdfium(pdf_source)
+    classification = []
+    try:
+        for index in range(len(pdf)):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            chars = [c for c in text if not c.isspace()]
+            garbled = sum(1 for c in chars if c == '\ufffd' or '\ue000' <= c <= '\uf8ff')
+            
+            page_area = page.get_width() * page.get_height()
+            image_area = 0.0
+            for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_IMAGE]):
+                left, bottom, right, top = obj.get_pos()
+                image_area += max(0.0, right - left) * max(0.0, top - bottom)
+            image_ratio = image_area / page_area if page_area else 0.0
+            
+            if len(chars) < TEXT_LAYER_MIN_CHARS:
+                path, reason = "model", "scanned"
+            elif garbled / len(chars) > TEXT_LAYER_MAX_GARBLED_RATIO:
+                path, reason = "model", "garbled"
+            elif image_ratio > TEXT_LAYER_MAX_IMAGE_RATIO:
+                path, reason = "model", "images"
+            else:
+                path, reason = "text", "text-layer"
+            classification.append({"page": index, "path": path, "reason": reason})
+            
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
     
-    # 出力Markdownファイルのパス
-    output_md = os.path.join(config.get("output_dir", "docs"), output_filename)
+    return classification
+
+
+def _page_text_lines(page) -> list[tuple[str, float]]:
+    """ページのテキストを行単位で取得する（行頭の文字のフォントサイズ付き）"""
+    import pypdfium2.raw as pdfium_c
     
+    textpage = page.get_textpage()
     try:
-        # PDFをダウンロード
-        download_start = time.time()
-        download_pdf(url, temp_pdf)
-        download_time = time.time() - download_start
-        print(f"  ⏱️  ダウンロード時間: {format_duration(download_time)}")
+        text = textpage.get_text_range()
+        # 生成された改行を含めて文字インデックスと一致する場合のみフォントサイズを取得
+        sizes_available = len(text) == textpage.count_chars()
+        lines = []
+        for match in re.finditer(r'[^\r\n]+', text):
+            line = match.group(0)
+            stripped = line.strip()
+            if not stripped:
+                continue
+            size = 0.0
+            if sizes_available:
+                first = match.start() + (len(line) - len(line.lstrip()))
+                size = pdfium_c.FPDFText_GetFontSize(textpage.raw, first)
+            lines.append((stripped, size))
+        return lines
+    finally:
+        textpage.close()
+
+
+def _join_text_lines(lines: list[str]) -> str:
+    """行を連結する（英数字同士の境界のみ空白を挟む）"""
+    joined = ""
+    for line in lines:
+        if joined and joined[-1].isascii() and joined[-1].isalnum() \
+                and line[0].isascii() and line[0].isalnum():
+            joined += " "
+        joined += line
+    return joined
+
+
+def text_lines_to_markdown(lines: list[tuple[str, float]]) -> str:
+    """フォントサイズ付きの行からMarkdownを組み立てる
+
+    本文のフォントサイズ（文字数で重み付けした中央値）より十分大きい短い行を
+    見出しとし、箇条書き記号で始まる行をリスト項目、句点で終わる行を
+    段落の終わりとみなす。ページ番号のみの行は除去する。
+    """
+    sized = sorted((size, len(text)) for text, size in lines if size > 0)
+    body_size = 0.0
+    if sized:
+        half = sum(length for _, length in sized) / 2
+        cumulative = 0
+        for size, length in sized:
+            cumulative += length
+            if cumulative >= half:
+                body_size = size
+                break
+    
+    blocks = []
+    paragraph = []
+    
+    def flush() -> None:
+        if paragraph:
+            blocks.append(_join_text_lines(paragraph))
+            paragraph.clear()
+    
+    for text, size in lines:
+        if re.fullmatch(r'[-‐\s]*\d+[-‐\s]*', text):
+            continue
         
-        # Markdownに変換
-        convert_start = time.time()
-        convert_pdf_to_markdown(temp_pdf, output_md, config.get("image_dir", "docs/images"))
-        convert_time = time.time() - convert_start
-        print(f"  ⏱️  変換時間: {format_duration(convert_time)}")
+        level = 0
+        if body_size and size and len(text) <= 60:
+            if size >= body_size * 1.5:
+                level = 1
+            elif size >= body_size * 1.2:
+                level = 2
+        if level:
+            flush()
+            blocks.append(f"{'#' * level} {text}")
+            continue
         
-        # Markdownを最適化（デフォルトで実行、--no-optimizeで無効化可能）
-        if not args.no_optimize:
-            print(f"  🔧 Markdown最適化中...")
-            optimize_start = time.time()
-            original_size, new_size = optimize_markdown_file(output_md)
-            optimize_time = time.time() - optimize_start
+        bullet = re.match(r'^[●•・▪■◦○\-]\s*(.+)$', text)
+        if bullet:
+            flush()
+            blocks.append(f"- {bullet.group(1)}")
+            continue
+        
+        paragraph.append(text)
+        if text.endswith(('。', '．', '.', '：', ':')):
+            flush()
+    flush()
+    
+    return '\n\n'.join(blocks)
+
+
+def extract_text_layer_markdown(pdf_source: str | io.BytesIO, pages: list[int]) -> str:
+    """指定ページをテキストレイヤーから軽量に抽出してMarkdownにする"""
+    pdf = _open_pdfium(pdf_source)
+    try:
+        lines = []
+        for index in pages:
+            page = pdf[index]
+            lines.extend(_page_text_lines(page))
+            page.close()
+    finally:
+        pdf.close()
+    return text_lines_to_markdown(lines)
+
+
+def group_page_runs(classification: list[dict]) -> list[tuple[str, list[int]]]:
+    """同じ処理経路の連続するページをまとめる"""
+    runs = []
+    for entry in classification:
+        if runs and runs[-1][0] == entry["path"]:
+            runs[-1][1].append(entry["page"])
+        else:
+            runs.append((entry["path"], [entry["page"]]))
+    return runs
+
+
+def convert_pdf_hybrid(pdf_source: str | io.BytesIO, output_md_path: str, image_dir: str,
+                       converter_config: dict | None = None,
+                       model_seconds_per_page: float | None = None) -> dict:
+    """テキストレイヤーのあるページは軽量抽出し、スキャン・複雑なページのみmarker-pdfで変換する"""
+    report(f"  🔎 ページを分類中...")
+    classification = classify_pdf_pages(pdf_source)
+    text_pages = [c["page"] for c in classification if c["path"] == "text"]
+    model_pages = [c["page"] for c in classification if c["path"] == "model"]
+    report(f"  📑 テキスト抽出: {len(text_pages)}ページ / モデル処理: {len(model_pages)}ページ")
+    
+    if not text_pages:
+        return convert_pdf_to_markdown(pdf_source, output_md_path, image_dir, converter_config)
+    
+    try:
+        report(f"  🔄 Markdown変換中（ハイブリッド）...")
+        parts = []
+        images = {}
+        text_time = 0.0
+        model_time = 0.0
+        models = None
+        
+        for path, pages in group_page_runs(classification):
+            run_start = time.time()
+            if path == "text":
+                parts.append(extract_text_layer_markdown(pdf_source, pages))
+                text_time += time.time() - run_start
+                continue
             
-            if original_size > 0:
-                reduction = original_size - new_size
-                percentage = (reduction / original_size * 100) if original_size > 0 else 0
-                print(f"  ✅ 最適化完了: {reduction:,} bytes削減 ({percentage:.1f}%)")
-                print(f"  ⏱️  最適化時間: {format_duration(optimize_time)}")
-        
-        # 画像参照を検証（--verifyフラグが指定された場合）
-        if args.verify:
-            print(f"  🔍 画像参照を検証中...")
-            verify_result = verify_images(output_md, config.get("image_dir", "docs/images"))
-            if verify_result['references']:
-                print(f"  📊 画像参照数: {len(verify_result['references'])}枚")
-                print(f"  ✅ 検出: {len(verify_result['found'])}枚")
-                if verify_result['missing']:
-                    print(f"  ⚠️  見つからない: {len(verify_result['missing'])}枚")
-                    for missing in verify_result['missing']:
-                        print(f"     - {missing}")
+            # モデルは最初に必要になった時点で1回だけ読み込む
+            if models is None:
+                models = create_model_dict()
+            converter = create_pdf_converter(
+                models, {**(converter_config or {}), "page_range": pages})
+            markdown_part, _, run_images = text_from_rendered(converter(pdf_source))
+            parts.append(markdown_part)
+            images.update(run_images or {})
+            model_time += time.time() - run_start
         
-        # 一時PDFファイルを削除
-        if os.path.exists(temp_pdf):
-            os.remove(temp_pdf)
-            print(f"  🗑️  一時ファイル削除完了")
+        markdown_text = '\n\n'.join(p.strip() for p in parts if p.strip()) + '\n'
+        save_markdown_with_images(markdown_text, images, output_md_path, image_dir,
+                                  (converter_config or {}).get("extract_images", True))
         
-        # 合計処理時間
-        total_time = time.time() - start_time
-        print(f"  ⏱️  合計処理時間: {format_duration(total_time)}")
-        print(f"  ✅ 処理完了: {name}")
+        # 同じ文書のモデル処理実績、なければ処理履歴のページ単価で短縮時間を見積もる
+        if model_pages:
+            model_seconds_per_page = model_time / len(model_pages)
+        time_saved = None
+        if model_seconds_per_page:
+            time_saved = max(0.0, model_seconds_per_page * len(text_pages) - text_time)
         
-        return True
+        report(f"  📊 ページ数: {len(classification)} "
+               f"(テキスト抽出: {len(text_pages)}, モデル処理: {len(model_pages)})")
+        report(f"  ⏱️  テキスト抽出: {format_duration(text_time)} / "
+               f"モデル処理: {format_duration(model_time)}")
+        if time_saved is not None:
+            report(f"  ⚡ 推定短縮時間: {format_duration(time_saved)}")
         
+        return {
+            'pages': len(classification),
+            'images': len(images),
+            'pages_text': len(text_pages),
+            'pages_model': len(model_pages),
+            'text_time': text_time,
+            'model_time': model_time,
+            'time_saved': time_saved,
+        }
+    
     except Exception as e:
-        print(f"  ❌ 処理失敗: {name}")
-        print(f"  エラー詳細: {e}")
+        report(f"  ❌ 変換エラー: {e}", level="error")
+        raise
+
+
+def estimate_model_seconds_per_page(history: dict) -> float | None:
+    """処理履歴からモデル処理のページ単価（秒）を求める（全ページをモデル処理した実績のみ）"""
+    entries = [e for e in history.values()
+               if isinstance(e, dict) and e.get("convert_time") and e.get("pages")
+               and not e.get("pages_text")]
+    if not entries:
+        return None
+    return sum(e["convert_time"] for e in entries) / sum(e["pages"] for e in entries)
+
+
+def format_duration(seconds: float) -> str:
+    """処理時間を人間が読みやすい形式にフォーマットする"""
+    if seconds < 60:
+        return f"{seconds:.1f}秒"
+    elif seconds < 3600:
+        minutes = seconds / 60
+        return f"{minutes:.1f}分"
+    else:
+        hours = seconds / 3600
+        return f"{hours:.1f}時間"
+
+
+def get_history_path(config: dict) -> Path:
+    """処理履歴ファイルのパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "history.json"
+
+
+def load_history(history_path: str) -> dict:
+    """処理履歴を読み込む（存在しない・壊れている場合は空の履歴）"""
+    try:
+        with open(history_path, "r", encoding="utf-8") as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError as e:
+        report(f"⚠️  警告: 処理履歴の解析に失敗しました（無視します）: {e}", level="warning")
+        return {}
+    return history if isinstance(history, dict) else {}
+
+
+def save_history(history: dict, history_path: str) -> None:
+    """処理履歴を保存する（一時ファイル経由で置き換え）"""
+    path = Path(history_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def record_history(history: dict, name: str, metrics: dict) -> None:
+    """1件分の処理結果（ステージ別時間・ページ数・PDFサイズ）を履歴に反映する
+
+    高速テキスト抽出のページ数は変換方法ごとの値のため、変換した実行では
+    前回の値を引き継がずに置き換える（通常の変換では削除する）。
+    """
+    entry = history.setdefault(name, {})
+    for key in ("download_time", "convert_time", "optimize_time", "total_time",
+                "pages", "pdf_size", "peak_rss_mb", "baseline_rss_mb"):
+        if metrics.get(key) is not None:
+            entry[key] = metrics[key]
+    if metrics.get("convert_time") is not None:
+        for key in ("pages_text", "pages_model"):
+            if metrics.get(key) is not None:
+                entry[key] = metrics[key]
+            else:
+                entry.pop(key, None)
+    entry["runs"] = entry.get("runs", 0) + 1
+    entry["updated_at"] = datetime.now().isoformat(timespec='seconds')
+
+
+RUN_DOCUMENT_COLUMNS = (
+    "download_time", "convert_time", "optimize_time", "verify_time", "total_time",
+    "pdf_size", "output_size", "pages", "images", "pages_text", "pages_model",
+    "peak_rss_mb", "cache_hit",
+)
+REGRESSION_THRESHOLD = 20.0
+REGRESSION_BASELINE_RUNS = 5
+
+
+def get_run_history_db_path(config: dict) -> Path:
+    """実行履歴データベースのパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "runs.sqlite3"
+
+
+def open_run_history(db_path: str | Path) -> sqlite3.Connection:
+    """実行履歴データベースを開く（テーブルがなければ作成する）"""
+    path = Path(db_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    metric_columns = ", ".join(f"{column} REAL" for column in RUN_DOCUMENT_COLUMNS)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            started_at TEXT NOT NULL,
+            finished_at TEXT NOT NULL,
+            marker_version TEXT,
+            jobs INTEGER,
+            options TEXT,
+            succeeded INTEGER,
+            failed INTEGER,
+            total_time REAL
+        );
+        CREATE TABLE IF NOT EXISTS documents (
+            run_id INTEGER NOT NULL REFERENCES runs(id),
+            name TEXT NOT NULL,
+            success INTEGER NOT NULL,
+            {metric_columns},
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS documents_name ON documents(name, run_id);
+    """)
+    return conn
+
+
+def record_run(db_path: str | Path, results: list, run_info: dict) -> int:
+    """1回の実行と文書ごとの計測値を実行履歴データベースに追記する（実行IDを返す）"""
+    conn = open_run_history(db_path)
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO runs (started_at, finished_at, marker_version, jobs, options,"
+                " succeeded, failed, total_time) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (run_info.get("started_at"),
+                 run_info.get("finished_at", datetime.now().isoformat(timespec='seconds')),
+                 run_info.get("marker_version"), run_info.get("jobs"),
+                 json.dumps(run_info.get("options", {}), ensure_ascii=False, sort_keys=True),
+                 sum(1 for _, success, _ in results if success),
+                 sum(1 for _, success, _ in results if not success),
+                 run_info.get("total_time")),
+            )
+            run_id = cursor.lastrowid
+            placeholders = ", ".join("?" for _ in RUN_DOCUMENT_COLUMNS)
+            conn.executemany(
+                f"INSERT INTO documents (run_id, name, success, {', '.join(RUN_DOCUMENT_COLUMNS)}, error)"
+                f" VALUES (?, ?, ?, {placeholders}, ?)",
+                [(run_id, pdf_info["name"], int(success),
+                  *(metrics.get(column) for column in RUN_DOCUMENT_COLUMNS),
+                  None if success else metrics.get("error"))
+                 for pdf_info, success, metrics in results],
+            )
+    finally:
+        conn.close()
+    return run_id
+
+
+def load_document_trends(conn: sqlite3.Connection, limit: int = 10) -> dict:
+    """文書ごとに、成功した直近の実行の変換時間を古い順に取得する"""
+    rows = conn.execute(
+        "SELECT d.name, d.run_id, d.convert_time, d.total_time, d.pages, d.cache_hit,"
+        " r.started_at, r.marker_version"
+        " FROM documents d JOIN runs r ON r.id = d.run_id"
+        " WHERE d.success = 1 AND d.convert_time IS NOT NULL"
+        " ORDER BY d.name, d.run_id DESC"
+    ).fetchall()
+    trends = {}
+    for row in rows:
+        entries = trends.setdefault(row["name"], [])
+        if len(entries) < limit:
+            entries.append(dict(row))
+    return {name: list(reversed(entries)) for name, entries in trends.items()}
+
+
+def find_regressions(trends: dict, threshold: float = REGRESSION_THRESHOLD,
+                     baseline_runs: int = REGRESSION_BASELINE_RUNS) -> list[dict]:
+    """最新の変換時間が直前の実行の中央値よりthreshold%以上遅くなった文書を検出する
+
+    キャッシュから再レンダリングした実行はモデル処理を含まず比較できないため除外する。
+    """
+    regressions = []
+    for name, entries in trends.items():
+        entries = [e for e in entries if not e.get("cache_hit")]
+        if len(entries) < 2:
+            continue
+        latest = entries[-1]
+        baseline = sorted(e["convert_time"] for e in entries[-1 - baseline_runs:-1])
+        middle = len(baseline) // 2
+        median = (baseline[middle] if len(baseline) % 2
+                  else (baseline[middle - 1] + baseline[middle]) / 2)
+        if median <= 0:
+            continue
+        change = (latest["convert_time"] - median) / median * 100
+        if change > threshold:
+            regressions.append({
+                "document": name,
+                "convert_time": latest["convert_time"],
+                "baseline": median,
+                "change_percent": round(change, 1),
+                "marker_version": latest["marker_version"],
+                "baseline_marker_versions": sorted({e["marker_version"] or "unknown"
+                                                    for e in entries[-1 - baseline_runs:-1]}),
+            })
+    return sorted(regressions, key=lambda r: r["change_percent"], reverse=True)
+
+
+def history_report(config: dict, threshold: float = REGRESSION_THRESHOLD, limit: int = 10) -> list[dict]:
+    """実行履歴から直近の実行・文書ごとの変換時間の推移・劣化した文書を表示する"""
+    db_path = get_run_history_db_path(config)
+    if not db_path.exists():
+        report(f"⚠️  実行履歴がありません: {db_path}", level="warning")
+        return []
+    
+    conn = open_run_history(db_path)
+    try:
+        runs = conn.execute(
+            "SELECT * FROM runs ORDER BY id DESC LIMIT ?", (limit,)
+        ).fetchall()
+        trends = load_document_trends(conn, limit)
+    finally:
+        conn.close()
+    
+    report(f"\n{'='*70}")
+    report("📈 実行履歴")
+    report(f"{'='*70}")
+    report(f"{'実行日時':<21}{'成功':>6}{'失敗':>6}{'総処理時間':>12}  marker")
+    for run in reversed(runs):
+        report(f"{run['started_at']:<21}{run['succeeded']:>6}{run['failed']:>6}"
+               f"{format_duration(run['total_time'] or 0):>12}  {run['marker_version'] or '-'}",
+               event="history_run", run_id=run["id"], started_at=run["started_at"],
+               succeeded=run["succeeded"], failed=run["failed"],
+               total_time=run["total_time"], marker_version=run["marker_version"])
+    
+    report(f"\n📊 変換時間の推移（直近{limit}回、古い順、*はキャッシュからの再レンダリング）:")
+    for name, entries in sorted(trends.items()):
+        times = " → ".join(format_duration(e["convert_time"]) + ("*" if e["cache_hit"] else "")
+                           for e in entries)
+        report(f"  {name}: {times}", event="history_trend", document=name,
+               convert_times=[e["convert_time"] for e in entries])
+    
+    regressions = find_regressions(trends, threshold)
+    if regressions:
+        report(f"\n⚠️  変換時間が{threshold:g}%以上悪化した文書:", level="warning")
+        for r in regressions:
+            report(f"  - {r['document']}: {format_duration(r['convert_time'])}"
+                   f"（基準 {format_duration(r['baseline'])}、+{r['change_percent']}%、"
+                   f"marker {r['marker_version'] or '-'}）",
+                   event="history_regression", level="warning", **r)
+    else:
+        report(f"\n✅ 変換時間が{threshold:g}%以上悪化した文書はありません", level="result")
+    return regressions
+
+
+def probe_pdf_size(url: str) -> int:
+    """HEADリクエストでPDFサイズを取得する（取得できない場合は0）"""
+    try:
+        response = requests.head(url, timeout=10, allow_redirects=True)
+        response.raise_for_status()
+        return int(response.headers.get('content-length', 0))
+    except (requests.exceptions.RequestException, ValueError):
+        return 0
+
+
+DEFAULT_SECONDS_PER_MB = 60.0
+
+
+def estimate_job_cost(pdf_info: dict, history: dict) -> float:
+    """処理時間の見積もり（秒）を返す
+
+    履歴があればその実績時間を使用し、未処理のエントリは
+    他エントリの実績から求めたページ単価・バイト単価で推定する。
+    実績が全くない場合はデフォルトのMB単価（DEFAULT_SECONDS_PER_MB）で推定する。
+    """
+    entry = history.get(pdf_info["name"], {})
+    if entry.get("total_time"):
+        return float(entry["total_time"])
+
+    timed = [e for e in history.values()
+             if isinstance(e, dict) and e.get("total_time")]
+    paged = [e for e in timed if e.get("pages")]
+    sized = [e for e in timed if e.get("pdf_size")]
+
+    pages = entry.get("pages") or pdf_info.get("pages")
+    if pages and paged:
+        seconds_per_page = (sum(e["total_time"] for e in paged)
+                            / sum(e["pages"] for e in paged))
+        return pages * seconds_per_page
+
+    pdf_size = entry.get("pdf_size") or pdf_info.get("pdf_size") or 0
+    if pdf_size and sized:
+        seconds_per_byte = (sum(e["total_time"] for e in sized)
+                            / sum(e["pdf_size"] for e in sized))
+        return pdf_size * seconds_per_byte
+
+    return pdf_size / (1024 * 1024) * DEFAULT_SECONDS_PER_MB
+
+
+def schedule_pdfs(pdfs: list, history: dict, probe_sizes: bool = False) -> list:
+    """処理時間の長い順（Longest Job First）にPDFを並べ替える"""
+    if probe_sizes:
+        pdfs = [
+            {**pdf_info, "pdf_size": probe_pdf_size(pdf_info["url"])}
+            if pdf_info["name"] not in history and not pdf_info.get("pdf_size")
+            else pdf_info
+            for pdf_info in pdfs
+        ]
+    # sortedは安定ソートのため、見積もりが同じ場合はconfig.jsonの順序を維持
+    return sorted(pdfs, key=lambda p: estimate_job_cost(p, history), reverse=True)
+
+
+DEFAULT_JOB_MEMORY_MB = 4096
+DEFAULT_WORKER_MEMORY_MB = 1024
+
+
+def parse_memory_size(value: str) -> int:
+    """メモリサイズ指定（例: 8G, 512M, 4096）をMB単位に変換する"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"メモリサイズの形式が不正です: {value}")
+    number, unit = float(match.group(1)), match.group(2).upper()
+    factors = {"K": 1 / 1024, "": 1, "M": 1, "G": 1024, "T": 1024 * 1024}
+    return int(number * factors[unit])
+
+
+def estimate_job_memory(pdf_info: dict, history: dict) -> float:
+    """1ジョブのピークメモリ（MB）を見積もる
+
+    履歴に実測ピークRSSがあればそれを使用し、未処理のエントリは
+    他エントリの実測値から「固定分 + ページ数比例分」を最小二乗で推定する。
+    """
+    entry = history.get(pdf_info["name"], {})
+    if entry.get("peak_rss_mb"):
+        return float(entry["peak_rss_mb"])
+
+    samples = [(e["pages"], e["peak_rss_mb"]) for e in history.values()
+               if isinstance(e, dict) and e.get("pages") and e.get("peak_rss_mb")]
+    if not samples:
+        return float(DEFAULT_JOB_MEMORY_MB)
+
+    pages = entry.get("pages") or pdf_info.get("pages")
+    mean_pages = sum(p for p, _ in samples) / len(samples)
+    mean_rss = sum(r for _, r in samples) / len(samples)
+    if not pages:
+        return max(r for _, r in samples)
+
+    variance = sum((p - mean_pages) ** 2 for p, _ in samples)
+    slope = (sum((p - mean_pages) * (r - mean_rss) for p, r in samples) / variance
+             if variance > 0 else 0.0)
+    slope = max(slope, 0.0)
+    return max(mean_rss + slope * (pages - mean_pages), min(r for _, r in samples))
+
+
+def estimate_worker_memory(history: dict, args=None) -> float:
+    """ワーカープロセス1つの固定メモリ（インタプリタと読み込み済みライブラリ、MB）を見積もる
+
+    --worker-memoryの指定を優先し、なければ履歴の変換開始時RSSの最小値を使う
+    （同じプロセスで前の文書を処理した後の値は大きくなるため最小値を採る）。
+    """
+    configured = getattr(args, "worker_memory", None)
+    if configured:
+        return float(configured)
+    baselines = [e["baseline_rss_mb"] for e in history.values()
+                 if isinstance(e, dict) and e.get("baseline_rss_mb")]
+    return float(min(baselines)) if baselines else float(DEFAULT_WORKER_MEMORY_MB)
+
+
+def next_admissible_job(pending: list, estimates: dict, in_use: float,
+                        budget: float | None, running: int, overhead: float = 0.0) -> int | None:
+    """メモリ予算に収まる次のジョブのpending内インデックスを返す（なければNone）
+
+    スケジュール順を優先しつつ、先頭のジョブが収まらない場合は
+    後続の収まるジョブを先に投入する。実行中のジョブがない場合は
+    予算を超えていても先頭のジョブを単独で実行する。
+    in_useは実行中ジョブのワーカー固定分を含む合計で、新しいジョブにもoverheadを加える。
+    """
+    if not pending:
+        return None
+    if budget is None or running == 0:
+        return 0
+    for position, (_, pdf_info) in enumerate(pending):
+        if in_use + overhead + estimates[pdf_info["name"]] <= budget:
+            return position
+    return None
+
+
+def _current_rss_mb(process) -> float:
+    """プロセスと子プロセスの合計RSS（MB）を取得する"""
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except Exception:
+            # 計測中に終了した子プロセスは無視
+            pass
+    return rss / (1024 * 1024)
+
+
+@contextmanager
+def track_peak_rss(metrics: dict, interval: float = 0.5):
+    """処理中のピークRSS（MB、子プロセスを含む）の開始時からの増加分を計測してmetricsに格納する
+
+    同じプロセスで複数の文書を順に処理する場合も、前の文書で確保したままの
+    メモリを含めないよう開始時のRSSを差し引く。差し引いた開始時のRSSは
+    ワーカーの固定分の見積もり用にbaseline_rss_mbとして記録する。psutilがない場合は記録しない
+    （ru_maxrssはプロセス全体の最大値で、文書ごとの値にならないため）。
+    """
+    try:
+        import psutil
+    except ImportError:
+        yield
+        return
+    
+    process = psutil.Process()
+    baseline = _current_rss_mb(process)
+    peak = [baseline]
+    stop = threading.Event()
+    
+    def sample() -> None:
+        while not stop.wait(interval):
+            try:
+                peak[0] = max(peak[0], _current_rss_mb(process))
+            except Exception:
+                pass
+    
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        sampler.join()
+        peak[0] = max(peak[0], _current_rss_mb(process))
+        metrics["peak_rss_mb"] = round(peak[0] - baseline, 1)
+        metrics["baseline_rss_mb"] = round(baseline, 1)
+
+
+PROFILE_TOP_N = 20
+
+# 実行中のプロファイリングの状態（profiling_session内でのみ有効）
+_profile_session = {"dir": None, "top": PROFILE_TOP_N, "stages": [], "frames": [], "count": 0}
+
+
+def get_profile_dir(config: dict, args, pdf_info: dict) -> Path | None:
+    """PDFごとのプロファイル出力先（--profile指定時のみ）"""
+    if not getattr(args, "profile", False):
+        return None
+    run_id = getattr(args, "profile_run", None) or "latest"
+    return (Path(config.get("cache_dir", "cache")) / "profiles" / run_id
+            / Path(pdf_info["output_filename"]).stem)
+
+
+def _allocation_snapshot() -> tracemalloc.Snapshot:
+    """tracemalloc自身の確保を除いたメモリ確保のスナップショットを取る"""
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+
+def _accumulate_allocations(diffs: dict, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> None:
+    """2つのスナップショット間の行ごとの確保の増分をdiffs（traceback -> [size, size_diff, count, count_diff]）に加算する"""
+    for stat in after.compare_to(before, "lineno"):
+        entry = diffs.setdefault(stat.traceback, [0, 0, 0, 0])
+        entry[0] = stat.size
+        entry[1] += stat.size_diff
+        entry[2] = stat.count
+        entry[3] += stat.count_diff
+
+
+@contextmanager
+def profile_stage(stage: str):
+    """処理ステージをcProfileとtracemallocで計測する（profiling_session外では何もしない）
+
+    ステージが入れ子になった場合、内側のステージの間は外側のプロファイラを止め、
+    メモリ確保の増分も内側のステージの前後の区間を除いて集計するため、
+    各ステージのプロファイルにはそのステージ固有の処理のみが含まれる。
+    ピークメモリは内側のステージの値を含む（外側のステージの実行中の最大値）。
+    """
+    profile_dir = _profile_session["dir"]
+    if profile_dir is None:
+        yield
+        return
+    
+    # ダンプファイルはステージの開始順に番号を付ける
+    _profile_session["count"] += 1
+    dump_name = f"{_profile_session['count']:02d}_{stage}"
+    frames = _profile_session["frames"]
+    before = _allocation_snapshot()
+    if frames:
+        # 外側のステージのここまでの区間を集計し、ピークをリセット前に退避する
+        parent = frames[-1]
+        parent["profiler"].disable()
+        _accumulate_allocations(parent["allocations"], parent["segment_start"], before)
+        parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    frame = {"profiler": cProfile.Profile(), "peak": 0, "segment_start": before, "allocations": {}}
+    frames.append(frame)
+    start = time.perf_counter()
+    frame["profiler"].enable()
+    try:
+        yield
+    finally:
+        profiler = frame["profiler"]
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        frames.pop()
+        peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+        after = _allocation_snapshot()
+        _accumulate_allocations(frame["allocations"], frame["segment_start"], after)
+        
+        top = _profile_session["top"]
+        profiler.dump_stats(str(profile_dir / f"{dump_name}.prof"))
+        after.dump(str(profile_dir / f"{dump_name}.tracemalloc"))
+        
+        hotspots = io.StringIO()
+        pstats.Stats(profiler, stream=hotspots).sort_stats("tottime").print_stats(top)
+        # 内側のステージの確保は外側の区間では増減0になるため、変化のない行は除く
+        allocations = sorted(((traceback, values) for traceback, values in frame["allocations"].items()
+                              if values[1] or values[3]), reverse=True,
+                             key=lambda item: (abs(item[1][1]), item[1][0], abs(item[1][3]), item[1][2]))
+        _profile_session["stages"].append({
+            "stage": stage,
+            "dump": dump_name,
+            "elapsed": elapsed,
+            "peak_mb": peak / (1024 * 1024),
+            "hotspots": hotspots.getvalue(),
+            "allocations": [str(tracemalloc.StatisticDiff(traceback, *values))
+                            for traceback, values in allocations[:top]],
+        })
+        
+        if frames:
+            # 外側のステージは内側のピークを引き継ぎ、ここから次の区間の集計を再開する
+            parent = frames[-1]
+            parent["peak"] = max(parent["peak"], peak)
+            parent["segment_start"] = after
+            parent["profiler"].enable()
+
+
+def write_profile_summary(profile_dir: Path, stages: list[dict]) -> Path:
+    """ステージ別の処理時間・メモリと上位のホットスポットをsummary.txtに書き出す"""
+    summary_path = profile_dir / "summary.txt"
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(f"{'ステージ':<12} {'時間(秒)':>10} {'ピーク(MB)':>12}  ダンプ\n")
+        for entry in stages:
+            f.write(f"{entry['stage']:<12} {entry['elapsed']:>10.3f} {entry['peak_mb']:>12.1f}  "
+                    f"{entry['dump']}.prof\n")
+        for entry in stages:
+            f.write(f"\n{'='*70}\n[{entry['stage']}] CPUホットスポット（自己時間順）\n{'='*70}\n")
+            f.write(entry["hotspots"])
+            f.write(f"\n[{entry['stage']}] メモリ確保の増分（行単位）\n")
+            for line in entry["allocations"]:
+                f.write(f"  {line}\n")
+    return summary_path
+
+
+@contextmanager
+def profiling_session(profile_dir: Path | None, top: int = PROFILE_TOP_N):
+    """1つのPDFの処理をプロファイリングし、終了時にステージ別の要約を書き出す"""
+    if profile_dir is None:
+        yield
+        return
+    
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _profile_session.update({"dir": profile_dir, "top": top, "stages": [], "frames": [], "count": 0})
+    try:
+        yield
+    finally:
+        stages = sorted(_profile_session["stages"], key=lambda entry: entry["dump"])
+        _profile_session.update({"dir": None, "stages": [], "frames": []})
+        if started_tracing:
+            tracemalloc.stop()
+        summary_path = write_profile_summary(profile_dir, stages)
+        report(f"  🔬 ステージ別プロファイル:")
+        for entry in stages:
+            report(f"     {entry['stage']:<10} {format_duration(entry['elapsed']):>10}  "
+                   f"ピーク {entry['peak_mb']:,.1f} MB")
+        report(f"  💾 プロファイル結果を保存しました: {summary_path}")
+
+
+# 実行中のトレースの状態（tracing_session内でのみ有効）
+_trace_session = {"events": None, "pid": None}
+
+
+def _active_trace_events() -> list | None:
+    """このプロセスで収集中のトレースイベントのリスト（forkで引き継いだ親の状態は無視）"""
+    if _trace_session["pid"] != os.getpid():
+        return None
+    return _trace_session["events"]
+
+
+@contextmanager
+def tracing_session(enabled: bool):
+    """トレースイベントの収集を開始し、収集先のリストを返す
+
+    既に収集中の場合（同じプロセス内での入れ子）は外側のリストに記録されるため、Noneを返す。
+    """
+    if not enabled or _active_trace_events() is not None:
+        yield None
+        return
+    
+    events = [{
+        "name": "process_name", "ph": "M", "pid": os.getpid(),
+        "args": {"name": f"{multiprocessing.current_process().name} ({os.getpid()})"},
+    }]
+    _trace_session.update({"events": events, "pid": os.getpid()})
+    try:
+        yield events
+    finally:
+        _trace_session.update({"events": None, "pid": None})
+
+
+@contextmanager
+def trace_span(name: str, attributes: dict | None = None):
+    """処理をトレースのスパン（Chromeトレース形式の完了イベント）として記録する
+
+    属性の辞書を返すため、処理中に判明した値（バイト数・ページ数など）を追加できる。
+    """
+    span = dict(attributes or {})
+    events = _active_trace_events()
+    if events is None:
+        yield span
+        return
+    
+    start = time.time()
+    try:
+        yield span
+    except BaseException as e:
+        span["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        events.append({
+            "name": name,
+            "cat": "pipeline",
+            "ph": "X",
+            "ts": int(start * 1_000_000),
+            "dur": int((time.time() - start) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {k: v for k, v in span.items() if v is not None},
+        })
+
+
+@contextmanager
+def pipeline_stage(stage: str, attributes: dict | None = None):
+    """処理ステージをトレースのスパンとして記録し、--profile時はプロファイリングも行う"""
+    with trace_span(stage, attributes) as span, profile_stage(stage):
+        yield span
+
+
+def write_trace(trace_path: Path, events: list[dict]) -> None:
+    """トレースイベントをChromeトレース形式のJSONとして保存する（Perfetto等で閲覧可能）"""
+    trace_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(trace_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+
+def get_temp_pdf_path(config: dict, index: int) -> str:
+    """一時PDFファイルのパスを取得する"""
+    return os.path.join(config.get("temp_dir", "temp"), f"temp_{index}.pdf")
+
+
+def finalize_markdown(output_md: str, config: dict, args, metrics: dict,
+                      split_chapters: bool = False) -> None:
+    """変換後のMarkdownを最適化し、章ごとに分割して、画像参照を検証する"""
+    # Markdownを最適化（デフォルトで実行、--no-optimizeで無効化可能）
+    if not args.no_optimize:
+        report(f"  🔧 Markdown最適化中...")
+        optimize_start = time.time()
+        with pipeline_stage("optimize") as span:
+            original_size, new_size = optimize_markdown_file(output_md)
+            span.update({"bytes_before": original_size, "bytes_after": new_size})
+        optimize_time = time.time() - optimize_start
+        metrics["optimize_time"] = optimize_time
+        
+        if original_size > 0:
+            reduction = original_size - new_size
+            percentage = (reduction / original_size * 100) if original_size > 0 else 0
+            report(f"  ✅ 最適化完了: {reduction:,} bytes削減 ({percentage:.1f}%)",
+                   event="optimize_complete", path=output_md,
+                   bytes_before=original_size, bytes_after=new_size)
+            report(f"  ⏱️  最適化時間: {format_duration(optimize_time)}")
+    
+    # 章ごとのファイルに分割（--split-chapters、またはPDFごとのsplit_chapters指定時）
+    if split_chapters:
+        with pipeline_stage("split") as span:
+            chapter_files = split_markdown_chapters(output_md, get_document_title(config, output_md))
+            # 先頭は目次ページ
+            span["chapters"] = len(chapter_files) - 1
+        metrics["chapters"] = len(chapter_files) - 1
+        report(f"  📑 章ごとに分割しました: {metrics['chapters']}章 → {get_chapter_dir(output_md)}",
+               event="chapters_split", path=output_md, chapters=metrics["chapters"])
+    
+    # 画像参照を検証（--verifyフラグが指定された場合）
+    if args.verify:
+        report(f"  🔍 画像参照を検証中...")
+        verify_start = time.time()
+        with pipeline_stage("verify") as span:
+            verify_result = {"references": [], "found": [], "missing": []}
+            # 分割した章のファイルも、それぞれの場所からの相対パスで検証する
+            for md_file in [Path(output_md), *list_chapter_files(output_md)]:
+                file_result = verify_images(str(md_file), config.get("image_dir", "docs/images"))
+                for key in verify_result:
+                    verify_result[key].extend(file_result[key])
+            span.update({"references": len(verify_result['references']),
+                         "missing": len(verify_result['missing'])})
+        metrics["verify_time"] = time.time() - verify_start
+        if verify_result['references']:
+            report(f"  📊 画像参照数: {len(verify_result['references'])}枚")
+            report(f"  ✅ 検出: {len(verify_result['found'])}枚")
+            if verify_result['missing']:
+                report(f"  ⚠️  見つからない: {len(verify_result['missing'])}枚", level="warning")
+                for missing in verify_result['missing']:
+                    report(f"     - {missing}")
+    
+    if os.path.exists(output_md):
+        metrics["output_size"] = os.path.getsize(output_md)
+
+
+def process_pdf(pdf_info: dict, config: dict, args, index: int, total: int,
+                metrics: dict | None = None) -> bool:
+    """1つのPDFを処理する（metricsが指定された場合はステージ別の計測値を格納）"""
+    if metrics is None:
+        metrics = {}
+
+    name = pdf_info["name"]
+    url = pdf_info["url"]
+    output_filename = pdf_info["output_filename"]
+    
+    report(f"\n{'='*70}")
+    report(f"📄 [{index}/{total}] {name}", event="document_start",
+           document=name, index=index, total=total)
+    report(f"{'='*70}")
+    
+    start_time = time.time()
+    
+    # 一時PDFファイルのパス
+    temp_pdf = get_temp_pdf_path(config, index)
+    
+    # 出力Markdownファイルのパス
+    output_md = os.path.join(config.get("output_dir", "docs"), output_filename)
+    
+    # --in-memory指定時は一時ファイルを作らずメモリ上で受け渡す
+    in_memory = getattr(args, "in_memory", False)
+    
+    # 中間ドキュメントのキャッシュ（--rerender時はダウンロードせずに再利用）
+    use_document_cache = getattr(args, "document_cache", False) or getattr(args, "rerender", False)
+    document_cache = None
+    pdf_buffer = None
+    
+    try:
+        converter_config = build_converter_config(pdf_info, args)
+        
+        if getattr(args, "rerender", False):
+            cached_sha256 = lookup_document_sha256(config, url)
+            if cached_sha256:
+                cache_path = get_document_cache_path(config, cached_sha256, converter_config)
+                if cache_path.exists():
+                    document_cache = cache_path
+                    metrics["pdf_sha256"] = cached_sha256
+            if document_cache is None:
+                report(f"  ⚠️  キャッシュがないため通常どおり変換します", level="warning")
+        
+        # PDFをダウンロード
+        skip_download = document_cache is not None
+        download_start = time.time()
+        if skip_download:
+            report(f"  ♻️  キャッシュ済みのため、ダウンロードをスキップします")
+        elif in_memory:
+            with pipeline_stage("download", {"url": url, "in_memory": True}) as span:
+                pdf_buffer, sha256 = download_pdf_to_memory(url)
+                span["bytes"] = pdf_buffer.getbuffer().nbytes
+            metrics["pdf_size"] = pdf_buffer.getbuffer().nbytes
+        else:
+            with pipeline_stage("download", {"url": url}) as span:
+                sha256 = download_pdf(url, temp_pdf)
+                if os.path.exists(temp_pdf):
+                    span["bytes"] = os.path.getsize(temp_pdf)
+            if os.path.exists(temp_pdf):
+                metrics["pdf_size"] = os.path.getsize(temp_pdf)
+        if not skip_download:
+            download_time = time.time() - download_start
+            metrics["download_time"] = download_time
+            if sha256:
+                metrics["pdf_sha256"] = sha256
+                if use_document_cache:
+                    document_cache = get_document_cache_path(config, sha256, converter_config)
+                    register_document_sha256(config, url, sha256)
+            report(f"  ⏱️  ダウンロード時間: {format_duration(download_time)}")
+        
+        # Markdownに変換
+        convert_start = time.time()
+        if in_memory and pdf_buffer is not None:
+            source = memory_pdf_source(pdf_buffer)
+        else:
+            source = nullcontext(None if skip_download else temp_pdf)
+        with source as pdf_source, pipeline_stage("convert") as span:
+            # 高速抽出は元PDFが必要なため、キャッシュからの再レンダリング時は使わない
+            if getattr(args, "fast_text", False) and pdf_source is not None:
+                convert_stats = convert_pdf_hybrid(
+                    pdf_source,
+                    output_md,
+                    config.get("image_dir", "docs/images"),
+                    converter_config=converter_config,
+                    model_seconds_per_page=getattr(args, "model_seconds_per_page", None),
+                )
+            else:
+                convert_stats = convert_pdf_to_markdown(
+                    pdf_source,
+                    output_md,
+                    config.get("image_dir", "docs/images"),
+                    converter_config=converter_config,
+                    document_cache=document_cache,
+                )
+            if isinstance(convert_stats, dict):
+                span.update({"pages": convert_stats.get("pages"),
+                             "images": convert_stats.get("images")})
+        # 変換が終わったPDFのバイト列は以降の処理中に保持しない
+        pdf_buffer = None
+        convert_time = time.time() - convert_start
+        metrics["convert_time"] = convert_time
+        if isinstance(convert_stats, dict):
+            for key in ("pages", "images", "pages_text", "pages_model", "time_saved", "cache_hit"):
+                if key in convert_stats:
+                    metrics[key] = convert_stats[key]
+        report(f"  ⏱️  変換時間: {format_duration(convert_time)}")
+        
+        # Markdownの最適化・章ごとの分割と画像参照の検証
+        finalize_markdown(output_md, config, args, metrics, should_split_chapters(pdf_info, args))
+        
+        # 一時PDFファイルを削除
+        if os.path.exists(temp_pdf):
+            os.remove(temp_pdf)
+            report(f"  🗑️  一時ファイル削除完了")
+        
+        # 合計処理時間
+        total_time = time.time() - start_time
+        metrics["total_time"] = total_time
+        report(f"  ⏱️  合計処理時間: {format_duration(total_time)}")
+        report(f"  ✅ 処理完了: {name}", event="document_complete", level="result",
+               document=name, total_time=total_time, pages=metrics.get("pages"),
+               images=metrics.get("images"))
+        
+        return True
+        
+    except Exception as e:
+        report(f"  ❌ 処理失敗: {name}", event="document_failed", level="error",
+               document=name, error=str(e))
+        report(f"  エラー詳細: {e}", level="error")
+        metrics["error"] = str(e)
+        
+        # 一時ファイルをクリーンアップ
+        if os.path.exists(temp_pdf):
+            os.remove(temp_pdf)
+        
+        return False
+
+
+def _process_pdf_job(pdf_info: dict, config: dict, args, index: int, total: int) -> tuple[bool, dict]:
+    """1つのPDFを処理し、結果と計測値（ピークRSSを含む）を返す"""
+    metrics = {}
+    profile_dir = get_profile_dir(config, args, pdf_info)
+    with tracing_session(getattr(args, "trace", False)) as trace_events, \
+            track_peak_rss(metrics), \
+            profiling_session(profile_dir, getattr(args, "profile_top", PROFILE_TOP_N)):
+        with trace_span("document", {"name": pdf_info["name"], "index": index}) as span:
+            success = process_pdf(pdf_info, config, args, index, total, metrics=metrics)
+            span.update({"success": success, "bytes": metrics.get("pdf_size"),
+                         "pages": metrics.get("pages"), "images": metrics.get("images"),
+                         "error": metrics.get("error")})
+    # ワーカープロセスで記録したイベントは計測値と一緒に親プロセスへ返す
+    if trace_events is not None:
+        metrics["trace_events"] = trace_events
+    return success, metrics
+
+
+WATCHDOG_INTERVAL = 1.0
+
+
+def check_job_limits(elapsed: float, rss_mb: float | None,
+                     timeout: float | None, max_job_memory: int | None) -> str | None:
+    """ウォッチドッグの判定を行い、制限を超えている場合はその理由を返す"""
+    if timeout and elapsed > timeout:
+        return f"タイムアウト（{format_duration(timeout)}を超過）"
+    if max_job_memory and rss_mb is not None and rss_mb > max_job_memory:
+        return f"メモリ上限超過（{rss_mb:,.0f} MB > {max_job_memory:,} MB）"
+    return None
+
+
+def _watchdog_worker(conn, pdf_info: dict, config: dict, args, index: int, total: int) -> None:
+    """ワーカープロセスで1つのPDFを処理し、結果をパイプで返す"""
+    configure_output(getattr(args, "output_mode", "text"))
+    threads = getattr(args, "threads_per_job", None)
+    if threads:
+        configure_threads(threads)
+    try:
+        success, metrics = _process_pdf_job(pdf_info, config, args, index, total)
+    except BaseException as e:
+        success, metrics = False, {"error": f"{type(e).__name__}: {e}"}
+    conn.send((success, metrics))
+    conn.close()
+
+
+def _job_rss_mb(pid: int) -> float | None:
+    """ワーカープロセス（子プロセスを含む）のRSS（MB）を取得する"""
+    try:
+        import psutil
+        return _current_rss_mb(psutil.Process(pid))
+    except Exception:
+        # psutil未導入・プロセス終了済みの場合は計測しない
+        return None
+
+
+def _kill_process_tree(process) -> None:
+    """ワーカープロセスとその子プロセスを強制終了する"""
+    try:
+        import psutil
+        children = psutil.Process(process.pid).children(recursive=True)
+    except Exception:
+        children = []
+    for child in children:
+        try:
+            child.kill()
+        except Exception:
+            pass
+    process.kill()
+    process.join()
+
+
+def _remove_temp_pdf(config: dict, index: int) -> None:
+    """停止・異常終了したワーカーが残した一時PDFファイルを削除する"""
+    temp_pdf = get_temp_pdf_path(config, index)
+    if os.path.exists(temp_pdf):
+        os.remove(temp_pdf)
+
+
+def run_pdf_jobs(pdfs: list, config: dict, args, jobs: int = 1,
+                 history: dict | None = None,
+                 isolate: bool = False) -> list[tuple[dict, bool, dict]]:
+    """PDFを順番に（jobs > 1の場合は並列に）処理し、(pdf_info, 成否, 計測値)のリストを返す
+
+    args.max_memory（MB）が指定されている場合は、実行中ジョブの見積もりメモリと
+    ワーカーごとの固定分の合計が予算に収まる範囲でのみ新しいジョブを投入する。
+    args.timeout（秒）またはargs.max_job_memory（MB）が指定されている場合は、
+    各変換を個別のワーカープロセスで実行し、制限を超えたワーカーを停止して
+    失敗として記録した上で残りの処理を続行する。
+    """
+    total = len(pdfs)
+    results = []
+    
+    timeout = getattr(args, "timeout", None)
+    max_job_memory = getattr(args, "max_job_memory", None)
+    watchdog = bool(timeout or max_job_memory
+                    or any(p.get("timeout") for p in pdfs))
+    
+    # isolate指定時は計測のため、1件ずつ新しいワーカープロセスで処理する
+    if jobs <= 1 and not watchdog and not isolate:
+        for index, pdf_info in enumerate(pdfs, start=1):
+            success, metrics = _process_pdf_job(pdf_info, config, args, index, total)
+            results.append((pdf_info, success, metrics))
+        return results
+    
+    budget = getattr(args, "max_memory", None)
+    estimates = {p["name"]: estimate_job_memory(p, history or {}) for p in pdfs}
+    overhead = estimate_worker_memory(history or {}, args)
+    
+    threads = getattr(args, "threads_per_job", None)
+    report(f"⚙️  並列処理: {jobs}ワーカー" + (f" × {threads}スレッド" if threads else ""))
+    if budget:
+        report(f"🧮 メモリ予算: {budget:,} MB（ワーカーごとの固定分 {overhead:,.0f} MB）")
+    if watchdog:
+        report(f"⏰ ウォッチドッグ: タイムアウト {format_duration(timeout) if timeout else 'なし'}, "
+               f"メモリ上限 {f'{max_job_memory:,} MB' if max_job_memory else 'なし'}")
+    
+    context = multiprocessing.get_context()
+    pending = list(enumerate(pdfs, start=1))
+    # 受信用コネクション -> 実行中ジョブの情報
+    running = {}
+    
+    while pending or running:
+        # 空きワーカーがあり、見積もりメモリが予算に収まる間はジョブを投入
+        while len(running) < jobs:
+            in_use = sum(estimates[job["pdf_info"]["name"]] + overhead for job in running.values())
+            position = next_admissible_job(pending, estimates, in_use, budget, len(running), overhead)
+            if position is None:
+                break
+            index, pdf_info = pending.pop(position)
+            estimate = estimates[pdf_info["name"]]
+            if budget and estimate + overhead > budget:
+                report(f"⚠️  警告: {pdf_info['name']} の見積もりメモリ({estimate:,.0f} MB)が"
+                       f"予算を超えるため単独で実行します", level="warning")
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_watchdog_worker,
+                args=(sender, pdf_info, config, args, index, total),
+                daemon=True,
+            )
+            process.start()
+            # 子プロセス側の送信端を閉じ、異常終了時にEOFを検知できるようにする
+            sender.close()
+            running[receiver] = {
+                "process": process,
+                "pdf_info": pdf_info,
+                "index": index,
+                "started": time.time(),
+                "timeout": pdf_info.get("timeout", timeout),
+            }
+        
+        for receiver in multiprocessing.connection.wait(list(running), timeout=WATCHDOG_INTERVAL):
+            job = running.pop(receiver)
+            try:
+                success, metrics = receiver.recv()
+            except EOFError:
+                job["process"].join()
+                _remove_temp_pdf(config, job["index"])
+                reason = f"ワーカーが異常終了しました（終了コード: {job['process'].exitcode}）"
+                report(f"  ❌ {job['pdf_info']['name']}: {reason}", level="error")
+                success, metrics = False, {"error": reason}
+            receiver.close()
+            job["process"].join()
+            results.append((job["pdf_info"], success, metrics))
+        
+        # 制限を超えたワーカーを停止し、失敗として記録
+        now = time.time()
+        for receiver, job in list(running.items()):
+            rss_mb = _job_rss_mb(job["process"].pid) if max_job_memory else None
+            reason = check_job_limits(now - job["started"], rss_mb, job["timeout"], max_job_memory)
+            if reason is None:
+                continue
+            running.pop(receiver)
+            _kill_process_tree(job["process"])
+            receiver.close()
+            _remove_temp_pdf(config, job["index"])
+            report(f"  ⏰ ワーカーを停止しました: {job['pdf_info']['name']}: {reason}")
+            results.append((job["pdf_info"], False, {"error": reason}))
+    
+    return results
+
+
+PAGE_SEPARATOR_RE = re.compile(r'^\{(\d+)\}-{48}$', re.MULTILINE)
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    """PDFのページ数を取得する"""
+    pdf = _open_pdfium(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def pack_documents(page_counts: list[int], max_pages: int) -> list[list[int]]:
+    """合計ページ数がmax_pages以下になるよう文書をまとめる（順序は維持）
+
+    max_pagesを超える文書は単独のバッチになる。
+    """
+    batches = []
+    current = []
+    current_pages = 0
+    for index, pages in enumerate(page_counts):
+        if current and current_pages + pages > max_pages:
+            batches.append(current)
+            current = []
+            current_pages = 0
+        current.append(index)
+        current_pages += pages
+    if current:
+        batches.append(current)
+    return batches
+
+
+def merge_pdfs(pdf_paths: list[str], output_path: str) -> list[tuple[int, int]]:
+    """複数のPDFを1つに結合し、各文書のページ範囲（開始, 終了）を返す"""
+    import pypdfium2 as pdfium
+    
+    merged = pdfium.PdfDocument.new()
+    sources = []
+    ranges = []
+    try:
+        for path in pdf_paths:
+            source = pdfium.PdfDocument(path)
+            sources.append(source)
+            start = len(merged)
+            merged.import_pages(source)
+            ranges.append((start, len(merged)))
+        merged.save(output_path)
+    finally:
+        merged.close()
+        for source in sources:
+            source.close()
+    return ranges
+
+
+def split_paginated_markdown(markdown_text: str, ranges: list[tuple[int, int]]) -> list[str]:
+    """ページ区切り付きのMarkdownを文書ごとに分割する"""
+    parts = [[] for _ in ranges]
+    pieces = PAGE_SEPARATOR_RE.split(markdown_text)
+    for page_id, text in zip(pieces[1::2], pieces[2::2]):
+        page = int(page_id)
+        for doc_index, (start, end) in enumerate(ranges):
+            if start <= page < end:
+                parts[doc_index].append(text.strip())
+                break
+    return ['\n\n'.join(t for t in texts if t) + '\n' for texts in parts]
+
+
+def convert_pdf_batch(pdf_paths: list[str], output_md_paths: list[str], image_dir: str,
+                      merged_path: str, converter_config: dict | None = None,
+                      artifact_dict: dict | None = None) -> list[dict]:
+    """複数のPDFを結合して1回で変換し、結果を文書ごとのMarkdownと画像に分割する"""
+    ranges = merge_pdfs(pdf_paths, merged_path)
+    report(f"  📚 {len(pdf_paths)}件を結合しました（{ranges[-1][1]}ページ）")
+    
+    try:
+        report(f"  🔄 Markdown変換中（バッチ）...")
+        # ページ区切りを出力させ、変換結果を文書ごとに分割できるようにする
+        converter = create_pdf_converter(
+            artifact_dict if artifact_dict is not None else create_model_dict(),
+            {**(converter_config or {}), "paginate_output": True},
+        )
+        markdown_text, _, images = text_from_rendered(converter(merged_path))
+    finally:
+        if os.path.exists(merged_path):
+            os.remove(merged_path)
+    
+    stats = []
+    for markdown_part, output_md_path, (start, end) in zip(
+            split_paginated_markdown(markdown_text, ranges), output_md_paths, ranges):
+        # 画像は参照しているMarkdownに振り分ける
+        part_images = {k: v for k, v in (images or {}).items() if f"({k})" in markdown_part}
+        extract_images = (converter_config or {}).get("extract_images", True)
+        save_markdown_with_images(markdown_part, part_images, output_md_path, image_dir,
+                                  extract_images)
+        stats.append({'pages': end - start, 'images': len(part_images) if extract_images else 0})
+    
+    return stats
+
+
+def process_pdf_batches(pdfs: list, config: dict, args, max_pages: int) -> list[tuple[dict, bool, dict]]:
+    """小さいPDFをまとめて変換し、(PDF情報, 成否, 計測値)のリストを返す"""
+    total = len(pdfs)
+    metrics_list = [{} for _ in pdfs]
+    failed = set()
+    temp_paths = [get_temp_pdf_path(config, index) for index in range(1, total + 1)]
+    page_counts = [0] * total
+    
+    # すべてのPDFをダウンロードしてページ数を取得
+    report(f"\n{'='*70}")
+    report(f"📥 バッチ変換用にPDFをダウンロード中 ({total}件)")
+    report(f"{'='*70}")
+    for index, pdf_info in enumerate(pdfs):
+        metrics = metrics_list[index]
+        report(f"\n  📄 [{index + 1}/{total}] {pdf_info['name']}")
+        try:
+            download_start = time.time()
+            sha256 = download_pdf(pdf_info["url"], temp_paths[index])
+            metrics["download_time"] = time.time() - download_start
+            metrics["pdf_size"] = os.path.getsize(temp_paths[index])
+            if sha256:
+                metrics["pdf_sha256"] = sha256
+            page_counts[index] = count_pdf_pages(temp_paths[index])
+        except Exception as e:
+            report(f"  ❌ ダウンロード失敗: {pdf_info['name']}", level="error")
+            report(f"  エラー詳細: {e}", level="error")
+            metrics["error"] = str(e)
+            failed.add(index)
+    
+    # 変換設定が同じ文書同士のみ、ページ数の上限までまとめる
+    groups = {}
+    for index, pdf_info in enumerate(pdfs):
+        if index in failed:
+            continue
+        try:
+            converter_config = build_converter_config(pdf_info, args)
+        except ValueError as e:
+            report(f"  ❌ {pdf_info['name']}: {e}", level="error")
+            metrics_list[index]["error"] = str(e)
+            failed.add(index)
+            continue
+        key = json.dumps(converter_config, sort_keys=True, default=str)
+        groups.setdefault(key, (converter_config, []))[1].append(index)
+    
+    batches = []
+    for converter_config, indices in groups.values():
+        for packed in pack_documents([page_counts[i] for i in indices], max_pages):
+            batches.append((converter_config, [indices[i] for i in packed]))
+    
+    models = create_model_dict() if batches else None
+    image_dir = config.get("image_dir", "docs/images")
+    
+    for batch_number, (converter_config, indices) in enumerate(batches, 1):
+        names = [pdfs[i]["name"] for i in indices]
+        report(f"\n{'='*70}")
+        report(f"📦 [バッチ {batch_number}/{len(batches)}] {', '.join(names)}")
+        report(f"{'='*70}")
+        
+        output_mds = [os.path.join(config.get("output_dir", "docs"), pdfs[i]["output_filename"])
+                      for i in indices]
+        merged_path = os.path.join(config.get("temp_dir", "temp"), f"batch_{batch_number}.pdf")
+        
+        convert_start = time.time()
+        try:
+            stats = convert_pdf_batch([temp_paths[i] for i in indices], output_mds, image_dir,
+                                      merged_path, converter_config, artifact_dict=models)
+        except Exception as e:
+            report(f"  ❌ バッチ変換失敗: {', '.join(names)}", level="error")
+            report(f"  エラー詳細: {e}", level="error")
+            for i in indices:
+                metrics_list[i]["error"] = str(e)
+                failed.add(i)
+            continue
+        convert_time = time.time() - convert_start
+        report(f"  ⏱️  変換時間: {format_duration(convert_time)}")
+        
+        batch_pages = sum(s["pages"] for s in stats) or 1
+        for i, output_md, doc_stats in zip(indices, output_mds, stats):
+            metrics = metrics_list[i]
+            metrics.update(doc_stats)
+            metrics["batch_size"] = len(indices)
+            # バッチの変換時間はページ数で按分する
+            metrics["convert_time"] = convert_time * doc_stats["pages"] / batch_pages
+            try:
+                finalize_markdown(output_md, config, args, metrics,
+                                  should_split_chapters(pdfs[i], args))
+            except Exception as e:
+                report(f"  ❌ 処理失敗: {pdfs[i]['name']}", event="document_failed", level="error",
+                       document=pdfs[i]['name'], error=str(e))
+                report(f"  エラー詳細: {e}", level="error")
+                metrics["error"] = str(e)
+                failed.add(i)
+                continue
+            metrics["total_time"] = sum(metrics.get(key) or 0 for key in
+                                        ("download_time", "convert_time", "optimize_time"))
+            report(f"  ✅ 処理完了: {pdfs[i]['name']}", event="document_complete", level="result",
+                   document=pdfs[i]['name'], total_time=metrics["total_time"],
+                   pages=metrics.get("pages"), images=metrics.get("images"))
+    
+    for temp_path in temp_paths:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    
+    return [(pdf_info, index not in failed, metrics_list[index])
+            for index, pdf_info in enumerate(pdfs)]
+
+
+def default_thread_grid(cpu_budget: int) -> list[tuple[int, int]]:
+    """ベンチマーク用の(ジョブ数, スレッド数)の組み合わせを作成する"""
+    grid = []
+    jobs = 1
+    while jobs <= cpu_budget:
+        grid.append((jobs, max(1, cpu_budget // jobs)))
+        jobs *= 2
+    return grid
+
+
+def benchmark_thread_configs(pdfs: list, config: dict, args,
+                             combos: list[tuple[int, int]]) -> list[dict]:
+    """ジョブ数×スレッド数の組み合わせごとに変換を実行し、スループットを計測する"""
+    bench_root = Path(config.get("cache_dir", "cache")) / "benchmark" / "threads"
+    results = []
+    
+    for jobs, threads in combos:
+        report(f"\n{'='*70}")
+        report(f"🏁 ベンチマーク: {jobs}ジョブ × {threads}スレッド")
+        report(f"{'='*70}")
+        
+        # 本番の出力を上書きしないよう、組み合わせごとの作業ディレクトリに出力
+        combo_dir = bench_root / f"{jobs}x{threads}"
+        bench_config = {
+            **config,
+            "output_dir": str(combo_dir / "docs"),
+            "image_dir": str(combo_dir / "docs" / "images"),
+            "temp_dir": str(combo_dir / "temp"),
+        }
+        ensure_directories(bench_config)
+        bench_args = argparse.Namespace(**{
+            **vars(args),
+            "no_optimize": True,
+            "verify": False,
+            "threads_per_job": threads,
+        })
+        if jobs <= 1:
+            configure_threads(threads)
+        
+        start = time.time()
+        job_results = run_pdf_jobs(pdfs, bench_config, bench_args, jobs)
+        elapsed = time.time() - start
+        
+        pages = sum(m.get("pages") or 0 for _, ok, m in job_results if ok)
+        succeeded = sum(1 for _, ok, _ in job_results if ok)
+        results.append({
+            "jobs": jobs,
+            "threads": threads,
+            "elapsed": elapsed,
+            "documents": succeeded,
+            "failed": len(job_results) - succeeded,
+            "pages": pages,
+            "pages_per_second": pages / elapsed if elapsed > 0 else 0.0,
+            "documents_per_minute": succeeded * 60 / elapsed if elapsed > 0 else 0.0,
+        })
+    
+    return results
+
+
+def print_thread_benchmark(results: list[dict]) -> dict | None:
+    """ベンチマーク結果の表を表示し、最もスループットの高い設定を返す"""
+    report(f"\n{'='*70}")
+    report(f"📊 ベンチマーク結果")
+    report(f"{'='*70}")
+    report(f"{'ジョブ':>6} {'スレッド':>8} {'時間':>10} {'ページ/秒':>10} {'文書/分':>8} {'失敗':>4}")
+    for r in results:
+        report(f"{r['jobs']:>6} {r['threads']:>8} {format_duration(r['elapsed']):>10} "
+               f"{r['pages_per_second']:>10.2f} {r['documents_per_minute']:>8.2f} {r['failed']:>4}")
+    
+    candidates = [r for r in results if r["failed"] == 0] or results
+    if not candidates:
+        return None
+    # ページ数が取得できない場合は文書スループットで比較
+    best = max(candidates, key=lambda r: (r["pages_per_second"], r["documents_per_minute"]))
+    report(f"\n🏆 推奨設定: --jobs {best['jobs']} --threads-per-job {best['threads']}")
+    return best
+
+
+def _directory_size(path: Path) -> int:
+    """ディレクトリ内の全ファイルの合計サイズ（バイト）"""
+    if not path.exists():
+        return 0
+    return sum(f.stat().st_size for f in path.rglob('*') if f.is_file())
+
+
+def benchmark_variants(pdfs: list, config: dict, args, variants: dict[str, dict],
+                       bench_name: str, jobs: int = 1, label_key: str = "variant") -> list[dict]:
+    """引数の組み合わせ（variants: 名前 -> 上書きする引数）ごとに変換を実行し、
+    処理時間・ピークメモリ・出力サイズを計測する
+
+    ピークメモリを文書ごとに計測するため、各変換は個別のワーカープロセスで実行する。
+    組み合わせの名前は結果のlabel_keyのキーに格納する。
+    """
+    bench_root = Path(config.get("cache_dir", "cache")) / "benchmark" / bench_name
+    results = []
+    
+    for variant, overrides in variants.items():
+        report(f"\n{'='*70}")
+        report(f"🏁 ベンチマーク: {variant}")
+        report(f"{'='*70}")
+        
+        # 本番の出力を上書きしないよう、組み合わせごとの作業ディレクトリに出力
+        variant_dir = bench_root / variant
+        bench_config = {
+            **config,
+            "output_dir": str(variant_dir / "docs"),
+            "image_dir": str(variant_dir / "docs" / "images"),
+            "temp_dir": str(variant_dir / "temp"),
+        }
+        shutil.rmtree(variant_dir / "docs", ignore_errors=True)
+        ensure_directories(bench_config)
+        bench_args = argparse.Namespace(**{
+            **vars(args),
+            "no_optimize": True,
+            "verify": False,
+            **overrides,
+        })
+        
+        start = time.time()
+        job_results = run_pdf_jobs(pdfs, bench_config, bench_args, jobs, isolate=True)
+        elapsed = time.time() - start
+        
+        succeeded = [m for _, ok, m in job_results if ok]
+        image_dir = Path(bench_config["image_dir"])
+        results.append({
+            label_key: variant,
+            "elapsed": elapsed,
+            "convert_time": sum(m.get("convert_time") or 0 for m in succeeded),
+            "peak_rss_mb": max((m.get("peak_rss_mb") or 0 for m in succeeded), default=0),
+            "documents": len(succeeded),
+            "failed": len(job_results) - len(succeeded),
+            "pages": sum(m.get("pages") or 0 for m in succeeded),
+            "images": sum(m.get("images") or 0 for m in succeeded),
+            "markdown_bytes": _directory_size(variant_dir / "docs") - _directory_size(image_dir),
+            "image_bytes": _directory_size(image_dir),
+        })
+    
+    return results
+
+
+def benchmark_profiles(pdfs: list, config: dict, args, profiles: list[str],
+                       jobs: int = 1) -> list[dict]:
+    """変換プロファイルごとに変換を実行し、処理時間と出力サイズを計測する"""
+    # PDFごとのプロファイル指定は比較の妨げになるため外す
+    bench_pdfs = [{k: v for k, v in p.items() if k != "profile"} for p in pdfs]
+    variants = {profile: {"conversion_profile": profile} for profile in profiles}
+    # profiles.jsonの形式を保つため、プロファイル名は従来どおり"profile"キーに格納する
+    return benchmark_variants(bench_pdfs, config, args, variants, "profiles", jobs, label_key="profile")
+
+
+def save_benchmark_results(config: dict, results: list[dict], name: str) -> Path:
+    """ベンチマーク結果をcache/benchmark/<name>.jsonに保存する"""
+    bench_path = Path(config.get("cache_dir", "cache")) / "benchmark" / f"{name}.json"
+    bench_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(bench_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    report(f"💾 ベンチマーク結果を保存しました: {bench_path}")
+    return bench_path
+
+
+def print_variant_benchmark(results: list[dict], title: str, label_key: str = "variant") -> None:
+    """ベンチマーク結果の表を表示する"""
+    report(f"\n{'='*70}")
+    report(f"📊 {title}")
+    report(f"{'='*70}")
+    report(f"{'設定':<10} {'時間':>10} {'変換時間':>10} {'ピークRSS':>10} {'ページ':>6} {'画像':>6} "
+           f"{'Markdown':>12} {'画像サイズ':>12} {'失敗':>4}")
+    for r in results:
+        report(f"{r[label_key]:<10} {format_duration(r['elapsed']):>10} "
+               f"{format_duration(r['convert_time']):>10} {r['peak_rss_mb']:>8,.0f}MB "
+               f"{r['pages']:>6} {r['images']:>6} {r['markdown_bytes']:>12,} "
+               f"{r['image_bytes']:>12,} {r['failed']:>4}")
+
+
+def print_image_savings(results: list[dict]) -> None:
+    """画像あり・なしの変換時間とピークメモリの差を表示する"""
+    by_variant = {r["variant"]: r for r in results}
+    default, text_only = by_variant.get("images"), by_variant.get("no-images")
+    if not default or not text_only:
+        return
+    
+    time_saved = default["convert_time"] - text_only["convert_time"]
+    memory_saved = default["peak_rss_mb"] - text_only["peak_rss_mb"]
+    time_ratio = time_saved / default["convert_time"] * 100 if default["convert_time"] else 0
+    memory_ratio = memory_saved / default["peak_rss_mb"] * 100 if default["peak_rss_mb"] else 0
+    report(f"\n⚡ --no-imagesによる短縮: 変換時間 {format_duration(time_saved)} ({time_ratio:.1f}%), "
+           f"ピークRSS {memory_saved:,.0f} MB ({memory_ratio:.1f}%)")
+
+
+OFFLINE_ENV_VARS = ("HF_HUB_OFFLINE", "TRANSFORMERS_OFFLINE")
+
+
+@contextmanager
+def block_network():
+    """ネットワーク接続を禁止する（モデルの取得が必要な場合は即座に失敗させる）"""
+    import socket
+    
+    original_connect = socket.socket.connect
+    original_getaddrinfo = socket.getaddrinfo
+    original_env = {name: os.environ.get(name) for name in OFFLINE_ENV_VARS}
+    
+    def guarded_connect(sock, address):
+        if sock.family == getattr(socket, "AF_UNIX", None):
+            return original_connect(sock, address)
+        raise OSError(f"オフラインモードのためネットワーク接続を禁止しました: {address}")
+    
+    def guarded_getaddrinfo(host, *args, **kwargs):
+        raise OSError(f"オフラインモードのため名前解決を禁止しました: {host}")
+    
+    socket.socket.connect = guarded_connect
+    socket.getaddrinfo = guarded_getaddrinfo
+    for name in OFFLINE_ENV_VARS:
+        os.environ[name] = "1"
+    try:
+        yield
+    finally:
+        socket.socket.connect = original_connect
+        socket.getaddrinfo = original_getaddrinfo
+        for name, value in original_env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def build_synthetic_pdf(pages: int = 2) -> bytes:
+    """ウォームアップ用の小さなテキストPDFを生成する"""
+    lines = [
+        (18, "Warm-up Document"),
+        (11, "The Scrum Team consists of one Scrum Master, one Product Owner, and Developers."),
+        (11, "The Sprint is a container for all other events."),
+    ]
+    
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None]
+    page_refs = []
+    for page in range(pages):
+        content = "BT\n"
+        y = 720
+        for size, text in lines + [(11, f"Page {page + 1}")]:
+            content += f"/F1 {size} Tf 1 0 0 1 72 {y} Tm ({text}) Tj\n"
+            y -= size * 2
+        content += "ET"
+        page_number = len(objects) + 1
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {page_number + 1} 0 R /Resources << /Font << /F1 {2 + 2 * pages + 1} 0 R >> >> >>")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n{content}\nendstream")
+        page_refs.append(f"{page_number} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {pages} >>"
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    
+    output = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for offset in offsets:
+        output += f"{offset:010d} 00000 n \n".encode("latin-1")
+    output += (f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\n"
+               f"startxref\n{xref_offset}\n%%EOF\n").encode("latin-1")
+    return output
+
+
+def warmup_mode(config: dict, offline: bool = False, pages: int = 2) -> dict:
+    """モデルを取得・読み込みし、小さな合成PDFを変換して所要時間を計測する"""
+    report("🔥 モデルウォームアップモード" + ("（オフライン）" if offline else ""))
+    report(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report("")
+    
+    result = {"offline": offline, "pages": pages}
+    guard = block_network() if offline else nullcontext()
+    try:
+        with guard:
+            # 初回の読み込み（重みが未取得の場合はダウンロードを含む）
+            report(f"  📦 モデルを読み込み中（コールド）...")
+            start = time.time()
+            create_model_dict()
+            result["cold_load_time"] = time.time() - start
+            report(f"  ⏱️  コールド読み込み: {format_duration(result['cold_load_time'])}")
+            
+            # 2回目の読み込み（ディスク・OSキャッシュ済み）
+            report(f"  📦 モデルを読み込み中（ウォーム）...")
+            start = time.time()
+            models = create_model_dict()
+            result["warm_load_time"] = time.time() - start
+            report(f"  ⏱️  ウォーム読み込み: {format_duration(result['warm_load_time'])}")
+            
+            report(f"  🔄 合成PDF（{pages}ページ）を変換中...")
+            start = time.time()
+            converter = create_pdf_converter(models, {})
+            markdown_text, _, _ = text_from_rendered(converter(io.BytesIO(build_synthetic_pdf(pages))))
+            result["convert_time"] = time.time() - start
+            result["seconds_per_page"] = result["convert_time"] / pages
+            report(f"  ⏱️  変換時間: {format_duration(result['convert_time'])} "
+                   f"({result['seconds_per_page']:.2f}秒/ページ)")
+            
+            if "Warm-up" not in markdown_text:
+                raise RuntimeError("合成PDFの変換結果に期待したテキストが含まれていません")
+    except Exception as e:
+        report(f"  ❌ ウォームアップ失敗: {e}", level="error")
+        if offline:
+            report(f"  💡 オンライン環境で一度 --warmup を実行し、モデルを取得してください")
+        sys.exit(1)
+    
+    warmup_path = Path(config.get("cache_dir", "cache")) / "warmup.json"
+    warmup_path.parent.mkdir(parents=True, exist_ok=True)
+    result["updated_at"] = datetime.now().isoformat(timespec='seconds')
+    with open(warmup_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    
+    report(f"\n{'='*70}")
+    report(f"✅ ウォームアップ完了（結果: {warmup_path}）")
+    report(f"{'='*70}")
+    report(f"コールド読み込み: {format_duration(result['cold_load_time'])}")
+    report(f"ウォーム読み込み: {format_duration(result['warm_load_time'])}")
+    report(f"ページあたりの変換時間: {result['seconds_per_page']:.2f}秒")
+    report(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    return result
+
+
+SEARCH_INDEX_VERSION = 1
+SEARCH_NGRAM = 2
+SEARCH_LIMIT = 10
+SEARCH_SNIPPET_WIDTH = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+SEARCH_TOKEN_RE = re.compile(r'[a-z0-9_]+|[^\Wa-z0-9_]+')
+INLINE_MARKUP_RE = re.compile(r'<[^>]+>|\*\*|__|`')
+
+
+def split_markdown_sections(text: str) -> list[dict]:
+    """Markdownを見出し単位のセクション（見出し・レベル・開始行・本文）に分割する
+
+    コードブロック内の「#」は見出しとみなさない。最初の見出しより前の本文は
+    見出しが空のセクションになる。
+    """
+    sections = []
+    current = {"heading": "", "level": 0, "line": 1, "lines": []}
+    in_code = False
+    for number, line in enumerate(text.splitlines(), start=1):
+        if line.lstrip().startswith(("```", "~~~")):
+            in_code = not in_code
+        match = None if in_code else HEADING_RE.match(line)
+        if match:
+            sections.append(current)
+            current = {"heading": match.group(2), "level": len(match.group(1)),
+                       "line": number, "lines": []}
+        current["lines"].append(line)
+    sections.append(current)
+    return [{"heading": s["heading"], "level": s["level"], "line": s["line"],
+             "text": "\n".join(s["lines"])}
+            for s in sections if s["heading"] or any(line.strip() for line in s["lines"])]
+
+
+def strip_inline_markup(text: str) -> str:
+    """見出しなどからHTMLタグと強調・コードの記号を取り除く"""
+    return INLINE_MARKUP_RE.sub("", text).strip()
+
+
+def normalize_search_text(text: str) -> str:
+    """検索用に全角・半角と大文字・小文字の違いを正規化する"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def tokenize_search_text(text: str, n: int = SEARCH_NGRAM) -> list[str]:
+    """検索用のトークン列を作る（英数字は単語、それ以外の文字列は文字n-gram）"""
+    tokens = []
+    for run in SEARCH_TOKEN_RE.findall(normalize_search_text(text)):
+        if run.isascii() or len(run) <= n:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+def get_search_index_path(config: dict) -> Path:
+    """全文検索インデックスのパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "search" / "index.pickle"
+
+
+def load_search_index(index_path: str | Path) -> dict | None:
+    """全文検索インデックスを読み込む（存在しない・形式が古い場合はNone）"""
+    try:
+        with open(index_path, "rb") as f:
+            index = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except (pickle.UnpicklingError, EOFError, AttributeError) as e:
+        report(f"⚠️  警告: 検索インデックスの読み込みに失敗しました（再構築します）: {e}", level="warning")
+        return None
+    if not isinstance(index, dict) or index.get("version") != SEARCH_INDEX_VERSION:
+        return None
+    return index
+
+
+def _index_markdown_file(md_file: Path) -> list[dict]:
+    """1つのMarkdownファイルをセクションごとの語の出現回数に変換する"""
+    sections = []
+    for section in split_markdown_sections(md_file.read_text(encoding="utf-8")):
+        tokens = tokenize_search_text(section["text"])
+        if not tokens:
+            continue
+        terms = {}
+        for token in tokens:
+            terms[token] = terms.get(token, 0) + 1
+        sections.append({"heading": strip_inline_markup(section["heading"]), "line": section["line"],
+                         "length": len(tokens), "terms": terms})
+    return sections
+
+
+def _build_postings(files: dict) -> tuple[list, dict, float]:
+    """ファイルごとのセクションから転置インデックス（語 → [(セクション番号, 出現回数)]）を作る"""
+    sections = []
+    postings = {}
+    for name in sorted(files):
+        for position, section in enumerate(files[name]["sections"]):
+            section_id = len(sections)
+            sections.append((name, position))
+            for term, count in section["terms"].items():
+                postings.setdefault(term, []).append((section_id, count))
+    total_length = sum(files[name]["sections"][position]["length"] for name, position in sections)
+    return sections, postings, (total_length / len(sections) if sections else 0.0)
+
+
+def update_search_index(config: dict, rebuild: bool = False) -> dict:
+    """出力ディレクトリのMarkdownから全文検索インデックスを差分更新する
+
+    更新日時とサイズが変わったファイルだけを再トークン化し、
+    変更があった場合のみ転置インデックスを作り直して保存する。
+    """
+    index_path = get_search_index_path(config)
+    docs_dir = Path(config.get("output_dir", "docs"))
+    index = None if rebuild else load_search_index(index_path)
+    if index is None:
+        index = {"version": SEARCH_INDEX_VERSION, "files": {}}
+    
+    files = index["files"]
+    current = {p.name: p for p in sorted(docs_dir.glob("*.md"))} if docs_dir.exists() else {}
+    changed = [name for name in files if name not in current]
+    for name in changed:
+        del files[name]
+    for name, md_file in current.items():
+        stat = md_file.stat()
+        entry = files.get(name)
+        if entry and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            continue
+        files[name] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                       "sections": _index_markdown_file(md_file)}
+        changed.append(name)
+    
+    if changed or "postings" not in index:
+        index["sections"], index["postings"], index["avg_length"] = _build_postings(files)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_name(f"{index_path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, index_path)
+    index["changed"] = changed
+    return index
+
+
+def refresh_search_index(config: dict) -> None:
+    """検索インデックスが作成済みの場合のみ、変更されたMarkdownを反映する"""
+    if not get_search_index_path(config).exists():
+        return
+    index = update_search_index(config)
+    if index["changed"]:
+        report(f"🔎 検索インデックスを更新しました: {len(index['changed'])}件",
+               event="search_index_updated", files=index["changed"])
+
+
+def search_index(index: dict, query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
+    """転置インデックスをBM25でスコア付けし、上位のセクションを返す"""
+    terms = set(tokenize_search_text(query))
+    postings = index["postings"]
+    sections = index["sections"]
+    files = index["files"]
+    avg_length = index["avg_length"] or 1.0
+    
+    scores = {}
+    for term in terms:
+        matches = postings.get(term)
+        if not matches:
+            continue
+        idf = math.log(1 + (len(sections) - len(matches) + 0.5) / (len(matches) + 0.5))
+        for section_id, count in matches:
+            name, position = sections[section_id]
+            length = files[name]["sections"][position]["length"]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            scores[section_id] = scores.get(section_id, 0.0) + idf * count * (BM25_K1 + 1) / (count + norm)
+    
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+    results = []
+    for section_id, score in ranked:
+        name, position = sections[section_id]
+        section = files[name]["sections"][position]
+        results.append({"file": name, "heading": section["heading"], "line": section["line"],
+                        "score": round(score, 3)})
+    return results
+
+
+def search_snippet(md_path: str | Path, line: int, query: str,
+                   width: int = SEARCH_SNIPPET_WIDTH) -> str:
+    """セクション内で検索語が現れる箇所の前後を抜粋する"""
+    lines = Path(md_path).read_text(encoding="utf-8").splitlines()
+    sections = split_markdown_sections("\n".join(lines[line - 1:]))
+    text = " ".join((sections[0]["text"] if sections else "").split())
+    normalized = normalize_search_text(text)
+    position = normalized.find(normalize_search_text(query.strip()))
+    if position < 0:
+        position = max((normalized.find(t) for t in tokenize_search_text(query)), default=-1)
+    start = max(position - width, 0) if position >= 0 else 0
+    snippet = text[start:start + width * 2 + len(query)]
+    return ("…" if start > 0 else "") + snippet + ("…" if start + len(snippet) < len(text) else "")
+
+
+def search_mode(config: dict, query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
+    """全文検索インデックスを更新してから検索し、結果を表示する"""
+    index = update_search_index(config)
+    if index["changed"]:
+        report(f"🔎 検索インデックスを更新しました: {len(index['changed'])}件")
+    
+    search_start = time.perf_counter()
+    results = search_index(index, query, limit)
+    search_ms = (time.perf_counter() - search_start) * 1000
+    
+    docs_dir = Path(config.get("output_dir", "docs"))
+    report(f"🔎 「{query}」の検索結果: {len(results)}件（{search_ms:.1f}ms）",
+           event="search_summary", level="result", query=query, hits=len(results), search_ms=search_ms)
+    for rank, result in enumerate(results, start=1):
+        result["snippet"] = search_snippet(docs_dir / result["file"], result["line"], query)
+        report(f"\n{rank}. {result['file']}:{result['line']}  {result['heading'] or '（冒頭）'}"
+               f"  [score {result['score']}]", event="search_result", level="result",
+               rank=rank, **result)
+        report(f"   {result['snippet']}", level="result")
+    return results
+
+
+EXPORT_DB_VERSION = 1
+
+
+def get_export_db_path(config: dict) -> Path:
+    """SQLiteエクスポートのデフォルトのパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "export" / "guides.sqlite3"
+
+
+def heading_paths(sections: list[dict]) -> list[str]:
+    """各セクションの見出しを上位の見出しから「 > 」でつないだパスを返す"""
+    stack = []
+    paths = []
+    for section in sections:
+        if section["level"]:
+            stack = [h for h in stack if h[0] < section["level"]]
+            stack.append((section["level"], strip_inline_markup(section["heading"])))
+        paths.append(" > ".join(heading for _, heading in stack))
+    return paths
+
+
+def open_export_db(db_path: str | Path) -> sqlite3.Connection:
+    """エクスポート用のSQLiteデータベースを開く（スキーマがなければ作成する）
+
+    日本語を部分一致で検索できるよう、FTS5はtrigramトークナイザを優先し、
+    使えないSQLiteではunicode61を使う。
+    """
+    path = Path(db_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != EXPORT_DB_VERSION:
+        conn.executescript("""
+            DROP TABLE IF EXISTS sections_fts;
+            DROP TABLE IF EXISTS images;
+            DROP TABLE IF EXISTS sections;
+            DROP TABLE IF EXISTS documents;
+            CREATE TABLE documents (
+                id INTEGER PRIMARY KEY,
+                file TEXT NOT NULL UNIQUE,
+                name TEXT,
+                version TEXT,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE sections (
+                id INTEGER PRIMARY KEY,
+                document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+                position INTEGER NOT NULL,
+                heading TEXT NOT NULL,
+                heading_path TEXT NOT NULL,
+                level INTEGER NOT NULL,
+                line INTEGER NOT NULL,
+                text TEXT NOT NULL
+            );
+            CREATE TABLE images (
+                section_id INTEGER NOT NULL REFERENCES sections(id) ON DELETE CASCADE,
+                alt TEXT NOT NULL,
+                path TEXT NOT NULL
+            );
+            CREATE INDEX sections_document ON sections(document_id, position);
+            CREATE INDEX images_section ON images(section_id);
+        """)
+        try:
+            conn.execute("CREATE VIRTUAL TABLE sections_fts USING fts5("
+                         "heading_path, text, tokenize='trigram')")
+        except sqlite3.OperationalError:
+            conn.execute("CREATE VIRTUAL TABLE sections_fts USING fts5(heading_path, text)")
+        conn.execute(f"PRAGMA user_version = {EXPORT_DB_VERSION}")
+        conn.commit()
+    return conn
+
+
+def export_sqlite(config: dict, db_path: str | Path | None = None) -> dict:
+    """docs/*.mdをセクション単位でSQLite（FTS5索引付き）に書き出す
+
+    更新日時とサイズが変わった文書だけを削除・再登録し、
+    すべての変更を1つのトランザクションでまとめて反映する。
+    """
+    db_path = Path(db_path) if db_path else get_export_db_path(config)
+    docs_dir = Path(config.get("output_dir", "docs"))
+    pdf_entries = {p.get("output_filename"): p for p in config.get("pdfs", [])}
+    current = {p.name: p for p in sorted(docs_dir.glob("*.md"))} if docs_dir.exists() else {}
+    
+    conn = open_export_db(db_path)
+    stats = {"path": str(db_path), "documents": len(current), "updated": [], "removed": [],
+             "sections": 0}
+    try:
+        with conn:
+            existing = {row["file"]: row for row in conn.execute("SELECT * FROM documents")}
+            stale = [name for name in existing if name not in current]
+            for name, md_file in current.items():
+                stat = md_file.stat()
+                row = existing.get(name)
+                if row is None or (row["mtime_ns"], row["size"]) != (stat.st_mtime_ns, stat.st_size):
+                    stale.append(name)
+            for name in stale:
+                if name in existing:
+                    conn.execute("DELETE FROM sections_fts WHERE rowid IN "
+                                 "(SELECT id FROM sections WHERE document_id = ?)", (existing[name]["id"],))
+                    conn.execute("DELETE FROM documents WHERE id = ?", (existing[name]["id"],))
+                if name not in current:
+                    stats["removed"].append(name)
+            
+            for name in stale:
+                if name not in current:
+                    continue
+                md_file = current[name]
+                stat = md_file.stat()
+                entry = pdf_entries.get(name, {})
+                document_id = conn.execute(
+                    "INSERT INTO documents (file, name, version, mtime_ns, size) VALUES (?, ?, ?, ?, ?)",
+                    (name, entry.get("name"), entry.get("version"), stat.st_mtime_ns, stat.st_size),
+                ).lastrowid
+                sections = split_markdown_sections(md_file.read_text(encoding="utf-8"))
+                for position, (section, path) in enumerate(zip(sections, heading_paths(sections))):
+                    section_id = conn.execute(
+                        "INSERT INTO sections (document_id, position, heading, heading_path, level, line, text)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (document_id, position, strip_inline_markup(section["heading"]), path,
+                         section["level"], section["line"], section["text"]),
+                    ).lastrowid
+                    conn.execute("INSERT INTO sections_fts (rowid, heading_path, text) VALUES (?, ?, ?)",
+                                 (section_id, path, section["text"]))
+                    conn.executemany("INSERT INTO images (section_id, alt, path) VALUES (?, ?, ?)",
+                                     [(section_id, alt, ref)
+                                      for alt, ref in IMAGE_REF_RE.findall(section["text"])])
+                stats["updated"].append(name)
+        stats["sections"] = conn.execute("SELECT COUNT(*) FROM sections").fetchone()[0]
+    finally:
+        conn.close()
+    return stats
+
+
+def refresh_sqlite_export(config: dict) -> None:
+    """SQLiteエクスポートが作成済みの場合のみ、変更された文書を反映する"""
+    if not get_export_db_path(config).exists():
+        return
+    stats = export_sqlite(config)
+    if stats["updated"] or stats["removed"]:
+        report(f"🗄️  SQLiteエクスポートを更新しました: {len(stats['updated'])}件",
+               event="sqlite_export_updated", updated=stats["updated"], removed=stats["removed"])
+
+
+DIFF_SIMILARITY = 0.5
+DIFF_PREVIEW_CHARS = 80
+
+
+def split_paragraphs(text: str) -> list[str]:
+    """セクション本文を空行区切りの段落に分割する（見出し行は除き、空白は1つにまとめる）"""
+    lines = text.splitlines()
+    if lines and HEADING_RE.match(lines[0]):
+        lines = lines[1:]
+    return [" ".join(block.split()) for block in re.split(r'\n\s*\n', "\n".join(lines)) if block.strip()]
+
+
+def _heading_key(heading: str) -> str:
+    """版の違いによる表記ゆれを吸収した見出しの比較キー"""
+    return re.sub(r'\s+', "", normalize_search_text(strip_inline_markup(heading)))
+
+
+def _dice_similarity(a: set, b: set) -> float:
+    """2つのトークン集合の類似度（Dice係数、0〜1）"""
+    if not a and not b:
+        return 1.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def _pair_blocks(old_items: list, new_items: list, text) -> list[tuple]:
+    """置き換えられた要素を、類似度が閾値以上のものは対応付け、それ以外は削除・追加とする
+
+    長いセクションどうしでも比較が線形時間で済むよう、類似度は
+    文字n-gramの集合のDice係数で判定する。
+    """
+    old_tokens = [set(tokenize_search_text(text(item))) for item in old_items]
+    new_tokens = [set(tokenize_search_text(text(item))) for item in new_items]
+    pairs = []
+    j = 0
+    for old, tokens in zip(old_items, old_tokens):
+        match = next((k for k in range(j, len(new_items))
+                      if _dice_similarity(tokens, new_tokens[k]) >= DIFF_SIMILARITY), None)
+        if match is None:
+            pairs.append((old, None))
+            continue
+        pairs.extend((None, new) for new in new_items[j:match])
+        pairs.append((old, new_items[match]))
+        j = match + 1
+    pairs.extend((None, new) for new in new_items[j:])
+    return pairs
+
+
+def diff_paragraphs(old_text: str, new_text: str) -> list[dict]:
+    """2つのセクション本文の段落単位の差分（added / removed / modified）を返す"""
+    old_paragraphs = split_paragraphs(old_text)
+    new_paragraphs = split_paragraphs(new_text)
+    matcher = difflib.SequenceMatcher(None, old_paragraphs, new_paragraphs, autojunk=False)
+    changes = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        for old, new in _pair_blocks(old_paragraphs[i1:i2], new_paragraphs[j1:j2], lambda p: p):
+            kind = "modified" if old is not None and new is not None else "removed" if new is None else "added"
+            changes.append({"type": kind, "old": old, "new": new})
+    return changes
+
+
+def diff_documents(old_text: str, new_text: str) -> list[dict]:
+    """2つのMarkdownを見出し単位のセクションで対応付け、セクションごとの差分を返す
+
+    見出しの並びを比較して対応付け、見出しが変わったセクションは
+    本文の類似度で対応付ける。
+    """
+    old_sections = split_markdown_sections(old_text)
+    new_sections = split_markdown_sections(new_text)
+    for sections in (old_sections, new_sections):
+        for section, path in zip(sections, heading_paths(sections)):
+            section["path"] = path
+    
+    matcher = difflib.SequenceMatcher(None, [_heading_key(s["heading"]) for s in old_sections],
+                                      [_heading_key(s["heading"]) for s in new_sections], autojunk=False)
+    pairs = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            pairs.extend(zip(old_sections[i1:i2], new_sections[j1:j2]))
+        else:
+            pairs.extend(_pair_blocks(old_sections[i1:i2], new_sections[j1:j2],
+                                      lambda s: " ".join(split_paragraphs(s["text"]))))
+    
+    result = []
+    for old, new in pairs:
+        entry = {
+            "old_path": old["path"] if old else None, "old_line": old["line"] if old else None,
+            "new_path": new["path"] if new else None, "new_line": new["line"] if new else None,
+        }
+        if old is None:
+            entry["status"] = "added"
+            entry["changes"] = [{"type": "added", "old": None, "new": p}
+                                for p in split_paragraphs(new["text"])]
+        elif new is None:
+            entry["status"] = "removed"
+            entry["changes"] = [{"type": "removed", "old": p, "new": None}
+                                for p in split_paragraphs(old["text"])]
+        else:
+            entry["changes"] = diff_paragraphs(old["text"], new["text"])
+            entry["status"] = ("modified" if entry["changes"] or old["heading"] != new["heading"]
+                               else "unchanged")
+        result.append(entry)
+    return result
+
+
+def resolve_document_path(config: dict, name: str) -> Path:
+    """バージョン・PDF名・ファイル名・パスのいずれかから変換済みMarkdownのパスを求める"""
+    docs_dir = Path(config.get("output_dir", "docs"))
+    for pdf_info in config.get("pdfs", []):
+        if name in (pdf_info.get("version"), pdf_info.get("name"), pdf_info.get("output_filename")):
+            return docs_dir / pdf_info["output_filename"]
+    path = Path(name)
+    return path if path.exists() else docs_dir / name
+
+
+def _preview(text: str | None) -> str:
+    """差分表示用に段落を短く切り詰める"""
+    if text is None:
+        return ""
+    return text if len(text) <= DIFF_PREVIEW_CHARS else text[:DIFF_PREVIEW_CHARS] + "…"
+
+
+def format_diff_report(old_name: str, new_name: str, sections: list[dict]) -> str:
+    """セクション差分をMarkdownの変更レポートに整形する"""
+    counts = {status: sum(1 for s in sections if s["status"] == status)
+              for status in ("added", "removed", "modified", "unchanged")}
+    lines = [f"# {old_name} → {new_name}", "",
+             f"- 追加: {counts['added']}セクション",
+             f"- 削除: {counts['removed']}セクション",
+             f"- 変更: {counts['modified']}セクション",
+             f"- 変更なし: {counts['unchanged']}セクション"]
+    labels = {"added": "追加", "removed": "削除", "modified": "変更"}
+    for section in sections:
+        if section["status"] == "unchanged":
+            continue
+        path = section["new_path"] if section["new_path"] is not None else section["old_path"]
+        lines += ["", f"## [{labels[section['status']]}] {path or '（冒頭）'}"]
+        if section["status"] == "modified" and section["old_path"] != section["new_path"]:
+            lines.append(f"見出し: {section['old_path'] or '（冒頭）'} → {section['new_path'] or '（冒頭）'}")
+        lines.append("")
+        for change in section["changes"]:
+            if change["old"] is not None:
+                lines.append(f"- {change['old']}")
+            if change["new"] is not None:
+                lines.append(f"+ {change['new']}")
+    return "\n".join(lines) + "\n"
+
+
+def diff_mode(config: dict, old_name: str, new_name: str, output_path: str | None = None) -> list[dict]:
+    """2つの版の変換済みMarkdownをセクション単位で比較し、変更を表示する"""
+    old_path = resolve_document_path(config, old_name)
+    new_path = resolve_document_path(config, new_name)
+    for path in (old_path, new_path):
+        if not path.exists():
+            report(f"❌ エラー: {path} が見つかりません", level="error")
+            sys.exit(1)
+    
+    diff_start = time.perf_counter()
+    sections = diff_documents(old_path.read_text(encoding="utf-8"), new_path.read_text(encoding="utf-8"))
+    diff_ms = (time.perf_counter() - diff_start) * 1000
+    
+    marks = {"added": "+", "removed": "-", "modified": "~"}
+    report(f"🆚 {old_path.name} → {new_path.name}")
+    for section in sections:
+        if section["status"] == "unchanged":
+            continue
+        path = section["new_path"] if section["new_path"] is not None else section["old_path"]
+        report(f"  {marks[section['status']]} {path or '（冒頭）'}（段落 {len(section['changes'])}件）",
+               event="diff_section", **{k: v for k, v in section.items() if k != "changes"},
+               changes=len(section["changes"]))
+        for change in section["changes"]:
+            if change["type"] == "modified":
+                report(f"      - {_preview(change['old'])}")
+                report(f"      + {_preview(change['new'])}")
+            else:
+                report(f"      {'+' if change['type'] == 'added' else '-'} "
+                       f"{_preview(change['new'] if change['type'] == 'added' else change['old'])}")
+    
+    counts = {status: sum(1 for s in sections if s["status"] == status)
+              for status in ("added", "removed", "modified", "unchanged")}
+    report(f"📊 追加 {counts['added']}・削除 {counts['removed']}・変更 {counts['modified']}・"
+           f"変更なし {counts['unchanged']}セクション（{diff_ms:.0f}ms）",
+           event="diff_summary", level="result", old=str(old_path), new=str(new_path),
+           diff_ms=diff_ms, **counts)
+    
+    if output_path:
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(output_path).write_text(format_diff_report(old_path.name, new_path.name, sections),
+                                     encoding="utf-8")
+        report(f"💾 変更レポートを保存しました: {output_path}", level="result")
+    return sections
+
+
+SIMILARITY_MIN_SCORE = 0.2
+
+
+def get_similarity_dir(config: dict) -> Path:
+    """セクション類似度の出力ディレクトリを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "similarity"
+
+
+def load_version_sections(config: dict) -> list[dict]:
+    """docs/*.mdを版の古い順に読み込み、本文のあるセクションを列挙する"""
+    docs_dir = Path(config.get("output_dir", "docs"))
+    versions = {p.get("output_filename"): p.get("version") for p in config.get("pdfs", [])}
+    md_files = sorted(docs_dir.glob("*.md") if docs_dir.exists() else [],
+                      key=lambda p: (versions.get(p.name) is None, versions.get(p.name) or "", p.name))
+    sections = []
+    for md_file in md_files:
+        parsed = split_markdown_sections(md_file.read_text(encoding="utf-8"))
+        for section, path in zip(parsed, heading_paths(parsed)):
+            if split_paragraphs(section["text"]):
+                sections.append({"file": md_file.name, "version": versions.get(md_file.name),
+                                 "heading": section["heading"], "path": path,
+                                 "line": section["line"], "text": section["text"]})
+    return sections
+
+
+def build_tfidf_matrix(texts: list[str]):
+    """各テキストのTF-IDFベクトル（L2正規化）を行とする行列を作る
+
+    語の出現は疎な(行, 列, 回数)の組として集計する。1つのテキストにしか
+    現れない語は異なるテキストどうしの内積に寄与しないため、正規化にだけ
+    使って行列の列からは除き、密行列の行列積で類似度を一括計算できる大きさに抑える。
+    """
+    import numpy as np
+    
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for row, text in enumerate(texts):
+        ids = [vocabulary.setdefault(token, len(vocabulary)) for token in tokenize_search_text(text)]
+        if not ids:
+            continue
+        unique, count = np.unique(np.array(ids, dtype=np.int64), return_counts=True)
+        rows.append(np.full(len(unique), row, dtype=np.int64))
+        cols.append(unique)
+        counts.append(count)
+    if not rows:
+        return np.zeros((len(texts), 0), dtype=np.float32)
+    rows, cols, counts = np.concatenate(rows), np.concatenate(cols), np.concatenate(counts)
+    
+    df = np.bincount(cols, minlength=len(vocabulary))
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1
+    weights = (1 + np.log(counts)) * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(texts)))
+    weights /= np.where(norms > 0, norms, 1)[rows]
+    
+    shared = df > 1
+    column_index = np.cumsum(shared) - 1
+    keep = shared[cols]
+    matrix = np.zeros((len(texts), int(shared.sum())), dtype=np.float32)
+    matrix[rows[keep], column_index[cols[keep]]] = weights[keep]
+    return matrix
+
+
+def align_sections(similarity, old_sections: list[dict], new_sections: list[dict],
+                   min_score: float = SIMILARITY_MIN_SCORE) -> list[dict]:
+    """類似度行列から、旧版の各セクションに最も近い新版のセクションを対応付ける
+
+    相互に最も近い組をmutualとし、見出しが変わったものをrenamed、
+    上位の見出しが変わったものをmovedとして印を付ける。
+    """
+    import numpy as np
+    
+    if not old_sections or not new_sections:
+        return [{"old": s["path"], "old_line": s["line"], "new": None, "new_line": None,
+                 "score": 0.0, "mutual": False, "renamed": False, "moved": False}
+                for s in old_sections]
+    best_new = similarity.argmax(axis=1)
+    best_old = similarity.argmax(axis=0)
+    alignments = []
+    for i, j in enumerate(best_new):
+        score = float(similarity[i, j])
+        old, new = old_sections[i], new_sections[j]
+        matched = score >= min_score
+        alignments.append({
+            "old": old["path"], "old_line": old["line"],
+            "new": new["path"] if matched else None, "new_line": new["line"] if matched else None,
+            "score": round(score, 4),
+            "mutual": bool(matched and best_old[j] == i),
+            "renamed": bool(matched and _heading_key(old["heading"]) != _heading_key(new["heading"])),
+            "moved": bool(matched and old["path"].rpartition(" > ")[0] != new["path"].rpartition(" > ")[0]),
+        })
+    return alignments
+
+
+def compute_section_similarity(config: dict, min_score: float = SIMILARITY_MIN_SCORE) -> dict:
+    """全版のセクション間のコサイン類似度を1回の行列積で求め、隣り合う版どうしを対応付ける
+
+    結果はcache/similarity/に対応付け（alignments.json）と、ヒートマップ用の
+    類似度行列（heatmap.npy）およびその行・列のラベル（heatmap.json）として保存する。
+    """
+    import numpy as np
+    
+    sections = load_version_sections(config)
+    matrix = build_tfidf_matrix([s["text"] for s in sections])
+    similarity = matrix @ matrix.T
+    
+    files = list(dict.fromkeys(s["file"] for s in sections))
+    ranges = {}
+    for index, section in enumerate(sections):
+        start, _ = ranges.get(section["file"], (index, index))
+        ranges[section["file"]] = (start, index + 1)
+    
+    pairs = []
+    for old_file, new_file in zip(files, files[1:]):
+        (o1, o2), (n1, n2) = ranges[old_file], ranges[new_file]
+        alignments = align_sections(similarity[o1:o2, n1:n2], sections[o1:o2], sections[n1:n2], min_score)
+        pairs.append({"old": old_file, "new": new_file, "alignments": alignments})
+    
+    output_dir = get_similarity_dir(config)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "alignments.json", "w", encoding="utf-8") as f:
+        json.dump({"min_score": min_score, "pairs": pairs}, f, ensure_ascii=False, indent=2)
+    # 行列はJSONにすると書き出しが変換時間の大半を占めるため、NumPy形式で保存する
+    np.save(output_dir / "heatmap.npy", similarity)
+    with open(output_dir / "heatmap.json", "w", encoding="utf-8") as f:
+        json.dump({
+            "matrix": "heatmap.npy",
+            "labels": [{"file": s["file"], "version": s["version"], "path": s["path"], "line": s["line"]}
+                       for s in sections],
+            "documents": [{"file": name, "start": ranges[name][0], "end": ranges[name][1]} for name in files],
+        }, f, ensure_ascii=False, indent=2)
+    return {"sections": len(sections), "terms": matrix.shape[1], "pairs": pairs, "output_dir": str(output_dir)}
+
+
+def similarity_mode(config: dict, min_score: float = SIMILARITY_MIN_SCORE) -> dict:
+    """セクション類似度を計算し、隣り合う版ごとの対応付けの要約を表示する"""
+    start = time.perf_counter()
+    result = compute_section_similarity(config, min_score)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    for pair in result["pairs"]:
+        alignments = pair["alignments"]
+        matched = [a for a in alignments if a["new"] is not None]
+        report(f"🧭 {pair['old']} → {pair['new']}: 対応 {len(matched)}/{len(alignments)}"
+               f"（相互 {sum(a['mutual'] for a in matched)}・見出し変更 {sum(a['renamed'] for a in matched)}・"
+               f"移動 {sum(a['moved'] for a in matched)}）",
+               event="similarity_pair", old=pair["old"], new=pair["new"], sections=len(alignments),
+               matched=len(matched), mutual=sum(a["mutual"] for a in matched),
+               renamed=sum(a["renamed"] for a in matched), moved=sum(a["moved"] for a in matched))
+        for a in matched:
+            if a["mutual"] and (a["renamed"] or a["moved"]):
+                report(f"    {a['old'] or '（冒頭）'} → {a['new'] or '（冒頭）'}（{a['score']:.2f}）")
+    report(f"📊 {result['sections']}セクション・{result['terms']}語の類似度を計算しました"
+           f"（{elapsed_ms:.0f}ms）: {result['output_dir']}",
+           event="similarity_summary", level="result", sections=result["sections"],
+           terms=result["terms"], elapsed_ms=elapsed_ms, output_dir=result["output_dir"])
+    return result
+
+
+def refresh_section_similarity(config: dict) -> None:
+    """セクション類似度が計算済みの場合のみ、最新のMarkdownで再計算する"""
+    if not (get_similarity_dir(config) / "alignments.json").exists():
+        return
+    result = compute_section_similarity(config)
+    report(f"🧭 セクション類似度を更新しました: {result['sections']}セクション",
+           event="similarity_updated", sections=result["sections"])
+
+
+CHUNK_TARGET_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 64
+SENTENCE_END_RE = re.compile(r'(?<=[。．！？!?])')
+
+
+def estimate_tokens(text: str) -> int:
+    """LLMのトークン数の概算（日本語などは1文字1トークン、英数字は4文字1トークン）"""
+    ascii_chars = sum(1 for c in text if c.isascii() and not c.isspace())
+    other_chars = sum(1 for c in text if not c.isascii() and not c.isspace())
+    return other_chars + (ascii_chars + 3) // 4
+
+
+def _split_long_line(line: str, target: int) -> list[str]:
+    """目標サイズを超える行を文末で、文末がなければ文字数で分割する"""
+    pieces = []
+    for sentence in SENTENCE_END_RE.split(line):
+        while estimate_tokens(sentence) > target:
+            pieces.append(sentence[:target])
+            sentence = sentence[target:]
+        if sentence:
+            pieces.append(sentence)
+    return pieces
+
+
+def iter_markdown_chunks(md_path: str | Path, target_tokens: int = CHUNK_TARGET_TOKENS,
+                         overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+    """Markdownを1行ずつ読み、見出しをまたがないチャンクを順に返す（メモリ使用量はチャンク1つ分）
+
+    各チャンクは元ファイルのbyte_start〜byte_endのバイト列そのもので、
+    同じセクション内では直前のチャンクの末尾overlap_tokens程度を重ねる。
+    """
+    stack = []
+    path = ""
+    units = []  # (テキスト, 開始バイト, 終了バイト, トークン数)
+    fresh = 0
+    in_code = False
+    offset = 0
+    
+    def flush():
+        text = "".join(u[0] for u in units)
+        return {"heading_path": path, "byte_start": units[0][1], "byte_end": units[-1][2],
+                "tokens": sum(u[3] for u in units), "text": text}
+    
+    with open(md_path, "rb") as f:
+        for raw in f:
+            line = raw.decode("utf-8")
+            if line.lstrip().startswith(("```", "~~~")):
+                in_code = not in_code
+            match = None if in_code else HEADING_RE.match(line.rstrip("\n"))
+            if match:
+                if fresh:
+                    yield flush()
+                units, fresh = [], 0
+                level = len(match.group(1))
+                stack = [h for h in stack if h[0] < level] + [(level, strip_inline_markup(match.group(2)))]
+                path = " > ".join(heading for _, heading in stack)
+            
+            pieces = [line] if estimate_tokens(line) <= target_tokens else _split_long_line(line, target_tokens)
+            for piece in pieces:
+                size = len(piece.encode("utf-8"))
+                tokens = estimate_tokens(piece)
+                if fresh and sum(u[3] for u in units) + tokens > target_tokens:
+                    yield flush()
+                    # 末尾からoverlap_tokens以内の行を次のチャンクの先頭に残す
+                    kept, total = [], 0
+                    for unit in reversed(units):
+                        if total + unit[3] > overlap_tokens:
+                            break
+                        kept.insert(0, unit)
+                        total += unit[3]
+                    units, fresh = kept, 0
+                units.append((piece, offset, offset + size, tokens))
+                fresh += tokens
+                offset += size
+    if fresh:
+        yield flush()
+
+
+def get_chunks_path(config: dict) -> Path:
+    """チャンクのJSONLのデフォルトのパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "export" / "chunks.jsonl"
+
+
+def export_chunks(config: dict, output_path: str | Path | None = None,
+                  target_tokens: int = CHUNK_TARGET_TOKENS,
+                  overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> dict:
+    """docs/*.mdのチャンクを1パスでJSONLに書き出す（一時ファイル経由で置き換え）"""
+    if target_tokens <= 0:
+        raise ValueError("チャンクの目標サイズは1以上にしてください")
+    if not 0 <= overlap_tokens < target_tokens:
+        raise ValueError("チャンクの重なりは0以上、目標サイズ未満にしてください")
+    output_path = Path(output_path) if output_path else get_chunks_path(config)
+    docs_dir = Path(config.get("output_dir", "docs"))
+    pdf_entries = {p.get("output_filename"): p for p in config.get("pdfs", [])}
+    md_files = sorted(docs_dir.glob("*.md")) if docs_dir.exists() else []
+    
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f"{output_path.name}.tmp")
+    stats = {"path": str(output_path), "documents": len(md_files), "chunks": 0, "tokens": 0}
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        for md_file in md_files:
+            entry = pdf_entries.get(md_file.name, {})
+            for number, chunk in enumerate(iter_markdown_chunks(md_file, target_tokens, overlap_tokens)):
+                record = {"id": f"{md_file.name}#{number}", "source": md_file.name,
+                          "name": entry.get("name"), "version": entry.get("version"), **chunk}
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["chunks"] += 1
+                stats["tokens"] += chunk["tokens"]
+    os.replace(tmp_path, output_path)
+    return stats
+
+
+def refresh_chunk_export(config: dict) -> None:
+    """チャンクのJSONLが作成済みの場合のみ、最新のMarkdownで書き出し直す"""
+    if not get_chunks_path(config).exists():
+        return
+    stats = export_chunks(config)
+    report(f"🧩 チャンクを更新しました: {stats['chunks']}件", event="chunks_updated", **stats)
+
+
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+
+
+def paragraph_hash(paragraph: str) -> str:
+    """段落の正規化ハッシュ（全角・半角、空白や改行位置の違いを無視する）"""
+    normalized = re.sub(r'\s+', "", unicodedata.normalize("NFKC", paragraph))
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:16]
+
+
+def build_paragraph_store(config: dict) -> dict:
+    """docs/*.mdの段落をハッシュで1回だけ保存し、文書ごとの段落ハッシュの並びを作る
+
+    同じハッシュの段落は最初に現れた版（古い順）の本文を代表として保存する。
+    """
+    docs_dir = Path(config.get("output_dir", "docs"))
+    entries = {p.get("output_filename"): p for p in config.get("pdfs", [])}
+    md_files = sorted(docs_dir.glob("*.md") if docs_dir.exists() else [],
+                      key=lambda p: (entries.get(p.name, {}).get("version") is None,
+                                     entries.get(p.name, {}).get("version") or "", p.name))
+    paragraphs = {}
+    documents = {}
+    for md_file in md_files:
+        sequence = []
+        for block in PARAGRAPH_BREAK_RE.split(md_file.read_text(encoding="utf-8")):
+            block = block.strip("\n")
+            if not block.strip():
+                continue
+            key = paragraph_hash(block)
+            paragraphs.setdefault(key, block)
+            sequence.append(key)
+        entry = entries.get(md_file.name, {})
+        documents[md_file.name] = {"name": entry.get("name"), "version": entry.get("version"),
+                                   "paragraphs": sequence}
+    return {"paragraphs": paragraphs, "documents": documents}
+
+
+def reconstruct_document(store: dict, file_name: str) -> str:
+    """段落ストアから文書の本文を復元する（段落の間は空行1つ）"""
+    paragraphs = store["paragraphs"]
+    return "\n\n".join(paragraphs[key] for key in store["documents"][file_name]["paragraphs"]) + "\n"
+
+
+def paragraph_duplication(store: dict) -> dict:
+    """文書ごと・版の組ごとの重複率（段落のバイト数基準）と、ストアによる削減量を求める"""
+    sizes = {key: len(text.encode("utf-8")) for key, text in store["paragraphs"].items()}
+    sets = {name: set(doc["paragraphs"]) for name, doc in store["documents"].items()}
+    owners = {}
+    for name, keys in sets.items():
+        for key in keys:
+            owners[key] = owners.get(key, 0) + 1
+    
+    documents = {}
+    for name, doc in store["documents"].items():
+        total = sum(sizes[key] for key in doc["paragraphs"])
+        shared = sum(sizes[key] for key in doc["paragraphs"] if owners[key] > 1)
+        documents[name] = {"paragraphs": len(doc["paragraphs"]), "bytes": total,
+                           "shared_bytes": shared, "shared_ratio": shared / total if total else 0.0}
+    
+    # pairs[a][b]: aの段落のうちbにも含まれる割合
+    pairs = {a: {b: (sum(sizes[key] for key in store["documents"][a]["paragraphs"] if key in sets[b])
+                     / documents[a]["bytes"] if documents[a]["bytes"] else 0.0)
+                 for b in sets if b != a}
+             for a in sets}
+    corpus_bytes = sum(documents[name]["bytes"] for name in documents)
+    store_bytes = sum(sizes.values())
+    return {"documents": documents, "pairs": pairs, "corpus_bytes": corpus_bytes,
+            "store_bytes": store_bytes, "unique_paragraphs": len(sizes)}
+
+
+def dedup_report(config: dict) -> dict:
+    """版どうしの段落の重複率と、共通段落を1回だけ保存した場合の削減量を表示する"""
+    store = build_paragraph_store(config)
+    stats = paragraph_duplication(store)
+    labels = {name: doc["version"] or Path(name).stem for name, doc in store["documents"].items()}
+    names = list(store["documents"])
+    
+    report(f"\n{'='*70}")
+    report("♻️  段落の重複率（行の版の段落のうち列の版にも含まれる割合、バイト数基準）")
+    report(f"{'='*70}")
+    report(" " * 10 + "".join(f"{labels[n][:8]:>9}" for n in names))
+    for a in names:
+        cells = "".join(f"{'-':>9}" if a == b else f"{stats['pairs'][a][b]:>9.0%}" for b in names)
+        report(f"{labels[a][:9]:<10}{cells}", event="dedup_document", document=a,
+               **stats["documents"][a], pairs=stats["pairs"][a])
+    
+    saved = stats["corpus_bytes"] - stats["store_bytes"]
+    ratio = saved / stats["corpus_bytes"] if stats["corpus_bytes"] else 0.0
+    report(f"\n📦 全文 {stats['corpus_bytes']:,} bytes → 段落ストア {stats['store_bytes']:,} bytes"
+           f"（{saved:,} bytes・{ratio:.1%}削減、段落 {stats['unique_paragraphs']}件）",
+           event="dedup_summary", level="result", corpus_bytes=stats["corpus_bytes"],
+           store_bytes=stats["store_bytes"], unique_paragraphs=stats["unique_paragraphs"])
+    
+    # --near-duplicatesの結果があれば、段落ハッシュでは別扱いになるほぼ同じセクションも表示
+    near_path = get_similarity_dir(config) / "near_duplicates.json"
+    if near_path.exists():
+        with open(near_path, encoding="utf-8") as f:
+            near = json.load(f)
+        counts = {}
+        for pair in near.get("pairs", []):
+            if pair.get("exact"):
+                continue
+            key = tuple(sorted((pair["a"]["version"] or pair["a"]["file"],
+                                pair["b"]["version"] or pair["b"]["file"])))
+            counts[key] = counts.get(key, 0) + 1
+        stats["near_duplicates"] = {f"{first}|{second}": count for (first, second), count in counts.items()}
+        report(f"\n🔁 本文は異なるがほぼ同じ内容のセクション（Jaccard ≥ {near.get('threshold', 0):g}、"
+               f"{near_path}）: {sum(counts.values())}組")
+        for (first, second), count in sorted(counts.items()):
+            report(f"  {first} ↔ {second}: {count}組", event="dedup_near_duplicates",
+                   first=first, second=second, pairs=count)
+    return stats
+
+
+def get_corpus_path(config: dict) -> Path:
+    """重複を除いたコーパスのデフォルトのパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "export" / "corpus.jsonl"
+
+
+def export_corpus(config: dict, output_path: str | Path | None = None) -> dict:
+    """共通段落を1回だけ保存したコーパスをJSONLに書き出す
+
+    先に段落（hash・text・含まれる版）を、続いて文書ごとの段落ハッシュの並びを
+    1行ずつ書き出す。文書はreconstruct_documentと同じ手順で復元できる。
+    """
+    store = build_paragraph_store(config)
+    output_path = Path(output_path) if output_path else get_corpus_path(config)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    
+    # 段落ごとの含まれる版（バージョンがない文書はファイル名）
+    containing = {}
+    for name, doc in store["documents"].items():
+        for key in dict.fromkeys(doc["paragraphs"]):
+            containing.setdefault(key, []).append(doc["version"] or name)
+    
+    tmp_path = output_path.with_name(f"{output_path.name}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for key, text in store["paragraphs"].items():
+            f.write(json.dumps({"type": "paragraph", "hash": key, "text": text,
+                                "documents": containing[key]}, ensure_ascii=False) + "\n")
+        for name, doc in store["documents"].items():
+            f.write(json.dumps({"type": "document", "file": name, **doc}, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, output_path)
+    return {"path": str(output_path), "documents": len(store["documents"]),
+            "paragraphs": len(store["paragraphs"]),
+            "text_bytes": sum(len(text.encode("utf-8")) for text in store["paragraphs"].values()),
+            "bytes": output_path.stat().st_size}
+
+
+MINHASH_PERMUTATIONS = 128
+MINHASH_SHINGLE_SIZE = 5
+MINHASH_MIN_SHINGLES = 20
+MINHASH_SEED = 1
+NEAR_DUPLICATE_THRESHOLD = 0.8
+MINHASH_PRIME = (1 << 32) + 15
+
+
+def parse_jaccard_threshold(value: str) -> float:
+    """--near-duplicate-thresholdの値を0より大きく1以下のJaccard係数として解釈する"""
+    try:
+        threshold = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"数値ではありません: {value}")
+    if not 0 < threshold <= 1:
+        raise argparse.ArgumentTypeError(f"Jaccard係数は0より大きく1以下で指定してください: {value}")
+    return threshold
+
+
+def section_shingles(text: str, size: int = MINHASH_SHINGLE_SIZE) -> set[int]:
+    """空白を除いた正規化済みの本文から、文字size-gramのハッシュ値の集合を作る"""
+    normalized = re.sub(r'\s+', "", normalize_search_text(strip_inline_markup(text)))
+    return {zlib.crc32(normalized[i:i + size].encode("utf-8"))
+            for i in range(len(normalized) - size + 1)}
+
+
+def minhash_signatures(shingle_sets: list[set[int]], permutations: int = MINHASH_PERMUTATIONS,
+                       seed: int = MINHASH_SEED):
+    """各集合のMinHashシグネチャ（permutations個のハッシュ関数それぞれの最小値）を行とする行列を返す
+
+    ハッシュ関数は (a * x + b) mod p の形で、集合ごとに全関数をまとめて計算する。
+    """
+    import numpy as np
+    
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=permutations, dtype=np.uint64)[:, None]
+    b = rng.integers(0, 1 << 31, size=permutations, dtype=np.uint64)[:, None]
+    signatures = np.full((len(shingle_sets), permutations), MINHASH_PRIME, dtype=np.uint64)
+    for row, shingles in enumerate(shingle_sets):
+        if shingles:
+            values = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))[None, :]
+            signatures[row] = ((a * values + b) % np.uint64(MINHASH_PRIME)).min(axis=1)
+    return signatures
+
+
+def lsh_parameters(permutations: int, threshold: float) -> tuple[int, int]:
+    """近似的な閾値 (1/bands)^(1/rows) が指定の閾値に最も近い (バンド数, 行数) を選ぶ"""
+    candidates = [(bands, permutations // bands) for bands in range(1, permutations + 1)
+                  if permutations % bands == 0]
+    return min(candidates, key=lambda c: abs((1 / c[0]) ** (1 / c[1]) - threshold))
+
+
+def lsh_candidate_pairs(signatures, bands: int, rows: int, groups: list | None = None) -> set[tuple[int, int]]:
+    """シグネチャをバンドに分け、いずれかのバンドが一致する組を候補とする
+
+    groupsが指定された場合、同じグループ（同じ文書）どうしの組は除く。
+    """
+    candidates = set()
+    for band in range(bands):
+        buckets = {}
+        for index, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+            buckets.setdefault(key, []).append(index)
+        for members in buckets.values():
+            for i, first in enumerate(members):
+                for second in members[i + 1:]:
+                    if groups is None or groups[first] != groups[second]:
+                        candidates.add((first, second))
+    return candidates
+
+
+def find_near_duplicates(config: dict, threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                         permutations: int = MINHASH_PERMUTATIONS) -> dict:
+    """全版のセクションから、異なる文書にあるほぼ同じ内容のセクションの組を探す
+
+    MinHash LSHで候補の組だけを選び、候補はシングルの集合の実際の
+    Jaccard係数で確認するため、全組の比較は行わない。
+    """
+    if not 0 < threshold <= 1:
+        raise ValueError(f"Jaccard係数は0より大きく1以下で指定してください: {threshold}")
+    sections = load_version_sections(config)
+    shingle_sets = [section_shingles(s["text"]) for s in sections]
+    keep = [i for i, shingles in enumerate(shingle_sets) if len(shingles) >= MINHASH_MIN_SHINGLES]
+    sections = [sections[i] for i in keep]
+    shingle_sets = [shingle_sets[i] for i in keep]
+    
+    bands, rows = lsh_parameters(permutations, threshold)
+    signatures = minhash_signatures(shingle_sets, permutations)
+    candidates = lsh_candidate_pairs(signatures, bands, rows, [s["file"] for s in sections])
+    
+    pairs = []
+    for i, j in candidates:
+        union = len(shingle_sets[i] | shingle_sets[j])
+        jaccard = len(shingle_sets[i] & shingle_sets[j]) / union if union else 0.0
+        if jaccard < threshold:
+            continue
+        pairs.append({
+            "a": {k: sections[i][k] for k in ("file", "version", "path", "line")},
+            "b": {k: sections[j][k] for k in ("file", "version", "path", "line")},
+            "jaccard": round(jaccard, 4),
+            "estimate": round(float((signatures[i] == signatures[j]).mean()), 4),
+            "exact": paragraph_hash(sections[i]["text"]) == paragraph_hash(sections[j]["text"]),
+        })
+    pairs.sort(key=lambda p: (-p["jaccard"], p["a"]["file"], p["a"]["line"]))
+    return {"threshold": threshold, "permutations": permutations, "bands": bands, "rows": rows,
+            "sections": len(sections), "candidates": len(candidates), "pairs": pairs}
+
+
+def near_duplicate_mode(config: dict, threshold: float = NEAR_DUPLICATE_THRESHOLD) -> dict:
+    """ほぼ同じ内容のセクションの組を表示し、cache/similarity/near_duplicates.jsonに保存する"""
+    start = time.perf_counter()
+    result = find_near_duplicates(config, threshold)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    
+    counts = {}
+    for pair in result["pairs"]:
+        key = (pair["a"]["version"] or pair["a"]["file"], pair["b"]["version"] or pair["b"]["file"])
+        counts[tuple(sorted(key))] = counts.get(tuple(sorted(key)), 0) + 1
+    report(f"🔁 ほぼ同じ内容のセクション（Jaccard ≥ {threshold:g}）: {len(result['pairs'])}組")
+    for (first, second), count in sorted(counts.items()):
+        report(f"  {first} ↔ {second}: {count}組")
+    for pair in result["pairs"]:
+        if not pair["exact"]:
+            report(f"  ≈ {pair['a']['file']}:{pair['a']['line']} {pair['a']['path'] or '（冒頭）'} ↔ "
+                   f"{pair['b']['file']}:{pair['b']['line']} {pair['b']['path'] or '（冒頭）'}"
+                   f"（{pair['jaccard']:.2f}）", event="near_duplicate", **pair)
+    
+    output_path = get_similarity_dir(config) / "near_duplicates.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    report(f"📊 {result['sections']}セクション・候補 {result['candidates']}組から"
+           f"{len(result['pairs'])}組を検出しました（{elapsed_ms:.0f}ms）: {output_path}",
+           event="near_duplicate_summary", level="result", sections=result["sections"],
+           candidates=result["candidates"], pairs=len(result["pairs"]), elapsed_ms=elapsed_ms)
+    return result
+
+
+SITE_BUILD_VERSION = 1
+SITE_MANIFEST_NAME = ".build-manifest.json"
+SITE_SEARCH_INDEX_NAME = "search-index.json"
+SITE_STYLESHEET = (
+    "*{box-sizing:border-box}"
+    "body{margin:0 auto;max-width:52rem;padding:1rem 1.25rem 4rem;font:16px/1.8 system-ui,-apple-system,"
+    "\"Hiragino Sans\",\"Noto Sans JP\",sans-serif;color:#1f2328;background:#fff}"
+    "nav{padding:.5rem 0;border-bottom:1px solid #d0d7de;margin-bottom:1.5rem}"
+    "a{color:#0969da;text-decoration:none}a:hover{text-decoration:underline}"
+    "h1,h2,h3,h4,h5,h6{line-height:1.4;margin:2rem 0 1rem}h1{font-size:1.8rem}h2{font-size:1.5rem}"
+    "h3{font-size:1.3rem}h4{font-size:1.15rem}"
+    "img{max-width:100%;height:auto}"
+    "table{border-collapse:collapse;margin:1rem 0;display:block;overflow-x:auto}"
+    "th,td{border:1px solid #d0d7de;padding:.3rem .7rem}th{background:#f6f8fa}"
+    "pre{background:#f6f8fa;padding:1rem;overflow-x:auto}code{font-size:.9em}"
+    "blockquote{margin:0;padding:0 1rem;color:#59636e;border-left:.25rem solid #d0d7de}"
+    "#q{width:100%;padding:.5rem;font-size:1rem}#r li{margin:.5rem 0}"
+)
+SITE_SEARCH_SCRIPT = (
+    "let d;const q=document.getElementById(\"q\"),r=document.getElementById(\"r\");"
+    "q.addEventListener(\"input\",async()=>{d=d||await(await fetch(\"" + SITE_SEARCH_INDEX_NAME + "\")).json();"
+    "const t=q.value.normalize(\"NFKC\").toLowerCase().trim();r.textContent=\"\";if(!t)return;"
+    "for(const[p,i,h,x]of d.sections){const k=x.indexOf(t);if(k<0)continue;"
+    "const a=document.createElement(\"a\"),l=document.createElement(\"li\");"
+    "a.href=d.pages[p].file+(i?\"#\"+encodeURIComponent(i):\"\");a.textContent=d.pages[p].title+(h?\" > \"+h:\"\");"
+    "l.append(a,\" \"+x.slice(Math.max(0,k-30),k+60));r.append(l);if(r.children.length>=50)break}})"
+)
+LIST_ITEM_RE = re.compile(r'^(\s*)([-*+]|\d+[.)])\s+(.*)$')
+TABLE_SEPARATOR_RE = re.compile(r'^\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+HORIZONTAL_RULE_RE = re.compile(r'^\s*([-*_])(\s*\1){2,}\s*$')
+INLINE_RE = re.compile(
+    r'(?P<code>`[^`]+`)'
+    r'|!\[(?P<alt>[^\]]*)\]\((?P<src>[^)\s]+)\)'
+    r'|\[(?P<label>[^\]]+)\]\((?P<href>[^)\s]+)\)'
+    r'|<(?P<url>https?://[^<>\s]+|[^<>\s@]+@[^<>\s@]+\.[^<>\s@]+)>'
+    r'|(?P<tag></?[a-zA-Z][a-zA-Z0-9]*(?:\s[^<>]*)?/?>)'
+    r'|\*\*(?P<strong>.+?)\*\*'
+    r'|\*(?P<em>[^*\s](?:[^*]*[^*\s])?)\*'
+)
+
+
+def get_site_dir(config: dict) -> Path:
+    """静的HTMLサイトのデフォルトの出力ディレクトリを取得する"""
+    return Path(config.get("site_dir", "site"))
+
+
+def get_site_registry_path(config: dict) -> Path:
+    """ビルド済みの静的HTMLサイトの出力先一覧のパスを取得する"""
+    return Path(config.get("cache_dir", "cache")) / "site_dirs.json"
+
+
+def _registered_site_dirs(config: dict) -> list[str]:
+    """--build-siteで指定されたことのある出力先（絶対パス）の一覧を読み込む"""
+    registry_path = get_site_registry_path(config)
+    if not registry_path.exists():
+        return []
+    with open(registry_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_site_dirs(config: dict) -> list[Path]:
+    """デフォルトの出力先と、--build-siteで指定されたことのある出力先の一覧を返す"""
+    site_dirs = [get_site_dir(config).resolve()] + [Path(p) for p in _registered_site_dirs(config)]
+    return list(dict.fromkeys(site_dirs))
+
+
+def register_site_dir(config: dict, site_dir: Path) -> None:
+    """静的HTMLサイトの出力先を、変換後の自動更新の対象として記録する"""
+    registered = _registered_site_dirs(config)
+    site_dir = site_dir.resolve()
+    if site_dir == get_site_dir(config).resolve() or str(site_dir) in registered:
+        return
+    registry_path = get_site_registry_path(config)
+    registry_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(registry_path, "w", encoding="utf-8") as f:
+        json.dump(registered + [str(site_dir)], f, ensure_ascii=False, indent=2)
+
+
+def heading_anchor(heading: str, used: set) -> str:
+    """見出しのリンク先IDを返す（見出し内のid属性があればそれを使い、なければ見出し文字列から作る）"""
+    match = ANCHOR_ID_RE.search(heading)
+    if match:
+        anchor = match.group(1)
+    else:
+        anchor = re.sub(r'[^\w\-]+', "", re.sub(r'\s+', "-", normalize_search_text(strip_inline_markup(heading))))
+        anchor = anchor.strip("-") or "section"
+    base, number = anchor, 2
+    while anchor in used:
+        anchor = f"{base}-{number}"
+        number += 1
+    used.add(anchor)
+    return anchor
+
+
+def render_inline(text: str, images: dict | None = None) -> str:
+    """Markdownの行内要素（コード・画像・リンク・強調・インラインHTML）をHTMLに変換する
+
+    imagesは画像参照から<img>の属性への対応で、含まれない画像はそのままのパスで出力する。
+    他のMarkdownファイルへのリンクは.htmlへのリンクに書き換える。
+    """
+    parts = []
+    position = 0
+    for match in INLINE_RE.finditer(text):
+        parts.append(html.escape(text[position:match.start()], quote=False))
+        position = match.end()
+        if match.group("code"):
+            parts.append(f"<code>{html.escape(match.group('code')[1:-1], quote=False)}</code>")
+        elif match.group("src") is not None:
+            attrs = dict((images or {}).get(match.group("src"), {"src": match.group("src")}))
+            attrs["alt"] = match.group("alt")
+            parts.append("<img" + "".join(f' {k}="{html.escape(str(v))}"' for k, v in attrs.items()) + ">")
+        elif match.group("href") is not None:
+            href = re.sub(r'\.md(?=$|#)', ".html", match.group("href"))
+            parts.append(f'<a href="{html.escape(href)}">{render_inline(match.group("label"), images)}</a>')
+        elif match.group("url"):
+            url = match.group("url")
+            href = url if url.startswith("http") else f"mailto:{url}"
+            parts.append(f'<a href="{html.escape(href)}">{html.escape(url, quote=False)}</a>')
+        elif match.group("tag"):
+            parts.append(match.group("tag"))
+        elif match.group("strong") is not None:
+            parts.append(f"<strong>{render_inline(match.group('strong'), images)}</strong>")
+        else:
+            parts.append(f"<em>{render_inline(match.group('em'), images)}</em>")
+    parts.append(html.escape(text[position:], quote=False))
+    return "".join(parts)
+
+
+def _split_table_row(line: str) -> list[str]:
+    """表の1行をセルの文字列に分ける"""
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+
+def render_markdown_html(text: str, images: dict | None = None,
+                         used: set | None = None) -> tuple[str, list[str]]:
+    """変換済みMarkdownを要素間に空白を入れないHTMLに変換し、見出しのID一覧とともに返す
+
+    marker-pdfが出力する範囲（見出し・段落・入れ子のリスト・表・コードブロック・
+    引用・区切り線・画像・リンク・強調・インラインHTML）に対応する。
+    ID一覧はsplit_markdown_sectionsのセクションと対応するよう、引用内の見出しを含まない。
+    """
+    out = []
+    anchors = []
+    used = set() if used is None else used
+    paragraph = []
+    lists = []
+    lines = text.splitlines()
+    
+    def flush_paragraph():
+        if paragraph:
+            out.append(f"<p>{render_inline(chr(10).join(paragraph), images)}</p>")
+            paragraph.clear()
+    
+    def close_lists(indent: int = -1):
+        while lists and lists[-1][0] > indent:
+            out.append(f"</li></{lists.pop()[1]}>")
+    
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if stripped.startswith(("```", "~~~")):
+            flush_paragraph()
+            close_lists()
+            fence = stripped[:3]
+            language = stripped[3:].strip()
+            block = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith(fence):
+                block.append(lines[i])
+                i += 1
+            attr = f' class="language-{html.escape(language)}"' if language else ""
+            out.append(f"<pre><code{attr}>{html.escape(chr(10).join(block), quote=False)}</code></pre>")
+        elif not stripped:
+            flush_paragraph()
+        elif HEADING_RE.match(line):
+            flush_paragraph()
+            close_lists()
+            match = HEADING_RE.match(line)
+            level, heading = len(match.group(1)), match.group(2)
+            anchor = heading_anchor(heading, used)
+            anchors.append(anchor)
+            id_attr = "" if ANCHOR_ID_RE.search(heading) else f' id="{html.escape(anchor)}"'
+            out.append(f"<h{level}{id_attr}>{render_inline(heading, images)}</h{level}>")
+        elif stripped.startswith("|") and i + 1 < len(lines) and TABLE_SEPARATOR_RE.match(lines[i + 1]):
+            flush_paragraph()
+            close_lists()
+            aligns = []
+            for cell in _split_table_row(lines[i + 1]):
+                if cell.startswith(":") and cell.endswith(":"):
+                    aligns.append(' style="text-align:center"')
+                elif cell.endswith(":"):
+                    aligns.append(' style="text-align:right"')
+                else:
+                    aligns.append("")
+            header = _split_table_row(line)
+            aligns += [""] * len(header)
+            rows = []
+            i += 2
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                cells = _split_table_row(lines[i])
+                rows.append("<tr>" + "".join(f"<td{aligns[n] if n < len(aligns) else ''}>"
+                                             f"{render_inline(cell, images)}</td>"
+                                             for n, cell in enumerate(cells)) + "</tr>")
+                i += 1
+            out.append("<table><thead><tr>" + "".join(f"<th{aligns[n]}>{render_inline(cell, images)}</th>"
+                                                      for n, cell in enumerate(header))
+                       + "</tr></thead><tbody>" + "".join(rows) + "</tbody></table>")
+            continue
+        elif LIST_ITEM_RE.match(line):
+            flush_paragraph()
+            match = LIST_ITEM_RE.match(line)
+            indent = len(match.group(1).expandtabs(4))
+            tag = "ol" if match.group(2)[0].isdigit() else "ul"
+            close_lists(indent)
+            if lists and lists[-1][0] == indent and lists[-1][1] != tag:
+                close_lists(indent - 1)
+            if lists and lists[-1][0] == indent:
+                out.append("</li><li>")
+            else:
+                lists.append((indent, tag))
+                out.append(f"<{tag}><li>")
+            out.append(render_inline(match.group(3), images))
+        elif lists and line[:1].isspace():
+            # リスト項目の継続行
+            out.append("\n" + render_inline(stripped, images))
+        elif stripped.startswith(">"):
+            flush_paragraph()
+            close_lists()
+            quoted = []
+            while i < len(lines) and lines[i].strip().startswith(">"):
+                quoted.append(re.sub(r'^\s*>\s?', "", lines[i]))
+                i += 1
+            # 引用内の見出しにもIDは付けるが、セクションにはならないため一覧には加えない
+            inner, _ = render_markdown_html("\n".join(quoted), images, used)
+            out.append(f"<blockquote>{inner}</blockquote>")
+            continue
+        elif HORIZONTAL_RULE_RE.match(line):
+            flush_paragraph()
+            close_lists()
+            out.append("<hr>")
+        else:
+            close_lists()
+            paragraph.append(stripped)
+        i += 1
+    flush_paragraph()
+    close_lists()
+    return "".join(out), anchors
+
+
+def markdown_plain_text(text: str) -> str:
+    """Markdownから記法（見出し・リスト・表の記号、画像、リンク先）を除いた本文を返す"""
+    text = IMAGE_REF_RE.sub("", text)
+    text = re.sub(r'\[([^\]]+)\]\([^)\s]+\)', r'\1', text)
+    text = "\n".join(line for line in text.splitlines() if not TABLE_SEPARATOR_RE.match(line))
+    text = re.sub(r'^(#{1,6}|\s*(?:[-*+]|\d+[.)]))\s+', "", text, flags=re.MULTILINE)
+    text = strip_inline_markup(text.replace("|", " "))
+    return re.sub(r'\s+', " ", text).strip()
+
+
+def image_dimensions(path: Path) -> tuple[int, int] | None:
+    """PNG・GIF画像のヘッダーから幅と高さを読み取る（それ以外の形式はNone）"""
+    with open(path, "rb") as f:
+        header = f.read(24)
+    if header[:8] == b"\x89PNG\r\n\x1a\n" and header[12:16] == b"IHDR":
+        return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return int.from_bytes(header[6:8], "little"), int.from_bytes(header[8:10], "little")
+    return None
+
+
+def _file_signature(path: Path) -> list[int] | None:
+    """差分ビルドの判定に使うファイルの更新日時とサイズ（存在しなければNone）"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _publish_site_image(source: Path, site_dir: Path) -> dict:
+    """画像を内容のハッシュをファイル名にしてサイトにコピーし、<img>の属性を返す
+
+    ファイル名が内容で決まるため、長期間キャッシュさせても更新が反映され、
+    版どうしで同じ画像は1つのファイルにまとまる。
+    """
+    data = source.read_bytes()
+    name = f"{hashlib.sha256(data).hexdigest()[:16]}{source.suffix.lower()}"
+    target = site_dir / "images" / name
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(data)
+    attrs = {"src": f"images/{name}"}
+    dimensions = image_dimensions(source)
+    if dimensions:
+        attrs["width"], attrs["height"] = dimensions
+    attrs.update({"loading": "lazy", "decoding": "async"})
+    return attrs
+
+
+def _site_page_html(title: str, body: str, stylesheet: str, head: str = "") -> str:
+    """共通のスタイルシートを参照するHTMLページを組み立てる"""
+    return (f'<!DOCTYPE html><html lang="ja"><head><meta charset="utf-8">'
+            f'<meta name="viewport" content="width=device-width,initial-scale=1">'
+            f'<title>{html.escape(title, quote=False)}</title><link rel="stylesheet" href="{stylesheet}">{head}'
+            f'</head><body><nav><a href="index.html">目次</a></nav><main>{body}</main></body></html>')
+
+
+def build_site_page(config: dict, md_path: Path, site_dir: Path, stylesheet: str) -> dict:
+    """1つのMarkdownをHTMLページに変換し、差分ビルド用の情報と検索用のセクションを返す"""
+    text = md_path.read_text(encoding="utf-8")
+    images = {}
+    for ref in dict.fromkeys(src for _, src in IMAGE_REF_RE.findall(text)):
+        source = md_path.parent / ref
+        if source.is_file():
+            images[ref] = _publish_site_image(source, site_dir)
+    body, anchors = render_markdown_html(text, images)
+    
+    title = get_document_title(config, md_path) or md_path.stem
+    html_name = f"{md_path.stem}.html"
+    output = _site_page_html(title, body, stylesheet)
+    (site_dir / html_name).write_text(output, encoding="utf-8")
+    
+    parsed = split_markdown_sections(text)
+    headed = iter(anchors)
+    sections = []
+    for section, path in zip(parsed, heading_paths(parsed)):
+        anchor = next(headed, "") if section["level"] else ""
+        content = normalize_search_text(markdown_plain_text(section["text"]))
+        if content:
+            sections.append([anchor, strip_inline_markup(path), content])
+    return {"html": html_name, "title": title, "signature": _file_signature(md_path),
+            "images": {ref: _file_signature(md_path.parent / ref) for ref in images},
+            "published": sorted(attrs["src"] for attrs in images.values()),
+            "bytes": len(output.encode("utf-8")), "sections": sections}
+
+
+def build_site(config: dict, site_dir: str | Path | None = None, rebuild: bool = False) -> dict:
+    """docs/*.mdから静的HTMLサイト（共通スタイルシート・画像・検索インデックス付き）を差分ビルドする
+
+    前回のビルドからMarkdownか参照している画像の更新日時・サイズが変わったページだけを
+    作り直す。config.jsonのタイトルが変わったページも作り直し、目次と検索インデックスに反映する。
+    スタイルシートやビルドの形式が変わった場合はすべて作り直す。
+    """
+    site_dir = Path(site_dir) if site_dir else get_site_dir(config)
+    docs_dir = Path(config.get("output_dir", "docs"))
+    manifest_path = site_dir / SITE_MANIFEST_NAME
+    stylesheet = f"style.{hashlib.sha256(SITE_STYLESHEET.encode('utf-8')).hexdigest()[:10]}.css"
+    
+    manifest = None
+    if manifest_path.exists() and not rebuild:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    if (not manifest or manifest.get("version") != SITE_BUILD_VERSION or manifest.get("stylesheet") != stylesheet
+            or not (site_dir / SITE_SEARCH_INDEX_NAME).exists()):
+        manifest = {"version": SITE_BUILD_VERSION, "stylesheet": stylesheet, "pages": {}}
+    site_dir.mkdir(parents=True, exist_ok=True)
+    if not (site_dir / stylesheet).exists():
+        (site_dir / stylesheet).write_text(SITE_STYLESHEET, encoding="utf-8")
+    
+    pages = manifest["pages"]
+    current = {p.name: p for p in sorted(docs_dir.glob("*.md"))} if docs_dir.exists() else {}
+    stats = {"path": str(site_dir), "pages": len(current), "built": [], "removed": [], "unchanged": 0}
+    # 変更のないページの検索用セクションは前回の検索インデックスから引き継ぐ
+    sections = {}
+    if pages:
+        with open(site_dir / SITE_SEARCH_INDEX_NAME, encoding="utf-8") as f:
+            previous = json.load(f)
+        for number, *section in previous["sections"]:
+            sections.setdefault(previous["pages"][number]["file"], []).append(section)
+    for name in [name for name in pages if name not in current]:
+        (site_dir / pages.pop(name)["html"]).unlink(missing_ok=True)
+        stats["removed"].append(name)
+    for name, md_path in current.items():
+        entry = pages.get(name)
+        if (entry and entry["signature"] == _file_signature(md_path)
+                and entry["title"] == (get_document_title(config, md_path) or md_path.stem)
+                and (site_dir / entry["html"]).exists()
+                and all(_file_signature(md_path.parent / ref) == signature
+                        for ref, signature in entry["images"].items())):
+            stats["unchanged"] += 1
+            continue
+        pages[name] = build_site_page(config, md_path, site_dir, stylesheet)
+        sections[pages[name]["html"]] = pages[name].pop("sections")
+        stats["built"].append(name)
+    
+    if stats["built"] or stats["removed"] or not (site_dir / "index.html").exists():
+        published = {src for page in pages.values() for src in page["published"]}
+        if (site_dir / "images").exists():
+            for image in (site_dir / "images").iterdir():
+                if f"images/{image.name}" not in published:
+                    image.unlink()
+        for old in site_dir.glob("style.*.css"):
+            if old.name != stylesheet:
+                old.unlink()
         
-        # 一時ファイルをクリーンアップ
-        if os.path.exists(temp_pdf):
-            os.remove(temp_pdf)
+        ordered = sorted(pages.values(), key=lambda page: page["html"])
+        search = {"pages": [{"file": page["html"], "title": page["title"]} for page in ordered],
+                  "sections": [[number, *section] for number, page in enumerate(ordered)
+                               for section in sections.get(page["html"], [])]}
+        with open(site_dir / SITE_SEARCH_INDEX_NAME, "w", encoding="utf-8") as f:
+            json.dump(search, f, ensure_ascii=False, separators=(",", ":"))
+        listing = "".join(f'<li><a href="{html.escape(page["html"])}">{html.escape(page["title"], quote=False)}</a></li>'
+                          for page in ordered)
+        index_body = (f'<h1>スクラムガイド</h1><input id="q" type="search" placeholder="検索" aria-label="検索">'
+                      f'<ul id="r"></ul><ul>{listing}</ul><script>{SITE_SEARCH_SCRIPT}</script>')
+        (site_dir / "index.html").write_text(_site_page_html("スクラムガイド", index_body, stylesheet),
+                                             encoding="utf-8")
         
-        return False
+        tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+    
+    register_site_dir(config, site_dir)
+    stats["bytes"] = sum(page["bytes"] for page in pages.values())
+    return stats
+
+
+def refresh_site(config: dict) -> None:
+    """ビルド済みの静的HTMLサイト（--build-siteで指定した出力先を含む）の、変更されたページを作り直す"""
+    for site_dir in load_site_dirs(config):
+        if not (site_dir / SITE_MANIFEST_NAME).exists():
+            continue
+        stats = build_site(config, site_dir)
+        if stats["built"] or stats["removed"]:
+            report(f"🌐 静的サイトを更新しました: {len(stats['built'])}ページ（{site_dir}）",
+                   event="site_updated", path=str(site_dir), built=stats["built"], removed=stats["removed"])
 
 
 def optimize_only_mode(config: dict):
     """既存のMarkdownファイルを最適化のみ実行"""
-    print("🔧 Markdown最適化モード")
-    print(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print()
+    report("🔧 Markdown最適化モード")
+    report(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report("")
     
     docs_dir = Path(config.get("output_dir", "docs"))
     
     if not docs_dir.exists():
-        print(f"❌ エラー: {docs_dir} ディレクトリが見つかりません")
+        report(f"❌ エラー: {docs_dir} ディレクトリが見つかりません", level="error")
         sys.exit(1)
     
     md_files = sorted(docs_dir.glob('*.md'))
     
     if not md_files:
-        print(f"❌ エラー: {docs_dir} にMarkdownファイルが見つかりません")
+        report(f"❌ エラー: {docs_dir} にMarkdownファイルが見つかりません", level="error")
         sys.exit(1)
     
-    print(f"📚 処理対象: {len(md_files)}件のMarkdownファイル\n")
+    report(f"📚 処理対象: {len(md_files)}件のMarkdownファイル\n")
     
     total_original = 0
     total_new = 0
     
     for md_file in md_files:
-        print(f"{'='*70}")
-        print(f"📄 {md_file.name}")
-        print(f"{'='*70}")
+        report(f"{'='*70}")
+        report(f"📄 {md_file.name}")
+        report(f"{'='*70}")
         
         original_size, new_size = optimize_markdown_file(str(md_file))
         
@@ -396,43 +4371,58 @@ def optimize_only_mode(config: dict):
             reduction = original_size - new_size
             percentage = (reduction / original_size * 100) if original_size > 0 else 0
             
-            print(f"  元のサイズ: {original_size:,} bytes")
-            print(f"  新サイズ  : {new_size:,} bytes")
-            print(f"  削減量    : {reduction:,} bytes ({percentage:.1f}%)")
-            print(f"  ✅ 最適化完了\n")
+            report(f"  元のサイズ: {original_size:,} bytes")
+            report(f"  新サイズ  : {new_size:,} bytes")
+            report(f"  削減量    : {reduction:,} bytes ({percentage:.1f}%)")
+            report(f"  ✅ 最適化完了\n", event="optimize_complete", path=str(md_file),
+                   bytes_before=original_size, bytes_after=new_size)
+        
+        # 分割済みの場合は最適化後の内容で章のファイルを作り直す
+        if list_chapter_files(md_file):
+            chapter_files = split_markdown_chapters(md_file, get_document_title(config, md_file))
+            report(f"  📑 章のファイルを更新しました: {len(chapter_files) - 1}章\n")
     
     total_reduction = total_original - total_new
     total_percentage = (total_reduction / total_original * 100) if total_original > 0 else 0
     
-    print(f"{'='*70}")
-    print(f"🎉 すべての最適化が完了しました")
-    print(f"{'='*70}")
-    print(f"合計削減量: {total_reduction:,} bytes ({total_percentage:.1f}%)")
-    print(f"元の合計  : {total_original:,} bytes")
-    print(f"新しい合計: {total_new:,} bytes")
-    print(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report(f"{'='*70}")
+    report(f"🎉 すべての最適化が完了しました")
+    report(f"{'='*70}")
+    report(f"合計削減量: {total_reduction:,} bytes ({total_percentage:.1f}%)", event="optimize_summary",
+           level="result", files=len(md_files), bytes_before=total_original, bytes_after=total_new)
+    report(f"元の合計  : {total_original:,} bytes", level="result")
+    report(f"新しい合計: {total_new:,} bytes", level="result")
+    refresh_search_index(config)
+    refresh_sqlite_export(config)
+    refresh_section_similarity(config)
+    refresh_chunk_export(config)
+    refresh_site(config)
+    report(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 
 def verify_only_mode(config: dict):
     """既存のMarkdownファイルの画像参照を検証のみ実行"""
-    print("🔍 画像参照検証モード")
-    print(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print()
+    report("🔍 画像参照検証モード")
+    report(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report("")
     
     docs_dir = Path(config.get("output_dir", "docs"))
     image_dir = config.get("image_dir", "docs/images")
     
     if not docs_dir.exists():
-        print(f"❌ エラー: {docs_dir} ディレクトリが見つかりません")
+        report(f"❌ エラー: {docs_dir} ディレクトリが見つかりません", level="error")
         sys.exit(1)
     
     md_files = sorted(docs_dir.glob('*.md'))
     
     if not md_files:
-        print(f"❌ エラー: {docs_dir} にMarkdownファイルが見つかりません")
+        report(f"❌ エラー: {docs_dir} にMarkdownファイルが見つかりません", level="error")
         sys.exit(1)
     
-    print(f"📚 検証対象: {len(md_files)}件のMarkdownファイル\n")
+    # 章ごとに分割したファイルも検証する
+    md_files += [f for md_file in list(md_files) for f in list_chapter_files(md_file)]
+    
+    report(f"📚 検証対象: {len(md_files)}件のMarkdownファイル\n")
     
     total_refs = 0
     total_found = 0
@@ -442,30 +4432,31 @@ def verify_only_mode(config: dict):
         verify_result = verify_images(str(md_file), image_dir)
         
         if verify_result['references']:
-            print(f"{'='*70}")
-            print(f"📄 {verify_result['file']}")
-            print(f"{'='*70}")
+            report(f"{'='*70}")
+            report(f"📄 {md_file.relative_to(docs_dir).as_posix()}")
+            report(f"{'='*70}")
             
             for alt, path in verify_result['references']:
                 status = "✅" if path in verify_result['found'] else "❌"
-                print(f"  {status} {alt or '(no alt)'} -> {path}")
+                report(f"  {status} {alt or '(no alt)'} -> {path}")
             
             total_refs += len(verify_result['references'])
             total_found += len(verify_result['found'])
             total_missing += len(verify_result['missing'])
             
-            print(f"  📊 参照数: {len(verify_result['references'])}枚 "
-                  f"(検出: {len(verify_result['found'])}枚, "
-                  f"見つからない: {len(verify_result['missing'])}枚)\n")
-    
-    print(f"{'='*70}")
-    print(f"🎉 検証が完了しました")
-    print(f"{'='*70}")
-    print(f"総画像参照数: {total_refs}枚")
-    print(f"✅ 検出: {total_found}枚")
+            report(f"  📊 参照数: {len(verify_result['references'])}枚 "
+                   f"(検出: {len(verify_result['found'])}枚, "
+                   f"見つからない: {len(verify_result['missing'])}枚)\n")
+    
+    report(f"{'='*70}")
+    report(f"🎉 検証が完了しました")
+    report(f"{'='*70}")
+    report(f"総画像参照数: {total_refs}枚", event="verify_summary", level="result",
+           files=len(md_files), references=total_refs, found=total_found, missing=total_missing)
+    report(f"✅ 検出: {total_found}枚", level="result")
     if total_missing > 0:
-        print(f"❌ 見つからない: {total_missing}枚")
-    print(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        report(f"❌ 見つからない: {total_missing}枚", level="error")
+    report(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 
 
 def filter_pdfs(pdfs: list, args) -> list:
@@ -474,17 +4465,17 @@ def filter_pdfs(pdfs: list, args) -> list:
         filtered = [p for p in pdfs if p["name"] in args.files]
         not_found = set(args.files) - {p["name"] for p in filtered}
         if not_found:
-            print(f"⚠️  警告: 以下のファイルがconfig.jsonに見つかりません:")
+            report(f"⚠️  警告: 以下のファイルがconfig.jsonに見つかりません:", level="warning")
             for name in not_found:
-                print(f"  - {name}")
+                report(f"  - {name}")
         return filtered
     elif args.versions:
         filtered = [p for p in pdfs if p["version"] in args.versions]
         not_found = set(args.versions) - {p["version"] for p in filtered}
         if not_found:
-            print(f"⚠️  警告: 以下のバージョンがconfig.jsonに見つかりません:")
+            report(f"⚠️  警告: 以下のバージョンがconfig.jsonに見つかりません:", level="warning")
             for ver in not_found:
-                print(f"  - {ver}")
+                report(f"  - {ver}")
         return filtered
     return pdfs
 
@@ -516,6 +4507,94 @@ def main():
   
   # 処理時に画像参照も検証
   %(prog)s --verify
+  
+  # 4並列で処理（処理履歴に基づき時間の長いものから実行）
+  %(prog)s --jobs 4
+  
+  # 8コアを2ジョブで分け合う（1ジョブあたり4スレッド）
+  %(prog)s --jobs 2 --cpu-budget 8
+  
+  # ジョブ数×スレッド数の組み合わせを計測
+  %(prog)s --benchmark-threads --versions 2011-07 2011-10
+  
+  # 見積もりメモリの合計が12GBに収まる範囲で並列処理
+  %(prog)s --jobs 4 --max-memory 12G
+  
+  # 1つのPDFが30分を超えたら停止して次へ進む
+  %(prog)s --timeout 1800
+  
+  # 一時PDFファイルを作らずメモリ上で変換
+  %(prog)s --in-memory
+  
+  # テキストレイヤーのあるページはモデルを使わずに抽出
+  %(prog)s --fast-text
+  
+  # 中間ドキュメントをキャッシュしながら変換し、レンダリング設定の変更後に再生成
+  %(prog)s --document-cache
+  %(prog)s --rerender
+  
+  # 処理ステージごとのプロファイルを取得
+  %(prog)s --profile --versions 2020
+  
+  # 結果とエラーのみ表示 / JSON Linesのイベントとして出力
+  %(prog)s --quiet
+  %(prog)s --json --jobs 4
+  
+  # 実行ごとの処理時間の推移と、変換時間が30%%以上悪化した文書を表示
+  %(prog)s --history --regression-threshold 30
+  
+  # 全文検索インデックスを構築し、変換済みMarkdownを検索
+  %(prog)s --build-index
+  %(prog)s --search "スプリントレトロスペクティブ"
+  
+  # 2017年版と2020年版をセクション単位で比較し、変更レポートを保存
+  %(prog)s --diff 2017 2020 --diff-output cache/diffs/2017-2020.md
+  
+  # 版をまたいだセクションの対応付け（見出しの変更・移動を検出）
+  %(prog)s --similarity
+  
+  # 拡張パックの1つの章だけを見出し索引で読み込む
+  %(prog)s --section "Scrum Guide Expansion Pack" "拡張パックにおけるスクラムの作成物"
+  
+  # 版どうしの段落の重複率を表示し、重複を除いたコーパスを書き出す
+  %(prog)s --dedup-report
+  %(prog)s --export-corpus
+  
+  # 版をまたいでほぼ同じ内容（Jaccard係数0.7以上）のセクションを探す
+  %(prog)s --near-duplicates --near-duplicate-threshold 0.7
+  
+  # RAG用のチャンク（約300トークン、50トークン重ね）をJSONLに書き出す
+  %(prog)s --export-chunks --chunk-size 300 --chunk-overlap 50
+  
+  # セクション単位のSQLite（FTS5）に書き出す
+  %(prog)s --export-sqlite
+  %(prog)s --export-sqlite guides.sqlite3
+  
+  # 静的HTMLサイトをビルドする（変更されたページのみ再生成）
+  %(prog)s --build-site
+  
+  # 並列処理の重なりやアイドル時間をトレースで確認
+  %(prog)s --jobs 4 --trace
+  
+  # モデルを事前に取得・読み込みし、オフラインでも動作するか確認
+  %(prog)s --warmup
+  %(prog)s --warmup --offline
+  
+  # 短いPDFを合計60ページまでまとめて変換
+  %(prog)s --batch-pages 60 --versions 2011-07 2011-10 2013 2016 2017
+  
+  # 大きなガイドを章ごとのファイルと目次ページにも分割して出力
+  %(prog)s --files "Scrum Guide Expansion Pack" --split-chapters
+  
+  # 画像を抽出せずテキストのみ変換し、短縮される時間とメモリを計測
+  %(prog)s --no-images
+  %(prog)s --benchmark-images --versions 2020
+  
+  # 高速プロファイルで変換（画像抽出なし・低解像度）
+  %(prog)s --conversion-profile fast
+  
+  # プロファイルごとの処理時間と出力サイズを比較
+  %(prog)s --benchmark-profiles --versions 2020
         """
     )
     
@@ -560,6 +4639,317 @@ def main():
         help="既存のMarkdownファイルの画像参照を検証のみ実行"
     )
     
+    # 変換オプション
+    parser.add_argument(
+        "--conversion-profile",
+        choices=list(CONVERSION_PROFILES),
+        default=None,
+        help="変換プロファイル（fast: 高速・画像なし, balanced: marker-pdfの既定値, "
+             "accurate: 高解像度・高精度）。config.jsonの\"profile\"が優先"
+    )
+    
+    parser.add_argument(
+        "--split-chapters",
+        action="store_true",
+        help="変換したMarkdownを章ごとのファイルと目次ページ（docs/<ファイル名>/）にも分割して出力"
+    )
+    
+    parser.add_argument(
+        "--no-images",
+        action="store_true",
+        help="画像の抽出・保存を行わず、画像参照を代替テキストのプレースホルダーに置き換える"
+    )
+    
+    parser.add_argument(
+        "--fast-text",
+        action="store_true",
+        help="テキストレイヤーのあるページはモデルを使わず抽出し、スキャン・複雑なページのみmarker-pdfで変換"
+    )
+    
+    parser.add_argument(
+        "--batch-pages",
+        type=int,
+        default=None,
+        metavar="N",
+        help="合計Nページ以下になるよう小さいPDFを結合し、まとめて変換（モデルのバッチを埋めてスループットを向上）"
+    )
+    
+    # ダウンロード・キャッシュオプション
+    parser.add_argument(
+        "--in-memory",
+        action="store_true",
+        help="ダウンロードしたPDFを一時ファイルに保存せず、メモリ上で変換器に渡す"
+    )
+    
+    parser.add_argument(
+        "--document-cache",
+        action="store_true",
+        help="marker-pdfの中間ドキュメント（レイアウト・OCR結果）をPDFのハッシュごとにキャッシュし、同じPDFではモデル処理を省略"
+    )
+    
+    parser.add_argument(
+        "--rerender",
+        action="store_true",
+        help="キャッシュ済みの中間ドキュメントからダウンロード・モデル処理なしでMarkdownを再生成"
+    )
+    
+    # 並列処理オプション
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=1,
+        metavar="N",
+        help="同時に処理するPDFの数（デフォルト: 1）"
+    )
+    
+    parser.add_argument(
+        "--threads-per-job",
+        type=int,
+        metavar="N",
+        help="1ジョブあたりのtorch/OpenMP/MKLスレッド数（デフォルト: CPUコア予算 ÷ ジョブ数）"
+    )
+    
+    parser.add_argument(
+        "--cpu-budget",
+        type=int,
+        metavar="N",
+        help="全ジョブで使用するCPUコア数の上限（デフォルト: 論理CPU数）"
+    )
+    
+    parser.add_argument(
+        "--max-memory",
+        type=parse_memory_size,
+        metavar="SIZE",
+        help="同時実行する変換の見積もりメモリ合計の上限（例: 12G, 8192M）"
+    )
+    
+    parser.add_argument(
+        "--worker-memory",
+        type=parse_memory_size,
+        metavar="SIZE",
+        help="--max-memoryで各ワーカーに加える固定メモリ（デフォルト: 履歴の変換開始時RSSの最小値、なければ1G）"
+    )
+    
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="1つのPDFの処理時間の上限（秒）。超過したワーカーは停止して失敗扱い"
+    )
+    
+    parser.add_argument(
+        "--max-job-memory",
+        type=parse_memory_size,
+        metavar="SIZE",
+        help="1つの変換のメモリ使用量の上限（例: 6G）。超過したワーカーは停止して失敗扱い"
+    )
+    
+    parser.add_argument(
+        "--benchmark-threads",
+        action="store_true",
+        help="ジョブ数×スレッド数の組み合わせごとの変換スループットを計測"
+    )
+    
+    parser.add_argument(
+        "--benchmark-profiles",
+        action="store_true",
+        help="変換プロファイルごとの処理時間と出力サイズを比較"
+    )
+    
+    parser.add_argument(
+        "--benchmark-images",
+        action="store_true",
+        help="画像抽出あり・なし（--no-images）の処理時間とピークメモリを比較"
+    )
+    
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="処理ステージ（ダウンロード・変換・画像保存・最適化・検証）ごとにcProfileとtracemallocで計測し、"
+             "cache/profiles/に結果を保存"
+    )
+    
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=PROFILE_TOP_N,
+        metavar="N",
+        help=f"プロファイル要約に表示するホットスポットの件数（デフォルト: {PROFILE_TOP_N}）"
+    )
+    
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="実行・文書・処理ステージの階層的なスパンをChromeトレース形式でcache/traces/に保存"
+    )
+    
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="モデルの取得・読み込みと合成PDFの変換を行い、コールド/ウォーム読み込み時間とページあたりの変換時間を表示"
+    )
+    
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="--warmup時にネットワーク接続を禁止し、モデルがローカルにない場合は即座に失敗させる"
+    )
+    
+    parser.add_argument(
+        "--history",
+        action="store_true",
+        help="実行履歴（cache/runs.sqlite3）から処理時間の推移と変換時間が悪化した文書を表示"
+    )
+    
+    parser.add_argument(
+        "--regression-threshold",
+        type=float,
+        default=REGRESSION_THRESHOLD,
+        metavar="PERCENT",
+        help=f"--historyで悪化とみなす変換時間の増加率（デフォルト: {REGRESSION_THRESHOLD:g}%%）"
+    )
+    
+    # 全文検索
+    parser.add_argument(
+        "--build-index",
+        action="store_true",
+        help="変換済みMarkdownの全文検索インデックス（見出し単位・文字n-gram）を構築・差分更新"
+    )
+    
+    parser.add_argument(
+        "--search",
+        metavar="QUERY",
+        help="変換済みMarkdownを全文検索し、関連度の高いセクションを表示"
+    )
+    
+    parser.add_argument(
+        "--similarity",
+        action="store_true",
+        help="全版のセクション間のTF-IDFコサイン類似度を計算し、隣り合う版のセクションの対応付けと"
+             "ヒートマップ用データをcache/similarity/に保存"
+    )
+    
+    parser.add_argument(
+        "--similarity-min-score",
+        type=float,
+        default=SIMILARITY_MIN_SCORE,
+        metavar="SCORE",
+        help=f"--similarityで対応ありとみなす類似度の下限（デフォルト: {SIMILARITY_MIN_SCORE}）"
+    )
+    
+    parser.add_argument(
+        "--build-site",
+        nargs="?",
+        const=True,
+        metavar="DIR",
+        help="変換済みMarkdownを共通スタイルシートと検索インデックス付きの静的HTMLサイトにする"
+             "（デフォルト: site/、変更されたページのみ再生成）"
+    )
+    
+    parser.add_argument(
+        "--export-sqlite",
+        nargs="?",
+        const=True,
+        metavar="PATH",
+        help="変換済みMarkdownをセクション単位でFTS5索引付きのSQLiteに書き出す"
+             "（デフォルト: cache/export/guides.sqlite3、変更された文書のみ更新）"
+    )
+    
+    parser.add_argument(
+        "--diff",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="2つの版（バージョン・PDF名・ファイル名）の変換済みMarkdownを見出し単位で比較し、段落ごとの変更を表示"
+    )
+    
+    parser.add_argument(
+        "--diff-output",
+        metavar="PATH",
+        help="--diffの変更レポートをMarkdownで保存するパス"
+    )
+    
+    parser.add_argument(
+        "--section",
+        nargs=2,
+        metavar=("DOCUMENT", "HEADING"),
+        help="見出し索引（docs/*.index.json）を使い、指定した見出しの章だけを読み込んで表示"
+    )
+    
+    parser.add_argument(
+        "--dedup-report",
+        action="store_true",
+        help="版どうしの段落の重複率と、共通段落を1回だけ保存した場合の削減量を表示"
+    )
+    
+    parser.add_argument(
+        "--near-duplicates",
+        action="store_true",
+        help="MinHash LSHで版をまたいでほぼ同じ内容のセクションを探し、cache/similarity/near_duplicates.jsonに保存"
+    )
+    
+    parser.add_argument(
+        "--near-duplicate-threshold",
+        type=parse_jaccard_threshold,
+        default=NEAR_DUPLICATE_THRESHOLD,
+        metavar="JACCARD",
+        help=f"--near-duplicatesでほぼ同じとみなすJaccard係数の下限（デフォルト: {NEAR_DUPLICATE_THRESHOLD}）"
+    )
+    
+    parser.add_argument(
+        "--export-corpus",
+        nargs="?",
+        const=True,
+        metavar="PATH",
+        help="共通段落を1回だけ保存したコーパスをJSONLに書き出す（デフォルト: cache/export/corpus.jsonl）"
+    )
+    
+    parser.add_argument(
+        "--export-chunks",
+        nargs="?",
+        const=True,
+        metavar="PATH",
+        help="変換済みMarkdownを見出しをまたがないRAG用チャンクに分割してJSONLに書き出す"
+             "（デフォルト: cache/export/chunks.jsonl）"
+    )
+    
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_TARGET_TOKENS,
+        metavar="TOKENS",
+        help=f"チャンクの目標サイズ（概算トークン数、デフォルト: {CHUNK_TARGET_TOKENS}）"
+    )
+    
+    parser.add_argument(
+        "--chunk-overlap",
+        type=int,
+        default=CHUNK_OVERLAP_TOKENS,
+        metavar="TOKENS",
+        help=f"同じセクション内で前のチャンクと重ねるトークン数（デフォルト: {CHUNK_OVERLAP_TOKENS}）"
+    )
+    
+    parser.add_argument(
+        "--search-limit",
+        type=int,
+        default=SEARCH_LIMIT,
+        metavar="N",
+        help=f"--searchで表示する結果の件数（デフォルト: {SEARCH_LIMIT}）"
+    )
+    
+    # 出力
+    output_group = parser.add_mutually_exclusive_group()
+    output_group.add_argument(
+        "--quiet", "-q",
+        action="store_true",
+        help="結果・警告・エラーのみ表示"
+    )
+    
+    output_group.add_argument(
+        "--json",
+        action="store_true",
+        help="進捗と結果をJSON Lines形式のイベントとして標準出力に出力"
+    )
+    
     # その他
     parser.add_argument(
         "--config", "-c",
@@ -570,9 +4960,105 @@ def main():
     
     args = parser.parse_args()
     
+    if args.batch_pages:
+        # バッチ変換は結合したPDFを1プロセスで変換するため、文書ごとの処理やワーカー制御は適用できない
+        unsupported = [flag for flag, enabled in (
+            ("--timeout", args.timeout), ("--max-job-memory", args.max_job_memory),
+            ("--in-memory", args.in_memory), ("--fast-text", args.fast_text),
+            ("--document-cache", args.document_cache), ("--rerender", args.rerender)) if enabled]
+        if unsupported:
+            parser.error(f"--batch-pagesは{', '.join(unsupported)}と併用できません")
+    
+    # 出力モードを設定（ワーカープロセスにも引き継ぐ）
+    args.output_mode = "json" if args.json else "quiet" if args.quiet else "text"
+    configure_output(args.output_mode)
+    
     # 設定を読み込む
     config = load_config(args.config)
     
+    # 全文検索インデックスの構築・検索モード
+    if args.build_index:
+        index = update_search_index(config)
+        report(f"🔎 検索インデックス: {len(index['files'])}ファイル・{len(index['sections'])}セクション"
+               f"（更新 {len(index['changed'])}件）: {get_search_index_path(config)}",
+               event="search_index_built", level="result", files=len(index["files"]),
+               sections=len(index["sections"]), changed=index["changed"])
+        return
+    
+    if args.search:
+        search_mode(config, args.search, args.search_limit)
+        return
+    
+    if args.diff:
+        diff_mode(config, args.diff[0], args.diff[1], args.diff_output)
+        return
+    
+    if args.similarity:
+        similarity_mode(config, args.similarity_min_score)
+        return
+    
+    if args.section:
+        md_path = resolve_document_path(config, args.section[0])
+        if not md_path.exists():
+            report(f"❌ エラー: {md_path} が見つかりません", level="error")
+            sys.exit(1)
+        text = read_section(md_path, args.section[1])
+        if text is None:
+            report(f"❌ エラー: 見出しが見つかりません: {args.section[1]}", level="error")
+            sys.exit(1)
+        report(text.rstrip("\n"), event="section", level="result",
+               file=md_path.name, heading=args.section[1])
+        return
+    
+    if args.near_duplicates:
+        near_duplicate_mode(config, args.near_duplicate_threshold)
+        return
+    
+    if args.dedup_report:
+        dedup_report(config)
+        return
+    
+    if args.export_corpus:
+        stats = export_corpus(config, None if args.export_corpus is True else args.export_corpus)
+        report(f"📦 重複を除いたコーパス: {stats['documents']}文書・段落 {stats['paragraphs']}件"
+               f"（本文 {stats['text_bytes']:,} bytes）: {stats['path']}",
+               event="corpus_exported", level="result", **stats)
+        return
+    
+    if args.export_chunks:
+        try:
+            stats = export_chunks(config, None if args.export_chunks is True else args.export_chunks,
+                                  args.chunk_size, args.chunk_overlap)
+        except ValueError as e:
+            parser.error(str(e))
+        report(f"🧩 チャンク: {stats['documents']}文書・{stats['chunks']}件・約{stats['tokens']:,}トークン"
+               f": {stats['path']}", event="chunks_exported", level="result", **stats)
+        return
+    
+    if args.build_site:
+        stats = build_site(config, None if args.build_site is True else args.build_site)
+        report(f"🌐 静的サイト: {stats['pages']}ページ（更新 {len(stats['built'])}件・"
+               f"変更なし {stats['unchanged']}件・削除 {len(stats['removed'])}件）: {stats['path']}",
+               event="site_built", level="result", **stats)
+        return
+    
+    if args.export_sqlite:
+        stats = export_sqlite(config, None if args.export_sqlite is True else args.export_sqlite)
+        report(f"🗄️  SQLiteエクスポート: {stats['documents']}文書・{stats['sections']}セクション"
+               f"（更新 {len(stats['updated'])}件・削除 {len(stats['removed'])}件）: {stats['path']}",
+               event="sqlite_export", level="result", **stats)
+        return
+    
+    # 実行履歴の表示モード
+    if args.history:
+        history_report(config, threshold=args.regression_threshold)
+        return
+    
+    # ウォームアップモード
+    if args.warmup:
+        warmup_mode(config, offline=args.offline)
+        return
+    
     # 最適化のみモード
     if args.optimize_only:
         optimize_only_mode(config)
@@ -584,9 +5070,9 @@ def main():
         return
     
     # 通常モード（ダウンロード・変換）
-    print("🚀 Scrum Guides PDF to Markdown Converter")
-    print(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print()
+    report("🚀 Scrum Guides PDF to Markdown Converter")
+    report(f"開始時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    report("")
     
     # ディレクトリを作成
     ensure_directories(config)
@@ -594,46 +5080,142 @@ def main():
     # PDFリストを取得
     pdfs = config.get("pdfs", [])
     if not pdfs:
-        print("❌ エラー: config.jsonにPDFが定義されていません")
+        report("❌ エラー: config.jsonにPDFが定義されていません", level="error")
         sys.exit(1)
     
     # PDFリストをフィルタリング
     pdfs = filter_pdfs(pdfs, args)
     
     if not pdfs:
-        print("❌ エラー: 処理対象のPDFがありません")
+        report("❌ エラー: 処理対象のPDFがありません", level="error")
         sys.exit(1)
     
-    print(f"\n📚 処理対象: {len(pdfs)}件のPDFファイル")
-    print()
+    if args.batch_pages:
+        timed = [p["name"] for p in pdfs if p.get("timeout")]
+        if timed:
+            report(f"❌ エラー: config.jsonでtimeoutを指定したPDFはバッチ変換できません: {', '.join(timed)}",
+                   level="error")
+            sys.exit(1)
+    
+    report(f"\n📚 処理対象: {len(pdfs)}件のPDFファイル")
+    report("")
+    
+    # 処理履歴を読み込み、並列処理時は時間の長いものから実行する
+    history_path = get_history_path(config)
+    history = load_history(history_path)
+    
+    # ジョブ数×スレッド数のベンチマーク
+    if args.benchmark_threads:
+        cpu_budget = args.cpu_budget or os.cpu_count() or 1
+        results = benchmark_thread_configs(pdfs, config, args, default_thread_grid(cpu_budget))
+        print_thread_benchmark(results)
+        save_benchmark_results(config, results, "threads")
+        return
+    
+    if args.fast_text:
+        args.model_seconds_per_page = estimate_model_seconds_per_page(history)
+    if args.profile:
+        args.profile_run = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    jobs, args.threads_per_job = resolve_thread_budget(
+        args.jobs, args.threads_per_job, args.cpu_budget)
+    if jobs == 1:
+        configure_threads(args.threads_per_job)
+    
+    if args.benchmark_profiles:
+        results = benchmark_profiles(pdfs, config, args, list(CONVERSION_PROFILES), jobs)
+        print_variant_benchmark(results, "プロファイル別ベンチマーク結果", label_key="profile")
+        save_benchmark_results(config, results, "profiles")
+        return
+    
+    if args.benchmark_images:
+        variants = {"images": {"no_images": False}, "no-images": {"no_images": True}}
+        results = benchmark_variants(pdfs, config, args, variants, "images", jobs)
+        print_variant_benchmark(results, "画像抽出あり・なしの比較")
+        print_image_savings(results)
+        save_benchmark_results(config, results, "images")
+        return
+    
+    if jobs > 1 and not args.batch_pages:
+        pdfs = schedule_pdfs(pdfs, history, probe_sizes=True)
+        report("📋 処理順序（見積もり時間の長い順）:")
+        for pdf_info in pdfs:
+            report(f"  - {pdf_info['name']}")
+        report("")
     
     # 各PDFを処理
     total_start = time.time()
+    started_at = datetime.now().isoformat(timespec='seconds')
     success_count = 0
     failed_count = 0
+    failures = []
+    
+    with tracing_session(args.trace) as trace_events, \
+            trace_span("run", {"documents": len(pdfs), "jobs": jobs}) as run_span:
+        if args.batch_pages:
+            if jobs > 1:
+                report(f"⚠️  警告: バッチ変換では--jobsは無視され、バッチを順に処理します", level="warning")
+            results = process_pdf_batches(pdfs, config, args, args.batch_pages)
+        else:
+            results = run_pdf_jobs(pdfs, config, args, jobs, history)
+        run_span["failed"] = sum(1 for _, success, _ in results if not success)
+    
+    if trace_events is not None:
+        for _, _, metrics in results:
+            trace_events.extend(metrics.pop("trace_events", []))
+        trace_path = (Path(config.get("cache_dir", "cache")) / "traces"
+                      / f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        write_trace(trace_path, trace_events)
+        report(f"🧭 トレースを保存しました: {trace_path}")
     
-    for index, pdf_info in enumerate(pdfs, start=1):
-        if process_pdf(pdf_info, config, args, index, len(pdfs)):
+    for pdf_info, success, metrics in results:
+        if success:
             success_count += 1
+            record_history(history, pdf_info["name"], metrics)
         else:
             failed_count += 1
+            failures.append((pdf_info["name"], metrics.get("error", "不明なエラー")))
+    
+    if success_count > 0:
+        save_history(history, history_path)
+        refresh_search_index(config)
+        refresh_sqlite_export(config)
+        refresh_section_similarity(config)
+        refresh_chunk_export(config)
+        refresh_site(config)
     
     # 最終結果を表示
     total_time = time.time() - total_start
-    print(f"\n{'='*70}")
-    print(f"🎉 すべての処理が完了しました")
-    print(f"{'='*70}")
-    print(f"✅ 成功: {success_count}件")
+    try:
+        record_run(get_run_history_db_path(config), results, {
+            "started_at": started_at,
+            "marker_version": get_marker_version(),
+            "jobs": jobs,
+            "total_time": total_time,
+            "options": {key: getattr(args, key, None) for key in (
+                "conversion_profile", "fast_text", "no_images", "in_memory", "batch_pages",
+                "document_cache", "rerender", "threads_per_job")},
+        })
+    except sqlite3.Error as e:
+        report(f"⚠️  警告: 実行履歴の記録に失敗しました: {e}", level="warning")
+    report(f"\n{'='*70}")
+    report(f"🎉 すべての処理が完了しました")
+    report(f"{'='*70}")
+    report(f"✅ 成功: {success_count}件", event="summary", level="result",
+           succeeded=success_count, failed=failed_count, total_time=total_time,
+           failures=[{"document": name, "error": reason} for name, reason in failures])
     if failed_count > 0:
-        print(f"❌ 失敗: {failed_count}件")
-    print(f"⏱️  総処理時間: {format_duration(total_time)}")
-    print(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        report(f"❌ 失敗: {failed_count}件", level="error")
+        for name, reason in failures:
+            report(f"  - {name}: {reason}", level="error")
+    report(f"⏱️  総処理時間: {format_duration(total_time)}", level="result")
+    report(f"終了時刻: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
     # 一時ディレクトリをクリーンアップ
     temp_dir = config.get("temp_dir", "temp")
     if os.path.exists(temp_dir) and not os.listdir(temp_dir):
         os.rmdir(temp_dir)
-        print(f"🗑️  一時ディレクトリを削除しました: {temp_dir}")
+        report(f"🗑️  一時ディレクトリを削除しました: {temp_dir}")
     
     # 失敗があった場合は終了コード1を返す
     if failed_count > 0:
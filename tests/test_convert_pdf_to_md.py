@@ -6,12 +6,15 @@ Phase 2: Integration tests (12 cases, target 85% coverage)
 Phase 3: Advanced scenarios (8 cases, target 90% coverage)
 """
 import pytest
+import argparse
 import json
 import os
+import re
 from pathlib import Path
 from unittest.mock import Mock, MagicMock, patch, mock_open
 import tempfile
 import shutil
+import sqlite3
 
 # Import the module under test
 import sys
@@ -966,8 +969,11 @@ def test_cli_filter_by_versions():
 
 @pytest.mark.phase2
 @pytest.mark.integration
-def test_process_pdf_with_verify_flag(tmp_path, sample_config, mock_marker_pdf_with_images, mock_requests_success, mocker):
+def test_process_pdf_with_verify_flag(tmp_path, sample_config, mock_marker_pdf_with_images, mock_requests_success, mocker,
+                                      monkeypatch):
     """Test process_pdf with --verify flag."""
+    # sample_config uses relative paths; keep the outputs out of the real docs/
+    monkeypatch.chdir(tmp_path)
     # Setup
     pdf_info = {
         "name": "Test PDF",
@@ -1014,8 +1020,10 @@ def test_process_pdf_with_verify_flag(tmp_path, sample_config, mock_marker_pdf_w
 
 @pytest.mark.phase2
 @pytest.mark.unit
-def test_temp_file_cleanup_on_success(tmp_path, sample_config, mock_requests_success, mocker):
+def test_temp_file_cleanup_on_success(tmp_path, sample_config, mock_requests_success, mocker, monkeypatch):
     """Test temporary PDF file is deleted after successful processing."""
+    # sample_config uses relative paths; keep the outputs out of the real docs/
+    monkeypatch.chdir(tmp_path)
     # Setup
     temp_dir = tmp_path / "temp"
     temp_dir.mkdir()
@@ -1029,6 +1037,7 @@ def test_temp_file_cleanup_on_success(tmp_path, sample_config, mock_requests_suc
     }
     
     config = {**sample_config, "temp_dir": str(temp_dir)}
+    convert_pdf_to_md.ensure_directories(config)
     
     import argparse
     args = argparse.Namespace(verify=False, no_optimize=True)
@@ -1093,8 +1102,10 @@ def test_temp_file_cleanup_on_error(tmp_path, sample_config, mocker):
 
 @pytest.mark.phase2
 @pytest.mark.integration
-def test_main_no_optimize_flag(tmp_path, sample_config, mock_marker_pdf, mock_requests_success, mocker):
+def test_main_no_optimize_flag(tmp_path, sample_config, mock_marker_pdf, mock_requests_success, mocker, monkeypatch):
     """Test main function with --no-optimize flag."""
+    # sample_config uses relative paths; keep the outputs out of the real docs/
+    monkeypatch.chdir(tmp_path)
     # Setup
     config_path = tmp_path / "config.json"
     config_path.write_text(json.dumps(sample_config))
@@ -1172,3 +1183,1997 @@ def test_main_no_matching_pdfs_after_filter(tmp_path, sample_config, mocker):
     # Verify error exit
     mock_exit.assert_called_with(1)
 
+
+
+# ============================================================================
+# PHASE 3: Advanced Scenarios
+# ============================================================================
+
+# ----------------------------------------------------------------------------
+# Category L: Scheduling and Run History Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_get_page_count_metadata_formats():
+    """Test page count extraction from both marker metadata formats."""
+    assert convert_pdf_to_md.get_page_count({'page_stats': [{}, {}, {}]}) == 3
+    assert convert_pdf_to_md.get_page_count({'page_stats': {'pages': 5}}) == 5
+    assert convert_pdf_to_md.get_page_count({}) is None
+    assert convert_pdf_to_md.get_page_count(None) is None
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_history_roundtrip(tmp_path):
+    """Test that recorded history survives save/load."""
+    history_path = tmp_path / "cache" / "history.json"
+    history = convert_pdf_to_md.load_history(str(history_path))
+    assert history == {}
+    
+    convert_pdf_to_md.record_history(history, "Guide A", {
+        "download_time": 1.0,
+        "convert_time": 30.0,
+        "total_time": 32.0,
+        "pages": 16,
+        "pdf_size": 500000,
+        "images": 2,
+    })
+    convert_pdf_to_md.save_history(history, str(history_path))
+    
+    loaded = convert_pdf_to_md.load_history(str(history_path))
+    assert loaded["Guide A"]["total_time"] == 32.0
+    assert loaded["Guide A"]["pages"] == 16
+    assert loaded["Guide A"]["runs"] == 1
+    assert "images" not in loaded["Guide A"]
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_record_history_clears_fast_text_pages_after_full_model_run():
+    """Test that a full-model run does not inherit page counts from an earlier --fast-text run."""
+    history = {}
+    convert_pdf_to_md.record_history(history, "Guide A", {
+        "convert_time": 10.0, "pages": 20, "pages_text": 18, "pages_model": 2})
+    convert_pdf_to_md.record_history(history, "Guide A", {"convert_time": 40.0, "pages": 20})
+    
+    assert "pages_text" not in history["Guide A"]
+    assert "pages_model" not in history["Guide A"]
+    assert convert_pdf_to_md.estimate_model_seconds_per_page(history) == pytest.approx(2.0)
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_load_history_invalid_json(tmp_path):
+    """Test that a corrupted history file is ignored."""
+    history_path = tmp_path / "history.json"
+    history_path.write_text("{broken", encoding="utf-8")
+    
+    assert convert_pdf_to_md.load_history(str(history_path)) == {}
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_estimate_job_cost_fallbacks():
+    """Test cost estimation from history, page rate, and size rate."""
+    history = {
+        "Seen": {"total_time": 100.0, "pages": 50, "pdf_size": 1000000},
+    }
+    
+    assert convert_pdf_to_md.estimate_job_cost({"name": "Seen"}, history) == 100.0
+    # 2秒/ページ
+    assert convert_pdf_to_md.estimate_job_cost({"name": "New", "pages": 10}, history) == 20.0
+    # 0.0001秒/バイト
+    assert convert_pdf_to_md.estimate_job_cost(
+        {"name": "New", "pdf_size": 200000}, history) == pytest.approx(20.0)
+    # 実績なし: デフォルトのMB単価で秒に換算
+    assert convert_pdf_to_md.estimate_job_cost({"name": "New", "pdf_size": 2 * 1024 * 1024}, {}) == \
+        pytest.approx(2 * convert_pdf_to_md.DEFAULT_SECONDS_PER_MB)
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_estimate_job_cost_uses_seconds_on_mixed_history():
+    """Test that size-only fallbacks stay in seconds so they sort sensibly against timed entries."""
+    history = {"Timed": {"total_time": 120.0}}
+    pdfs = [{"name": "Timed"}, {"name": "Small", "pdf_size": 500 * 1024}]
+    
+    scheduled = convert_pdf_to_md.schedule_pdfs(pdfs, history)
+    
+    assert [p["name"] for p in scheduled] == ["Timed", "Small"]
+    assert convert_pdf_to_md.estimate_job_cost(pdfs[1], history) < 120.0
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_schedule_pdfs_longest_first(sample_config):
+    """Test that PDFs are ordered longest-first with unseen entries probed."""
+    pdfs = [
+        {"name": "Short", "url": "https://example.com/short.pdf"},
+        {"name": "Unseen", "url": "https://example.com/unseen.pdf"},
+        {"name": "Long", "url": "https://example.com/long.pdf"},
+    ]
+    history = {
+        "Short": {"total_time": 10.0, "pdf_size": 100000},
+        "Long": {"total_time": 300.0, "pdf_size": 1000000},
+    }
+    
+    with patch('convert_pdf_to_md.probe_pdf_size', return_value=500000) as mock_probe:
+        scheduled = convert_pdf_to_md.schedule_pdfs(pdfs, history, probe_sizes=True)
+    
+    mock_probe.assert_called_once_with("https://example.com/unseen.pdf")
+    assert [p["name"] for p in scheduled] == ["Long", "Unseen", "Short"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_run_pdf_jobs_sequential_collects_metrics(tmp_path, mock_marker_pdf, mock_requests_success):
+    """Test that sequential job execution returns per-document metrics."""
+    config = {
+        "output_dir": str(tmp_path / "docs"),
+        "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"),
+    }
+    convert_pdf_to_md.ensure_directories(config)
+    pdfs = [{
+        "name": "Test PDF",
+        "url": "https://example.com/test.pdf",
+        "output_filename": "test.md",
+        "version": "2024"
+    }]
+    
+    import argparse
+    args = argparse.Namespace(verify=False, no_optimize=True)
+    
+    results = convert_pdf_to_md.run_pdf_jobs(pdfs, config, args, jobs=1)
+    
+    assert len(results) == 1
+    pdf_info, success, metrics = results[0]
+    assert success is True
+    assert metrics["pages"] == 1
+    assert metrics["pdf_size"] == 1048576
+    assert "total_time" in metrics
+
+
+# ----------------------------------------------------------------------------
+# Category M: CPU Thread Budget Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_resolve_thread_budget_splits_cores():
+    """Test that the core budget is divided across jobs."""
+    assert convert_pdf_to_md.resolve_thread_budget(2, None, 8) == (2, 4)
+    assert convert_pdf_to_md.resolve_thread_budget(16, None, 8) == (16, 1)
+    assert convert_pdf_to_md.resolve_thread_budget(2, 3, 8) == (2, 3)
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_configure_threads_sets_environment(monkeypatch):
+    """Test that OpenMP/MKL thread variables are set for the worker."""
+    for var in convert_pdf_to_md.THREAD_ENV_VARS:
+        monkeypatch.delenv(var, raising=False)
+    
+    convert_pdf_to_md.configure_threads(3)
+    
+    for var in convert_pdf_to_md.THREAD_ENV_VARS:
+        assert os.environ[var] == "3"
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_converter_config_threads():
+    """Test that the thread budget is passed to marker's pdftext workers."""
+    import argparse
+    
+    args = argparse.Namespace(threads_per_job=2)
+    assert convert_pdf_to_md.build_converter_config({}, args) == {"pdftext_workers": 2}
+    assert convert_pdf_to_md.build_converter_config({}, argparse.Namespace()) == {}
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_default_thread_grid():
+    """Test the jobs x threads sweep covers powers of two within the budget."""
+    assert convert_pdf_to_md.default_thread_grid(8) == [(1, 8), (2, 4), (4, 2), (8, 1)]
+    assert convert_pdf_to_md.default_thread_grid(1) == [(1, 1)]
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_print_thread_benchmark_picks_best():
+    """Test that the highest-throughput configuration is recommended."""
+    results = [
+        {"jobs": 1, "threads": 4, "elapsed": 100.0, "documents": 2, "failed": 0,
+         "pages": 40, "pages_per_second": 0.4, "documents_per_minute": 1.2},
+        {"jobs": 2, "threads": 2, "elapsed": 60.0, "documents": 2, "failed": 0,
+         "pages": 40, "pages_per_second": 0.67, "documents_per_minute": 2.0},
+    ]
+    
+    best = convert_pdf_to_md.print_thread_benchmark(results)
+    
+    assert best["jobs"] == 2
+
+
+# ----------------------------------------------------------------------------
+# Category N: Memory Admission Control Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_parse_memory_size_units():
+    """Test memory size parsing into megabytes."""
+    assert convert_pdf_to_md.parse_memory_size("12G") == 12288
+    assert convert_pdf_to_md.parse_memory_size("512M") == 512
+    assert convert_pdf_to_md.parse_memory_size("4096") == 4096
+    assert convert_pdf_to_md.parse_memory_size("1.5GB") == 1536
+    
+    with pytest.raises(ValueError):
+        convert_pdf_to_md.parse_memory_size("lots")
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_estimate_job_memory_from_history():
+    """Test memory estimates from measured peaks and page-count regression."""
+    history = {
+        "Small": {"pages": 10, "peak_rss_mb": 3000.0},
+        "Large": {"pages": 110, "peak_rss_mb": 5000.0},
+    }
+    
+    assert convert_pdf_to_md.estimate_job_memory({"name": "Large"}, history) == 5000.0
+    # 3000MB + 20MB/ページ
+    assert convert_pdf_to_md.estimate_job_memory(
+        {"name": "New", "pages": 60}, history) == pytest.approx(4000.0)
+    assert convert_pdf_to_md.estimate_job_memory({"name": "New"}, {}) == \
+        convert_pdf_to_md.DEFAULT_JOB_MEMORY_MB
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_next_admissible_job_respects_budget():
+    """Test that jobs are admitted only while the projected total fits."""
+    pending = [(1, {"name": "Big"}), (2, {"name": "Small"})]
+    estimates = {"Big": 6000.0, "Small": 2000.0}
+    
+    # 実行中ジョブなし: 先頭を投入
+    assert convert_pdf_to_md.next_admissible_job(pending, estimates, 0.0, 7000, 0) == 0
+    # 先頭が収まらない場合は後続の小さいジョブを投入
+    assert convert_pdf_to_md.next_admissible_job(pending, estimates, 4000.0, 7000, 1) == 1
+    # どちらも収まらない
+    assert convert_pdf_to_md.next_admissible_job(pending, estimates, 6000.0, 7000, 1) is None
+    # 予算指定なし
+    assert convert_pdf_to_md.next_admissible_job(pending, estimates, 99999.0, None, 3) == 0
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_next_admissible_job_counts_worker_baseline():
+    """Test that each worker's fixed memory can keep a job out of the budget."""
+    pending = [(1, {"name": "Small"})]
+    estimates = {"Running": 500.0, "Small": 500.0}
+    
+    # The job increases alone fit: 500 + 500 <= 2000
+    assert convert_pdf_to_md.next_admissible_job(pending, estimates, 500.0, 2000, 1) == 0
+    # With 1200MB per worker, the running worker uses 1700MB and the new one would need 1700MB more
+    assert convert_pdf_to_md.next_admissible_job(pending, estimates, 500.0 + 1200.0, 2000, 1,
+                                                 overhead=1200.0) is None
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_estimate_worker_memory_from_history_or_option():
+    """Test that the worker overhead comes from --worker-memory, else the smallest recorded baseline."""
+    history = {"A": {"baseline_rss_mb": 1800.0}, "B": {"baseline_rss_mb": 1500.0}, "C": {"pages": 3}}
+    
+    assert convert_pdf_to_md.estimate_worker_memory(history) == 1500.0
+    assert convert_pdf_to_md.estimate_worker_memory(history, argparse.Namespace(worker_memory=2048)) == 2048.0
+    assert convert_pdf_to_md.estimate_worker_memory({}) == convert_pdf_to_md.DEFAULT_WORKER_MEMORY_MB
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_track_peak_rss_records_metric():
+    """Test that peak RSS is recorded for a tracked block."""
+    metrics = {}
+    
+    with convert_pdf_to_md.track_peak_rss(metrics, interval=0.01):
+        data = bytearray(64 * 1024 * 1024)
+    
+    assert metrics["peak_rss_mb"] > 0
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_track_peak_rss_excludes_memory_held_before_the_job():
+    """Test that the recorded peak is the increase over the RSS at job start."""
+    metrics = {}
+    
+    with patch('convert_pdf_to_md._current_rss_mb', side_effect=[3000.0, 3400.0]):
+        with convert_pdf_to_md.track_peak_rss(metrics, interval=60):
+            pass
+    
+    assert metrics["peak_rss_mb"] == 400.0
+    assert metrics["baseline_rss_mb"] == 3000.0
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_track_peak_rss_skips_without_psutil():
+    """Test that no peak is recorded when psutil is unavailable instead of using ru_maxrss."""
+    metrics = {}
+    
+    with patch.dict(sys.modules, {"psutil": None}):
+        with convert_pdf_to_md.track_peak_rss(metrics):
+            pass
+    
+    assert "peak_rss_mb" not in metrics
+
+
+# ----------------------------------------------------------------------------
+# Category O: Conversion Watchdog Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_check_job_limits():
+    """Test watchdog decisions for timeout and memory limits."""
+    assert convert_pdf_to_md.check_job_limits(10.0, 1000.0, 60.0, 4096) is None
+    assert "タイムアウト" in convert_pdf_to_md.check_job_limits(61.0, 1000.0, 60.0, None)
+    assert "メモリ" in convert_pdf_to_md.check_job_limits(1.0, 5000.0, None, 4096)
+    # RSSが取得できない場合はメモリ判定を行わない
+    assert convert_pdf_to_md.check_job_limits(1.0, None, None, 4096) is None
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+@pytest.mark.slow
+def test_run_pdf_jobs_watchdog_kills_hung_worker(tmp_path):
+    """Test that a hung conversion is stopped and the batch continues."""
+    import argparse
+    import time as time_module
+    
+    config = {
+        "output_dir": str(tmp_path / "docs"),
+        "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"),
+    }
+    convert_pdf_to_md.ensure_directories(config)
+    pdfs = [
+        {"name": "Hung", "url": "https://example.com/hung.pdf", "output_filename": "hung.md"},
+        {"name": "Ok", "url": "https://example.com/ok.pdf", "output_filename": "ok.md"},
+    ]
+    
+    def fake_download(url, output_path):
+        Path(output_path).write_bytes(b'%PDF')
+    
+    def fake_convert(pdf_path, output_md_path, image_dir, converter_config=None, **kwargs):
+        if "hung" in output_md_path:
+            time_module.sleep(60)
+        Path(output_md_path).write_text("# Ok\n", encoding="utf-8")
+        return {"pages": 1, "images": 0}
+    
+    args = argparse.Namespace(verify=False, no_optimize=True, timeout=1.0)
+    
+    with patch('convert_pdf_to_md.download_pdf', side_effect=fake_download), \
+         patch('convert_pdf_to_md.convert_pdf_to_markdown', side_effect=fake_convert):
+        results = convert_pdf_to_md.run_pdf_jobs(pdfs, config, args, jobs=1)
+    
+    outcome = {pdf_info["name"]: (success, metrics) for pdf_info, success, metrics in results}
+    assert outcome["Hung"][0] is False
+    assert "タイムアウト" in outcome["Hung"][1]["error"]
+    assert outcome["Ok"][0] is True
+    assert not list((tmp_path / "temp").glob("*.pdf"))
+
+
+# ----------------------------------------------------------------------------
+# Category P: In-Memory Download Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_download_pdf_returns_sha256(tmp_path, mock_requests_success):
+    """Test that the file download hashes content on the fly."""
+    import hashlib
+    
+    output_path = tmp_path / "test.pdf"
+    sha256 = convert_pdf_to_md.download_pdf("https://example.com/test.pdf", str(output_path))
+    
+    assert sha256 == hashlib.sha256(output_path.read_bytes()).hexdigest()
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_download_pdf_to_memory(mock_requests_success):
+    """Test downloading into an in-memory buffer with a matching hash."""
+    import hashlib
+    
+    buffer, sha256 = convert_pdf_to_md.download_pdf_to_memory("https://example.com/test.pdf")
+    
+    data = buffer.getvalue()
+    assert len(data) == 1048576
+    assert buffer.tell() == 0
+    assert sha256 == hashlib.sha256(data).hexdigest()
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_memory_pdf_source_exposes_content():
+    """Test that the in-memory source can be read back by the converter."""
+    import io
+    
+    buffer = io.BytesIO(b'%PDF-1.4 test')
+    
+    with convert_pdf_to_md.memory_pdf_source(buffer) as source:
+        if isinstance(source, str):
+            with open(source, "rb") as f:
+                assert f.read() == b'%PDF-1.4 test'
+        else:
+            assert source.read() == b'%PDF-1.4 test'
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_process_pdf_in_memory_skips_temp_file(tmp_path, mock_marker_pdf, mock_requests_success):
+    """Test that --in-memory processing never writes a temp PDF."""
+    import argparse
+    
+    config = {
+        "output_dir": str(tmp_path / "docs"),
+        "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"),
+    }
+    convert_pdf_to_md.ensure_directories(config)
+    pdf_info = {
+        "name": "Test PDF",
+        "url": "https://example.com/test.pdf",
+        "output_filename": "test.md",
+        "version": "2024"
+    }
+    args = argparse.Namespace(verify=False, no_optimize=True, in_memory=True)
+    metrics = {}
+    
+    with patch('convert_pdf_to_md.download_pdf') as mock_download:
+        result = convert_pdf_to_md.process_pdf(pdf_info, config, args, 1, 1, metrics=metrics)
+    
+    assert result is True
+    mock_download.assert_not_called()
+    assert metrics["pdf_size"] == 1048576
+    assert len(metrics["pdf_sha256"]) == 64
+    assert not list((tmp_path / "temp").iterdir())
+
+
+# ----------------------------------------------------------------------------
+# Category Q: Text-Layer Fast Path Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_text_lines_to_markdown_structure():
+    """Test heading, list, paragraph and page-number handling of the text-layer extractor."""
+    lines = [
+        ("第1章 概要", 18.0),
+        ("本書はサンプル", 10.0),
+        ("の説明です。", 10.0),
+        ("● 項目A", 10.0),
+        ("The quick brown", 10.0),
+        ("fox jumps.", 10.0),
+        ("12", 9.0),
+    ]
+    
+    markdown = convert_pdf_to_md.text_lines_to_markdown(lines)
+    
+    assert markdown.split("\n\n") == [
+        "# 第1章 概要",
+        "本書はサンプルの説明です。",
+        "- 項目A",
+        "The quick brown fox jumps.",
+    ]
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_group_page_runs():
+    """Test that consecutive pages on the same path are grouped."""
+    classification = [
+        {"page": 0, "path": "text"},
+        {"page": 1, "path": "text"},
+        {"page": 2, "path": "model"},
+        {"page": 3, "path": "text"},
+    ]
+    
+    runs = convert_pdf_to_md.group_page_runs(classification)
+    
+    assert runs == [("text", [0, 1]), ("model", [2]), ("text", [3])]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_convert_pdf_hybrid_routes_pages(tmp_path, mock_marker_pdf):
+    """Test that only model pages are sent to marker-pdf and output keeps page order."""
+    classification = [
+        {"page": 0, "path": "text", "reason": "text-layer"},
+        {"page": 1, "path": "model", "reason": "scanned"},
+        {"page": 2, "path": "text", "reason": "text-layer"},
+    ]
+    output_md = tmp_path / "out.md"
+    
+    with patch('convert_pdf_to_md.classify_pdf_pages', return_value=classification), \
+         patch('convert_pdf_to_md.extract_text_layer_markdown',
+               side_effect=lambda source, pages: f"text {pages}"):
+        stats = convert_pdf_to_md.convert_pdf_hybrid(
+            "test.pdf", str(output_md), str(tmp_path / "images"),
+            converter_config={"pdftext_workers": 2},
+        )
+    
+    mock_marker_pdf['converter_class'].assert_called_once_with(
+        artifact_dict={'model': 'mock_model'},
+        config={"pdftext_workers": 2, "page_range": [1]},
+    )
+    content = output_md.read_text(encoding="utf-8")
+    assert content.index("text [0]") < content.index("# Test Document") < content.index("text [2]")
+    assert stats["pages"] == 3
+    assert stats["pages_text"] == 2
+    assert stats["pages_model"] == 1
+    assert stats["time_saved"] is not None
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_convert_pdf_hybrid_falls_back_without_text_pages(tmp_path, mock_marker_pdf):
+    """Test that fully scanned PDFs go through the regular marker-pdf conversion."""
+    classification = [{"page": 0, "path": "model", "reason": "scanned"}]
+    
+    with patch('convert_pdf_to_md.classify_pdf_pages', return_value=classification), \
+         patch('convert_pdf_to_md.convert_pdf_to_markdown',
+               return_value={'pages': 1, 'images': 0}) as mock_convert:
+        stats = convert_pdf_to_md.convert_pdf_hybrid(
+            "test.pdf", str(tmp_path / "out.md"), str(tmp_path / "images"))
+    
+    mock_convert.assert_called_once()
+    assert stats == {'pages': 1, 'images': 0}
+
+
+# ----------------------------------------------------------------------------
+# Category R: Conversion Profile Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_converter_config_entry_profile_overrides_cli():
+    """Test that a per-entry profile and converter options override the CLI profile."""
+    import argparse
+    
+    args = argparse.Namespace(conversion_profile="fast", threads_per_job=2)
+    pdf_info = {"profile": "accurate", "converter_options": {"highres_image_dpi": 216}}
+    
+    converter_config = convert_pdf_to_md.build_converter_config(pdf_info, args)
+    
+    assert converter_config["mode"] == "balanced"
+    assert converter_config["extract_images"] is True
+    assert converter_config["highres_image_dpi"] == 216
+    assert converter_config["pdftext_workers"] == 2
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_conversion_profile_keys_exist_in_marker():
+    """Test that every profile key matches a setting of some marker component."""
+    pytest.importorskip("marker.builders.layout")
+    
+    known = convert_pdf_to_md.marker_setting_names()
+    assert known is not None
+    for name, profile in convert_pdf_to_md.CONVERSION_PROFILES.items():
+        unknown = [key for key in profile if key != "disabled_processors" and key not in known]
+        assert unknown == [], f"{name}: {unknown}"
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_converter_config_warns_on_unknown_settings(capsys):
+    """Test that converter options marker does not define are reported as ignored."""
+    import argparse
+    
+    known = {"mode", "lowres_image_dpi", "highres_image_dpi", "extract_images", "ocr_error_batch_size"}
+    with patch("convert_pdf_to_md.marker_setting_names", return_value=known):
+        convert_pdf_to_md.build_converter_config(
+            {"profile": "accurate", "converter_options": {"layout_batch_size": 2}}, argparse.Namespace())
+    
+    output = capsys.readouterr().out
+    assert "layout_batch_size" in output
+    assert "extract_images" not in output
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_converter_config_rejects_unknown_profile():
+    """Test that an unknown profile name in config.json is reported."""
+    import argparse
+    
+    with pytest.raises(ValueError):
+        convert_pdf_to_md.build_converter_config({"profile": "turbo"}, argparse.Namespace())
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_create_pdf_converter_drops_disabled_processors():
+    """Test that disabled processors are removed from marker's default processor list."""
+    class TableProcessor:
+        pass
+    
+    class TextProcessor:
+        pass
+    
+    with patch('convert_pdf_to_md.PdfConverter') as mock_converter_class:
+        mock_converter_class.default_processors = (TableProcessor, TextProcessor)
+        convert_pdf_to_md.create_pdf_converter(
+            {'model': 'mock_model'},
+            {"mode": "fast", "disabled_processors": ["TableProcessor"]},
+        )
+    
+    mock_converter_class.assert_called_once_with(
+        artifact_dict={'model': 'mock_model'},
+        processor_list=[f"{TextProcessor.__module__}.{TextProcessor.__name__}"],
+        config={"mode": "fast"},
+    )
+
+
+# ----------------------------------------------------------------------------
+# Category S: Cross-Document Batching Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_pack_documents_respects_page_limit():
+    """Test that small documents are packed in order up to the page limit."""
+    batches = convert_pdf_to_md.pack_documents([10, 15, 20, 80, 5], max_pages=40)
+    
+    assert batches == [[0, 1], [2], [3], [4]]
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_split_paginated_markdown():
+    """Test that paginated markdown is split back into per-document parts."""
+    separator = "-" * 48
+    markdown = (f"\n\n{{0}}{separator}\n\nPage A\n\n{{1}}{separator}\n\nPage B"
+                f"\n\n{{2}}{separator}\n\nPage C\n\n")
+    
+    parts = convert_pdf_to_md.split_paginated_markdown(markdown, [(0, 2), (2, 3)])
+    
+    assert parts == ["Page A\n\nPage B\n", "Page C\n"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_convert_pdf_batch_splits_markdown_and_images(tmp_path, mock_marker_pdf):
+    """Test that one batched conversion yields per-document markdown and images."""
+    separator = "-" * 48
+    mock_marker_pdf['text_from_rendered'].return_value = (
+        f"\n\n{{0}}{separator}\n\n# Doc A\n\n![](_page_0_Picture_0.jpeg)"
+        f"\n\n{{1}}{separator}\n\n# Doc B\n\n",
+        {},
+        {"_page_0_Picture_0.jpeg": b"image-bytes"},
+    )
+    outputs = [str(tmp_path / "a.md"), str(tmp_path / "b.md")]
+    
+    with patch('convert_pdf_to_md.merge_pdfs', return_value=[(0, 1), (1, 2)]):
+        stats = convert_pdf_to_md.convert_pdf_batch(
+            ["a.pdf", "b.pdf"], outputs, str(tmp_path / "images"),
+            str(tmp_path / "batch.pdf"), {"mode": "fast"},
+        )
+    
+    config = mock_marker_pdf['converter_class'].call_args.kwargs["config"]
+    assert config == {"mode": "fast", "paginate_output": True}
+    assert stats == [{'pages': 1, 'images': 1}, {'pages': 1, 'images': 0}]
+    assert "a_image_1.png" in (tmp_path / "a.md").read_text(encoding="utf-8")
+    assert (tmp_path / "b.md").read_text(encoding="utf-8") == "# Doc B\n"
+    assert (tmp_path / "images" / "a_image_1.png").exists()
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+@pytest.mark.parametrize("flags", [["--timeout", "600"], ["--max-job-memory", "6G"], ["--in-memory"],
+                                   ["--fast-text"], ["--document-cache"]])
+def test_batch_pages_rejects_unsupported_options(flags, capsys):
+    """Test that options the batched conversion cannot honour are rejected instead of ignored."""
+    with patch.object(sys, "argv", ["convert_pdf_to_md.py", "--batch-pages", "60", *flags]):
+        with pytest.raises(SystemExit) as excinfo:
+            convert_pdf_to_md.main()
+    
+    assert excinfo.value.code == 2
+    assert flags[0] in capsys.readouterr().err
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_batch_pages_rejects_entries_with_timeout(tmp_path):
+    """Test that a config.json entry with its own timeout is not silently batched without a watchdog."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({
+        "output_dir": str(tmp_path / "docs"), "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"), "cache_dir": str(tmp_path / "cache"),
+        "pdfs": [{"name": "Slow", "url": "https://example.com/slow.pdf", "output_filename": "slow.md",
+                  "timeout": 60}]}), encoding="utf-8")
+    
+    with patch.object(sys, "argv", ["convert_pdf_to_md.py", "-c", str(config_path), "--batch-pages", "60"]), \
+            patch("convert_pdf_to_md.process_pdf_batches") as mock_batches:
+        with pytest.raises(SystemExit) as excinfo:
+            convert_pdf_to_md.main()
+    
+    assert excinfo.value.code == 1
+    mock_batches.assert_not_called()
+
+
+# ----------------------------------------------------------------------------
+# Category T: Document Cache Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_document_cache_path_ignores_render_only_options(tmp_path):
+    """Test that only options affecting layout/OCR change the cache key."""
+    config = {"cache_dir": str(tmp_path)}
+    base = convert_pdf_to_md.get_document_cache_path(config, "abc", {"mode": "fast"})
+    
+    assert base == convert_pdf_to_md.get_document_cache_path(
+        config, "abc", {"mode": "fast", "paginate_output": True, "pdftext_workers": 4})
+    assert base != convert_pdf_to_md.get_document_cache_path(
+        config, "abc", {"mode": "balanced"})
+    assert base.name.startswith("abc-")
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_convert_pdf_to_markdown_builds_and_reuses_document_cache(tmp_path, mock_marker_pdf):
+    """Test that a cache miss stores the document and a hit renders without models."""
+    import pickle
+    from contextlib import nullcontext
+    
+    def fake_save(doc, path, extract_images):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(pickle.dumps(doc))
+    
+    document = {"pages": []}
+    converter = mock_marker_pdf['converter_class'].return_value
+    converter.filepath_to_str.side_effect = lambda path: nullcontext(path)
+    converter.build_document.return_value = document
+    cache_path = tmp_path / "documents" / "doc.pkl"
+    
+    with patch('convert_pdf_to_md.save_cached_document', side_effect=fake_save), \
+         patch('convert_pdf_to_md.render_document') as mock_render:
+        convert_pdf_to_md.convert_pdf_to_markdown(
+            "test.pdf", str(tmp_path / "first.md"), str(tmp_path / "images"),
+            document_cache=cache_path)
+        mock_marker_pdf['create_model'].reset_mock()
+        
+        convert_pdf_to_md.convert_pdf_to_markdown(
+            None, str(tmp_path / "second.md"), str(tmp_path / "images"),
+            converter_config={"paginate_output": True}, document_cache=cache_path)
+    
+    converter.build_document.assert_called_once_with("test.pdf")
+    mock_marker_pdf['create_model'].assert_not_called()
+    assert mock_render.call_args_list[1].args == (document, {"paginate_output": True})
+    assert (tmp_path / "second.md").exists()
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_process_pdf_rerender_skips_download(tmp_path, mock_marker_pdf):
+    """Test that --rerender uses the cached document without downloading."""
+    import argparse
+    
+    config = {
+        "output_dir": str(tmp_path / "docs"),
+        "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"),
+        "cache_dir": str(tmp_path / "cache"),
+    }
+    convert_pdf_to_md.ensure_directories(config)
+    pdf_info = {
+        "name": "Test PDF",
+        "url": "https://example.com/test.pdf",
+        "output_filename": "test.md",
+        "version": "2024"
+    }
+    args = argparse.Namespace(verify=False, no_optimize=True, rerender=True)
+    convert_pdf_to_md.register_document_sha256(config, pdf_info["url"], "f" * 64)
+    cache_path = convert_pdf_to_md.get_document_cache_path(config, "f" * 64, {})
+    cache_path.write_bytes(b"cached")
+    
+    with patch('convert_pdf_to_md.download_pdf') as mock_download, \
+         patch('convert_pdf_to_md.convert_pdf_to_markdown',
+               return_value={'pages': 1, 'images': 0}) as mock_convert:
+        result = convert_pdf_to_md.process_pdf(pdf_info, config, args, 1, 1)
+    
+    assert result is True
+    mock_download.assert_not_called()
+    assert mock_convert.call_args.args[0] is None
+    assert mock_convert.call_args.kwargs["document_cache"] == cache_path
+
+
+# ----------------------------------------------------------------------------
+# Category U: Text-Only Mode Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_replace_images_with_placeholders():
+    """Test that image references and marker descriptions become alt-text placeholders."""
+    markdown = (
+        "Intro\n\n![](_page_0_Picture_1.jpeg)\n\n![Scrum team](team.png)\n\n"
+        "Image /page/1/Picture/2 description: A sprint cycle diagram\n"
+    )
+    
+    result = convert_pdf_to_md.replace_images_with_placeholders(markdown)
+    
+    assert result == (
+        "Intro\n\n*[画像]*\n\n*[画像: Scrum team]*\n\n"
+        "*[画像: A sprint cycle diagram]*\n"
+    )
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_converter_config_no_images_overrides_profile():
+    """Test that --no-images disables extraction even when the entry asks for images."""
+    import argparse
+    
+    args = argparse.Namespace(no_images=True)
+    converter_config = convert_pdf_to_md.build_converter_config({"profile": "accurate"}, args)
+    
+    assert converter_config["extract_images"] is False
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_convert_pdf_to_markdown_no_images(tmp_path, mock_marker_pdf_with_images):
+    """Test that no image files are written when extraction is disabled."""
+    mock_marker_pdf_with_images['text_from_rendered'].return_value = (
+        "# Doc\n\n![](image1.png)\n", {}, {"image1.png": b"png"})
+    output_md = tmp_path / "out.md"
+    image_dir = tmp_path / "images"
+    
+    convert_pdf_to_md.convert_pdf_to_markdown(
+        "test.pdf", str(output_md), str(image_dir),
+        converter_config={"extract_images": False})
+    
+    assert output_md.read_text(encoding="utf-8") == "# Doc\n\n*[画像]*\n"
+    assert not image_dir.exists()
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_benchmark_profiles_keeps_profile_key_and_saves_results(tmp_path):
+    """Test that profile results keep the "profile" key of profiles.json and are saved by the shared helper."""
+    config = {"cache_dir": str(tmp_path / "cache"), "output_dir": str(tmp_path / "docs")}
+    args = argparse.Namespace(no_optimize=False, verify=False, conversion_profile=None)
+    
+    with patch("convert_pdf_to_md.run_pdf_jobs", return_value=[]):
+        results = convert_pdf_to_md.benchmark_profiles([{"name": "A", "profile": "fast"}], config, args,
+                                                       ["fast", "accurate"])
+    path = convert_pdf_to_md.save_benchmark_results(config, results, "profiles")
+    
+    assert [r["profile"] for r in results] == ["fast", "accurate"]
+    assert "variant" not in results[0]
+    assert path == tmp_path / "cache" / "benchmark" / "profiles.json"
+    assert json.loads(path.read_text(encoding="utf-8")) == results
+
+
+# ----------------------------------------------------------------------------
+# Category V: Warm-up and Offline Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_synthetic_pdf():
+    """Test that the synthetic warm-up PDF has the requested number of pages."""
+    pdf_bytes = convert_pdf_to_md.build_synthetic_pdf(pages=3)
+    
+    assert pdf_bytes.startswith(b"%PDF-1.4")
+    assert pdf_bytes.rstrip().endswith(b"%%EOF")
+    assert pdf_bytes.count(b"/Type /Page ") == 3
+    assert b"/Count 3" in pdf_bytes
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_block_network_rejects_connections():
+    """Test that network access fails fast inside block_network and is restored afterwards."""
+    import socket
+    
+    original_connect = socket.socket.connect
+    with convert_pdf_to_md.block_network():
+        assert os.environ["HF_HUB_OFFLINE"] == "1"
+        with pytest.raises(OSError):
+            socket.create_connection(("example.com", 80), timeout=1)
+    
+    assert socket.socket.connect is original_connect
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_warmup_mode_reports_timings(tmp_path, mock_marker_pdf):
+    """Test that warm-up loads models twice, converts the synthetic PDF and saves timings."""
+    mock_marker_pdf['text_from_rendered'].return_value = ("# Warm-up Document\n", {}, {})
+    config = {"cache_dir": str(tmp_path / "cache")}
+    
+    result = convert_pdf_to_md.warmup_mode(config, offline=True, pages=2)
+    
+    assert mock_marker_pdf['create_model'].call_count == 2
+    assert result["seconds_per_page"] == result["convert_time"] / 2
+    saved = json.loads((tmp_path / "cache" / "warmup.json").read_text(encoding="utf-8"))
+    assert saved["offline"] is True
+    assert "cold_load_time" in saved and "warm_load_time" in saved
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_warmup_mode_offline_failure_exits(tmp_path, mock_marker_pdf):
+    """Test that a model download attempt in offline mode exits with an error."""
+    mock_marker_pdf['create_model'].side_effect = OSError("network disabled")
+    
+    with pytest.raises(SystemExit):
+        convert_pdf_to_md.warmup_mode({"cache_dir": str(tmp_path)}, offline=True)
+
+
+# ----------------------------------------------------------------------------
+# Category W: Stage Profiling Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_profile_stage_is_noop_without_session(tmp_path):
+    """Test that stages outside a profiling session write nothing."""
+    with convert_pdf_to_md.profile_stage("download"):
+        pass
+    
+    assert convert_pdf_to_md._profile_session["stages"] == []
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_profiling_session_writes_stage_dumps_and_summary(tmp_path):
+    """Test that nested stages get their own dumps numbered in start order."""
+    import pstats
+    
+    profile_dir = tmp_path / "profile"
+    with convert_pdf_to_md.profiling_session(profile_dir, top=5):
+        with convert_pdf_to_md.profile_stage("convert"):
+            data = [str(i) for i in range(1000)]
+            with convert_pdf_to_md.profile_stage("images"):
+                sorted(data)
+        with convert_pdf_to_md.profile_stage("optimize"):
+            pass
+    
+    for dump in ("01_convert", "02_images", "03_optimize"):
+        assert (profile_dir / f"{dump}.prof").exists()
+        assert (profile_dir / f"{dump}.tracemalloc").exists()
+    pstats.Stats(str(profile_dir / "02_images.prof"))
+    summary = (profile_dir / "summary.txt").read_text(encoding="utf-8")
+    assert summary.index("convert") < summary.index("images") < summary.index("optimize")
+    assert "CPUホットスポット" in summary
+
+
+def _allocate_in_inner_stage(): return bytearray(4 * 1024 * 1024)
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_nested_stage_keeps_outer_peak_and_allocations(tmp_path):
+    """Test that an inner stage neither wipes the outer peak nor leaks its allocations into the outer diff."""
+    with patch("convert_pdf_to_md.write_profile_summary", wraps=convert_pdf_to_md.write_profile_summary) as summary:
+        with convert_pdf_to_md.profiling_session(tmp_path / "profile", top=50):
+            with convert_pdf_to_md.profile_stage("convert"):
+                outer = bytearray(32 * 1024 * 1024)
+                del outer
+                with convert_pdf_to_md.profile_stage("images"):
+                    inner = _allocate_in_inner_stage()
+    
+    stages = {entry["stage"]: entry for entry in summary.call_args.args[1]}
+    assert stages["convert"]["peak_mb"] >= 32
+    assert stages["images"]["peak_mb"] < 32
+    inner_line = f"test_convert_pdf_to_md.py:{_allocate_in_inner_stage.__code__.co_firstlineno}:"
+    assert any(inner_line in line and "(+4096 KiB)" in line for line in stages["images"]["allocations"])
+    assert not any(inner_line in line and "(+4096 KiB)" in line for line in stages["convert"]["allocations"])
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_process_pdf_job_profiles_each_stage(tmp_path, mock_marker_pdf, mock_requests_success, monkeypatch):
+    """Test that --profile records download, convert and optimize stages for a PDF."""
+    import argparse
+    
+    # Optimization writes backups relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    config = {
+        "output_dir": str(tmp_path / "docs"),
+        "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"),
+        "cache_dir": str(tmp_path / "cache"),
+    }
+    convert_pdf_to_md.ensure_directories(config)
+    pdf_info = {
+        "name": "Test PDF",
+        "url": "https://example.com/test.pdf",
+        "output_filename": "test.md",
+        "version": "2024"
+    }
+    args = argparse.Namespace(verify=False, no_optimize=False, profile=True,
+                              profile_run="run1", profile_top=5)
+    
+    success, _ = convert_pdf_to_md._process_pdf_job(pdf_info, config, args, 1, 1)
+    
+    profile_dir = tmp_path / "cache" / "profiles" / "run1" / "test"
+    assert success is True
+    assert sorted(p.name for p in profile_dir.glob("*.prof")) == [
+        "01_download.prof", "02_convert.prof", "03_optimize.prof"]
+    assert (profile_dir / "summary.txt").exists()
+
+
+# ----------------------------------------------------------------------------
+# Category X: Tracing Span Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_trace_span_records_complete_events():
+    """Test that spans become Chrome trace complete events with their attributes."""
+    with convert_pdf_to_md.tracing_session(True) as events:
+        with convert_pdf_to_md.trace_span("run", {"documents": 1}):
+            with convert_pdf_to_md.trace_span("download") as span:
+                span["bytes"] = 1024
+    
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert spans["download"]["args"] == {"bytes": 1024}
+    assert spans["run"]["ts"] <= spans["download"]["ts"]
+    assert spans["run"]["ts"] + spans["run"]["dur"] >= spans["download"]["ts"] + spans["download"]["dur"]
+    assert any(e["ph"] == "M" and e["name"] == "process_name" for e in events)
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_tracing_session_disabled_and_nested():
+    """Test that disabled or nested sessions do not start a new event list."""
+    with convert_pdf_to_md.tracing_session(False) as events:
+        assert events is None
+        with convert_pdf_to_md.trace_span("ignored") as span:
+            span["x"] = 1
+    
+    with convert_pdf_to_md.tracing_session(True) as outer:
+        with convert_pdf_to_md.tracing_session(True) as inner:
+            assert inner is None
+            with convert_pdf_to_md.trace_span("nested"):
+                pass
+    assert [e["name"] for e in outer if e["ph"] == "X"] == ["nested"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_process_pdf_job_returns_trace_events(tmp_path, mock_marker_pdf, mock_requests_success):
+    """Test that a traced job returns document and stage spans with attributes."""
+    import argparse
+    
+    config = {
+        "output_dir": str(tmp_path / "docs"),
+        "image_dir": str(tmp_path / "docs" / "images"),
+        "temp_dir": str(tmp_path / "temp"),
+    }
+    convert_pdf_to_md.ensure_directories(config)
+    pdf_info = {
+        "name": "Test PDF",
+        "url": "https://example.com/test.pdf",
+        "output_filename": "test.md",
+        "version": "2024"
+    }
+    args = argparse.Namespace(verify=True, no_optimize=False, trace=True)
+    
+    success, metrics = convert_pdf_to_md._process_pdf_job(pdf_info, config, args, 1, 1)
+    
+    assert success is True
+    spans = {e["name"]: e for e in metrics["trace_events"] if e["ph"] == "X"}
+    assert set(spans) == {"document", "download", "convert", "optimize", "verify"}
+    assert spans["download"]["args"]["bytes"] == 1048576
+    assert spans["document"]["args"]["success"] is True
+    
+    trace_path = tmp_path / "trace.json"
+    convert_pdf_to_md.write_trace(trace_path, metrics["trace_events"])
+    assert "traceEvents" in json.loads(trace_path.read_text(encoding="utf-8"))
+
+
+# ----------------------------------------------------------------------------
+# Category Y: Output Mode and Progress Tests
+# ----------------------------------------------------------------------------
+
+@pytest.fixture
+def output_mode():
+    """Restore the default text output mode after a test changes it."""
+    yield convert_pdf_to_md.configure_output
+    convert_pdf_to_md.configure_output("text")
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_report_quiet_mode_shows_results_and_errors_only(output_mode, capsys):
+    """Test that quiet mode hides info messages but keeps results, warnings and errors."""
+    output_mode("quiet")
+    
+    convert_pdf_to_md.report("  📥 ダウンロード中")
+    convert_pdf_to_md.report("✅ 成功: 1件", event="summary", level="result")
+    convert_pdf_to_md.report("❌ 失敗", level="error")
+    
+    assert capsys.readouterr().out == "✅ 成功: 1件\n❌ 失敗\n"
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_report_json_mode_emits_event_lines(output_mode, capsys):
+    """Test that JSON mode writes one event per line and skips decoration."""
+    output_mode("json")
+    
+    convert_pdf_to_md.report("=" * 70)
+    convert_pdf_to_md.report("  ✅ 処理完了: A", event="document_complete", level="result",
+                             document="A", pages=3)
+    
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["event"] == "document_complete"
+    assert record["message"] == "✅ 処理完了: A"
+    assert record["pages"] == 3
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_report_progress_is_rate_limited(output_mode, capsys):
+    """Test that progress updates are throttled except for the final update."""
+    output_mode("json", progress_interval=60)
+    
+    for done in range(1, 101):
+        convert_pdf_to_md.report_progress("download", done, 100)
+    convert_pdf_to_md.report_progress("download", 100, 100, final=True)
+    
+    events = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [e["done"] for e in events] == [1, 100]
+    assert events[-1]["final"] is True
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_configure_output_rejects_unknown_mode(output_mode):
+    """Test that an unknown output mode is rejected."""
+    with pytest.raises(ValueError):
+        output_mode("verbose")
+
+
+# ----------------------------------------------------------------------------
+# Category Z: Run History Database Tests
+# ----------------------------------------------------------------------------
+
+def _run_results(convert_time, cache_hit=False):
+    """Build run_pdf_jobs-style results for one successful and one failed document."""
+    return [
+        ({"name": "Guide A"}, True, {"convert_time": convert_time, "total_time": convert_time + 1,
+                                     "pages": 10, "cache_hit": cache_hit}),
+        ({"name": "Guide B"}, False, {"error": "timeout"}),
+    ]
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_record_run_appends_runs_and_documents(tmp_path):
+    """Test that each run and its per-document metrics are stored in SQLite."""
+    db_path = tmp_path / "runs.sqlite3"
+    
+    first = convert_pdf_to_md.record_run(db_path, _run_results(10.0), {
+        "started_at": "2024-01-01T00:00:00", "marker_version": "1.0", "jobs": 2,
+        "total_time": 12.0, "options": {"fast_text": False}})
+    second = convert_pdf_to_md.record_run(db_path, _run_results(11.0), {
+        "started_at": "2024-01-02T00:00:00", "marker_version": "1.0"})
+    
+    assert second == first + 1
+    conn = convert_pdf_to_md.open_run_history(db_path)
+    try:
+        run = conn.execute("SELECT * FROM runs WHERE id = ?", (first,)).fetchone()
+        assert (run["succeeded"], run["failed"], run["jobs"]) == (1, 1, 2)
+        failed = conn.execute("SELECT error FROM documents WHERE name = 'Guide B'").fetchall()
+        assert [row["error"] for row in failed] == ["timeout", "timeout"]
+        trends = convert_pdf_to_md.load_document_trends(conn)
+    finally:
+        conn.close()
+    assert [e["convert_time"] for e in trends["Guide A"]] == [10.0, 11.0]
+    assert "Guide B" not in trends
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_find_regressions_compares_against_median():
+    """Test that only slowdowns beyond the threshold are flagged, ignoring cache hits."""
+    def entries(*times, cache_hit_last=False):
+        result = [{"convert_time": t, "cache_hit": 0, "marker_version": "1.0"} for t in times]
+        result[-1]["cache_hit"] = int(cache_hit_last)
+        return result
+    
+    trends = {
+        "slow": entries(10.0, 30.0, 10.0, 13.0),
+        "stable": entries(10.0, 10.5, 11.0),
+        "cached": entries(10.0, 10.0, 50.0, cache_hit_last=True),
+        "single": entries(99.0),
+    }
+    
+    regressions = convert_pdf_to_md.find_regressions(trends, threshold=20)
+    
+    assert [r["document"] for r in regressions] == ["slow"]
+    assert regressions[0]["baseline"] == 10.0
+    assert regressions[0]["change_percent"] == 30.0
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_history_report_flags_regressed_documents(tmp_path, capsys):
+    """Test that the history report lists runs and warns about regressed documents."""
+    config = {"cache_dir": str(tmp_path / "cache")}
+    db_path = convert_pdf_to_md.get_run_history_db_path(config)
+    for day, convert_time in enumerate([10.0, 10.0, 20.0], start=1):
+        convert_pdf_to_md.record_run(db_path, _run_results(convert_time), {
+            "started_at": f"2024-01-0{day}T00:00:00", "marker_version": "1.0", "total_time": 30.0})
+    
+    regressions = convert_pdf_to_md.history_report(config, threshold=50)
+    
+    assert [r["document"] for r in regressions] == ["Guide A"]
+    output = capsys.readouterr().out
+    assert "2024-01-03T00:00:00" in output
+    assert "Guide A" in output
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_help_renders_with_percent_in_epilog(capsys):
+    """Test that --help formats the epilog, which mentions percentages, without errors."""
+    with patch.object(sys, "argv", ["convert_pdf_to_md.py", "--help"]):
+        with pytest.raises(SystemExit) as excinfo:
+            convert_pdf_to_md.main()
+    
+    assert excinfo.value.code == 0
+    assert "30%以上悪化" in capsys.readouterr().out
+
+
+# ----------------------------------------------------------------------------
+# Category AA: Full-Text Search Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_split_markdown_sections_ignores_code_blocks():
+    """Test that sections split on headings but not on '#' inside code fences."""
+    text = "前書き\n\n# 第1章\n本文\n```\n# コメント\n```\n## 1.1 節\n詳細"
+    
+    sections = convert_pdf_to_md.split_markdown_sections(text)
+    
+    assert [(s["heading"], s["level"], s["line"]) for s in sections] == [
+        ("", 0, 1), ("第1章", 1, 3), ("1.1 節", 2, 8)]
+    assert "# コメント" in sections[1]["text"]
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_tokenize_search_text_uses_bigrams_and_words():
+    """Test that Japanese runs become bigrams and ASCII runs become normalized words."""
+    tokens = convert_pdf_to_md.tokenize_search_text("スクラム Ｓｃｒｕｍ Guide 2020年")
+    
+    assert tokens == ["スク", "クラ", "ラム", "scrum", "guide", "2020", "年"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_update_search_index_is_incremental_and_ranks_sections(tmp_path):
+    """Test that only changed files are re-indexed and matching sections rank first."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "a.md").write_text("# スプリント\nスプリントは1か月以内。\n# 役割\n開発者", encoding="utf-8")
+    (docs_dir / "b.md").write_text("# レビュー\nスプリントレビューを行う。", encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache")}
+    
+    first = convert_pdf_to_md.update_search_index(config)
+    unchanged = convert_pdf_to_md.update_search_index(config)
+    (docs_dir / "b.md").write_text("# レビュー\nインクリメントを検査する。", encoding="utf-8")
+    updated = convert_pdf_to_md.update_search_index(config)
+    
+    assert sorted(first["changed"]) == ["a.md", "b.md"]
+    assert unchanged["changed"] == []
+    assert updated["changed"] == ["b.md"]
+    results = convert_pdf_to_md.search_index(
+        convert_pdf_to_md.load_search_index(convert_pdf_to_md.get_search_index_path(config)),
+        "スプリント")
+    assert (results[0]["file"], results[0]["heading"]) == ("a.md", "スプリント")
+    assert results[0]["score"] > max(r["score"] for r in results[1:])
+
+
+# ----------------------------------------------------------------------------
+# Category AB: SQLite Export Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_heading_paths_follow_heading_levels():
+    """Test that heading paths include ancestors and reset at shallower headings."""
+    sections = convert_pdf_to_md.split_markdown_sections(
+        "序文\n# 理論\n## **経験主義**\n### 透明性\n## リーン\n# 価値")
+    
+    assert convert_pdf_to_md.heading_paths(sections) == [
+        "", "理論", "理論 > 経験主義", "理論 > 経験主義 > 透明性", "理論 > リーン", "価値"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_export_sqlite_writes_sections_images_and_fts(tmp_path):
+    """Test that sections, versions and image refs are exported and searchable via FTS5."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "guide.md").write_text(
+        "# スクラムの作成物\n## インクリメント\n完成の定義を満たす。\n![図1](images/fig1.png)\n",
+        encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache"),
+              "pdfs": [{"name": "Guide", "version": "2020", "output_filename": "guide.md"}]}
+    
+    stats = convert_pdf_to_md.export_sqlite(config)
+    
+    assert stats["updated"] == ["guide.md"]
+    assert stats["sections"] == 2
+    conn = sqlite3.connect(stats["path"])
+    try:
+        assert conn.execute("SELECT name, version FROM documents").fetchall() == [("Guide", "2020")]
+        assert conn.execute("SELECT alt, path FROM images").fetchall() == [("図1", "images/fig1.png")]
+        hits = conn.execute(
+            "SELECT s.heading_path FROM sections_fts JOIN sections s ON s.id = sections_fts.rowid"
+            " WHERE sections_fts MATCH ?", ("完成の定義",)).fetchall()
+        assert hits == [("スクラムの作成物 > インクリメント",)]
+    finally:
+        conn.close()
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_export_sqlite_updates_only_changed_documents(tmp_path):
+    """Test that re-exporting replaces changed documents and removes deleted ones."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "a.md").write_text("# A\n古い本文", encoding="utf-8")
+    (docs_dir / "b.md").write_text("# B\n本文", encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache")}
+    convert_pdf_to_md.export_sqlite(config)
+    
+    (docs_dir / "a.md").write_text("# A\n新しい本文です", encoding="utf-8")
+    (docs_dir / "b.md").unlink()
+    stats = convert_pdf_to_md.export_sqlite(config)
+    
+    assert stats["updated"] == ["a.md"]
+    assert stats["removed"] == ["b.md"]
+    conn = sqlite3.connect(stats["path"])
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM sections_fts").fetchone()[0] == 1
+        assert conn.execute("SELECT text FROM sections").fetchall() == [("# A\n新しい本文です",)]
+    finally:
+        conn.close()
+
+
+# ----------------------------------------------------------------------------
+# Category AC: Section Diff Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_diff_paragraphs_classifies_changes():
+    """Test that paragraph changes are reported as modified, added or removed."""
+    old = "# 節\nスクラムチームは小さい。\n\n開発チームは自己組織化している。\n\n削除される段落です。"
+    new = "# 節\nスクラムチームは小さい。\n\n開発者は自己管理している。開発チームは自己組織化している。\n\n新しい段落。"
+    
+    changes = convert_pdf_to_md.diff_paragraphs(old, new)
+    
+    assert [c["type"] for c in changes] == ["modified", "removed", "added"]
+    assert changes[0]["old"] == "開発チームは自己組織化している。"
+    assert changes[2]["new"] == "新しい段落。"
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_diff_documents_aligns_renamed_sections_by_content():
+    """Test that sections align by heading, and renamed headings align by content."""
+    old = ("# スクラムの理論\n経験主義に基づいている。\n\n"
+           "# 開発チーム\n開発チームは、スプリントの終了時に完成したインクリメントを届ける専門家で構成される。\n\n"
+           "# 廃止された節\nこの節は削除される。")
+    new = ("# スクラムの理論\n経験主義に基づいている。\n\n"
+           "# 開発者\n開発者は、スプリントの終了時に完成したインクリメントを届ける専門家で構成される。\n\n"
+           "# 新しい節\nまったく新しい内容を扱う。")
+    
+    sections = convert_pdf_to_md.diff_documents(old, new)
+    
+    summary = [(s["status"], s["old_path"], s["new_path"]) for s in sections]
+    assert summary == [
+        ("unchanged", "スクラムの理論", "スクラムの理論"),
+        ("modified", "開発チーム", "開発者"),
+        ("removed", "廃止された節", None),
+        ("added", None, "新しい節"),
+    ]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_diff_mode_resolves_versions_and_writes_report(tmp_path):
+    """Test that versions resolve via config and the Markdown report is saved."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "old.md").write_text("# 価値\n確約。", encoding="utf-8")
+    (docs_dir / "new.md").write_text("# 価値\n確約。\n\n勇気。", encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "pdfs": [
+        {"name": "Old", "version": "2017", "output_filename": "old.md"},
+        {"name": "New", "version": "2020", "output_filename": "new.md"}]}
+    output_path = tmp_path / "diff.md"
+    
+    sections = convert_pdf_to_md.diff_mode(config, "2017", "New", str(output_path))
+    
+    assert [s["status"] for s in sections] == ["modified"]
+    report_text = output_path.read_text(encoding="utf-8")
+    assert "# old.md → new.md" in report_text
+    assert "## [変更] 価値" in report_text
+    assert "+ 勇気。" in report_text
+
+
+# ----------------------------------------------------------------------------
+# Category AD: Section Similarity Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_tfidf_matrix_gives_cosine_similarity():
+    """Test that rows are normalized so identical texts score 1 and disjoint texts 0."""
+    matrix = convert_pdf_to_md.build_tfidf_matrix([
+        "スクラムチームは小さい", "スクラムチームは小さい", "透明性と検査", "適応"])
+    similarity = matrix @ matrix.T
+    
+    assert similarity[0, 1] == pytest.approx(1.0, abs=1e-5)
+    assert similarity[0, 2] == pytest.approx(0.0)
+    # Terms unique to one text are dropped from the matrix columns
+    assert not matrix[3].any()
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_align_sections_flags_mutual_renamed_and_moved():
+    """Test that best matches are flagged as mutual, renamed or moved, or left unmatched."""
+    import numpy as np
+    old = [{"heading": "開発チーム", "path": "開発チーム", "line": 1},
+           {"heading": "結論", "path": "結論", "line": 9},
+           {"heading": "謝辞", "path": "謝辞", "line": 12}]
+    new = [{"heading": "開発者", "path": "スクラムチーム > 開発者", "line": 3},
+           {"heading": "最後に", "path": "最後に", "line": 20}]
+    similarity = np.array([[0.8, 0.1], [0.1, 0.9], [0.05, 0.1]], dtype=np.float32)
+    
+    alignments = convert_pdf_to_md.align_sections(similarity, old, new, min_score=0.2)
+    
+    assert [(a["new"], a["mutual"], a["renamed"], a["moved"]) for a in alignments] == [
+        ("スクラムチーム > 開発者", True, True, True),
+        ("最後に", True, True, False),
+        (None, False, False, False),
+    ]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_compute_section_similarity_aligns_versions_in_order(tmp_path):
+    """Test that adjacent versions are aligned oldest first and the heatmap files are saved."""
+    import numpy as np
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "new.md").write_text(
+        "# スクラムの定義\nスクラムは複雑な問題に対応するフレームワークである。\n\n"
+        "# スプリント\nスプリントは1か月以内の固定の長さのイベントである。", encoding="utf-8")
+    (docs_dir / "old.md").write_text(
+        "# スプリント\nスプリントは1か月以内の固定の長さのイベントである。\n\n"
+        "# スクラムの概要\nスクラムは複雑な問題に対応するフレームワークである。", encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache"), "pdfs": [
+        {"output_filename": "new.md", "version": "2020"},
+        {"output_filename": "old.md", "version": "2017"}]}
+    
+    result = convert_pdf_to_md.compute_section_similarity(config)
+    
+    pair = result["pairs"][0]
+    assert (pair["old"], pair["new"]) == ("old.md", "new.md")
+    assert [(a["old"], a["new"], a["renamed"]) for a in pair["alignments"]] == [
+        ("スプリント", "スプリント", False), ("スクラムの概要", "スクラムの定義", True)]
+    output_dir = tmp_path / "cache" / "similarity"
+    assert np.load(output_dir / "heatmap.npy").shape == (4, 4)
+    labels = json.loads((output_dir / "heatmap.json").read_text(encoding="utf-8"))["labels"]
+    assert [label["file"] for label in labels] == ["old.md", "old.md", "new.md", "new.md"]
+
+
+# ----------------------------------------------------------------------------
+# Category AE: RAG Chunk Export Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_estimate_tokens_counts_japanese_and_ascii():
+    """Test that Japanese characters count as one token and ASCII as four characters per token."""
+    assert convert_pdf_to_md.estimate_tokens("スクラム") == 4
+    assert convert_pdf_to_md.estimate_tokens("Scrum Guide") == 3
+    assert convert_pdf_to_md.estimate_tokens(" \n") == 0
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_iter_markdown_chunks_respects_headings_size_and_overlap(tmp_path):
+    """Test that chunks stay within a section, overlap inside it and map to exact byte ranges."""
+    md_path = tmp_path / "guide.md"
+    lines = "".join(f"{'あ' * 8}{i}\n" for i in range(6))
+    md_path.write_text(f"# 第1章\n{lines}## 1.1 節\n短い本文。\n", encoding="utf-8")
+    
+    chunks = list(convert_pdf_to_md.iter_markdown_chunks(md_path, target_tokens=30, overlap_tokens=10))
+    
+    raw = md_path.read_bytes()
+    for chunk in chunks:
+        assert raw[chunk["byte_start"]:chunk["byte_end"]].decode("utf-8") == chunk["text"]
+        assert chunk["tokens"] <= 30
+    assert [c["heading_path"] for c in chunks] == ["第1章", "第1章", "第1章", "第1章 > 1.1 節"]
+    # Consecutive chunks in a section overlap; a new section starts fresh
+    assert chunks[1]["byte_start"] < chunks[0]["byte_end"]
+    assert chunks[3]["byte_start"] == chunks[2]["byte_end"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_export_chunks_writes_jsonl_with_metadata(tmp_path):
+    """Test that all documents are streamed to JSONL with source and version metadata."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "a.md").write_text("# 価値基準\n確約、集中、公開、尊敬、勇気。\n", encoding="utf-8")
+    (docs_dir / "b.md").write_text("# 理論\n経験主義。\n", encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache"),
+              "pdfs": [{"name": "Guide A", "version": "2020", "output_filename": "a.md"}]}
+    
+    stats = convert_pdf_to_md.export_chunks(config)
+    
+    records = [json.loads(line) for line in Path(stats["path"]).read_text(encoding="utf-8").splitlines()]
+    assert [(r["id"], r["version"], r["heading_path"]) for r in records] == [
+        ("a.md#0", "2020", "価値基準"), ("b.md#0", None, "理論")]
+    assert stats["chunks"] == 2
+    with pytest.raises(ValueError):
+        convert_pdf_to_md.export_chunks(config, target_tokens=10, overlap_tokens=10)
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+@pytest.mark.parametrize("target, overlap", [(0, 0), (-5, 0), (10, -1)])
+def test_export_chunks_rejects_invalid_sizes(tmp_path, target, overlap):
+    """Test that non-positive chunk sizes and negative overlaps are rejected before chunking loops forever."""
+    config = {"output_dir": str(tmp_path / "docs"), "cache_dir": str(tmp_path / "cache")}
+    
+    with pytest.raises(ValueError):
+        convert_pdf_to_md.export_chunks(config, target_tokens=target, overlap_tokens=overlap)
+    assert not (tmp_path / "cache").exists()
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_export_chunks_cli_reports_invalid_chunk_size(tmp_path, capsys):
+    """Test that --chunk-size 0 exits with an argument error instead of hanging."""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"output_dir": str(tmp_path / "docs"), "cache_dir": str(tmp_path / "cache")}),
+                           encoding="utf-8")
+    
+    with patch.object(sys, "argv", ["convert_pdf_to_md.py", "-c", str(config_path), "--export-chunks",
+                                    "--chunk-size", "0"]):
+        with pytest.raises(SystemExit) as excinfo:
+            convert_pdf_to_md.main()
+    
+    assert excinfo.value.code == 2
+    assert "目標サイズ" in capsys.readouterr().err
+
+
+# ----------------------------------------------------------------------------
+# Category AF: Section Byte-Offset Index Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_build_section_index_computes_byte_and_line_ranges():
+    """Test that each heading maps to its own range and to its subtree range."""
+    data = "前書き\n# 章1\nあ\n## 節1.1\nい\n# 章2\nう\n".encode("utf-8")
+    
+    sections = convert_pdf_to_md.build_section_index(data)
+    
+    assert [(s["path"], s["line_start"], s["line_end"], s["subtree_line_end"]) for s in sections] == [
+        ("章1", 2, 4, 6), ("章1 > 節1.1", 4, 6, 6), ("章2", 6, 8, 8)]
+    chapter = sections[0]
+    assert data[chapter["byte_start"]:chapter["byte_end"]].decode("utf-8") == "# 章1\nあ\n"
+    assert data[chapter["byte_start"]:chapter["subtree_byte_end"]].decode("utf-8") == "# 章1\nあ\n## 節1.1\nい\n"
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_optimize_markdown_file_writes_section_index(tmp_path, monkeypatch):
+    """Test that optimizing a file writes a sidecar index matching the optimized content."""
+    # Optimization writes backups relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    md_path = tmp_path / "guide.md"
+    md_path.write_text("# 章1   \n\n\n\n本文\n# 章2\n本文2\n", encoding="utf-8")
+    
+    convert_pdf_to_md.optimize_markdown_file(str(md_path))
+    
+    index = convert_pdf_to_md.load_section_index(md_path)
+    assert index["size"] == md_path.stat().st_size
+    assert [s["heading"] for s in index["sections"]] == ["章1", "章2"]
+    raw = md_path.read_bytes()
+    second = index["sections"][1]
+    assert raw[second["byte_start"]:second["byte_end"]] == "# 章2\n本文2\n".encode("utf-8")
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_read_section_seeks_and_rebuilds_stale_index(tmp_path):
+    """Test that sections are read by heading or path and a stale index is rebuilt."""
+    md_path = tmp_path / "guide.md"
+    md_path.write_text("# 理論\n経験主義\n## 透明性\n見える\n# 価値\n確約\n", encoding="utf-8")
+    convert_pdf_to_md.write_section_index(md_path)
+    
+    assert convert_pdf_to_md.read_section(md_path, "理論 > 透明性") == "## 透明性\n見える\n"
+    assert convert_pdf_to_md.read_section(md_path, "理論", subtree=False) == "# 理論\n経験主義\n"
+    
+    md_path.write_text("# 序文\nはじめに\n# 価値\n確約、勇気\n", encoding="utf-8")
+    assert convert_pdf_to_md.read_section(md_path, "価値") == "# 価値\n確約、勇気\n"
+    assert convert_pdf_to_md.read_section(md_path, "存在しない") is None
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_read_section_rebuilds_after_same_size_edit(tmp_path):
+    """Test that an in-place edit keeping the file size does not reuse stale byte offsets."""
+    md_path = tmp_path / "guide.md"
+    md_path.write_text("# 理論\n経験主義\n# 価値\n勇気\n", encoding="utf-8")
+    convert_pdf_to_md.write_section_index(md_path)
+    
+    # Same byte length: two characters move below the second heading
+    md_path.write_text("# 理論\n経験\n# 価値\n主義勇気\n", encoding="utf-8")
+    os.utime(md_path, ns=(md_path.stat().st_atime_ns, md_path.stat().st_mtime_ns + 1_000_000))
+    
+    assert convert_pdf_to_md.read_section(md_path, "価値") == "# 価値\n主義勇気\n"
+    assert convert_pdf_to_md.load_section_index(md_path)["mtime_ns"] == md_path.stat().st_mtime_ns
+
+
+# ----------------------------------------------------------------------------
+# Category AG: Chapter Split Tests
+# ----------------------------------------------------------------------------
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_split_markdown_chapters_writes_chapters_and_index(tmp_path):
+    """Test that top-level chapters get their own files and an index page links them."""
+    md_path = tmp_path / "guide.md"
+    md_path.write_text(
+        "# スクラムガイド\n表紙\n## 理論\n経験主義\n### 透明性\n見える\n## 価値\n確約\n",
+        encoding="utf-8")
+    
+    files = convert_pdf_to_md.split_markdown_chapters(md_path, "Scrum Guide")
+    
+    chapter_dir = tmp_path / "guide"
+    assert [f.name for f in files] == ["index.md", "chapter-01.md", "chapter-02.md"]
+    assert (chapter_dir / "chapter-01.md").read_text(encoding="utf-8") == \
+        "## 理論\n経験主義\n### 透明性\n見える\n"
+    index = (chapter_dir / "index.md").read_text(encoding="utf-8")
+    assert index.startswith("# スクラムガイド\n表紙")
+    assert "1. [理論](chapter-01.md)" in index
+    assert "[全文](../guide.md)" in index
+    # The original file is kept as-is
+    assert md_path.read_text(encoding="utf-8").startswith("# スクラムガイド")
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_split_markdown_chapters_rewrites_images_and_anchors(tmp_path, images_dir):
+    """Test that image paths resolve from the chapter directory and cross-chapter links are fixed."""
+    docs_dir = tmp_path / "docs"
+    shutil.copytree(images_dir, docs_dir / "images")
+    image_name = sorted((docs_dir / "images").iterdir())[0].name
+    md_path = docs_dir / "guide.md"
+    md_path.write_text(
+        f"# 第1章\n[第2章へ](#page-2-0)\n![図](images/{image_name})\n"
+        f"# <span id=\"page-2-0\"></span>第2章\n[第2章の先頭](#page-2-0)\n![外部](https://example.com/a.png)\n",
+        encoding="utf-8")
+    
+    convert_pdf_to_md.split_markdown_chapters(md_path)
+    
+    chapter_dir = docs_dir / "guide"
+    first = (chapter_dir / "chapter-01.md").read_text(encoding="utf-8")
+    second = (chapter_dir / "chapter-02.md").read_text(encoding="utf-8")
+    assert f"![図](../images/{image_name})" in first
+    assert "[第2章へ](chapter-02.md#page-2-0)" in first
+    assert "[第2章の先頭](#page-2-0)" in second
+    assert "![外部](https://example.com/a.png)" in second
+    result = convert_pdf_to_md.verify_images(str(chapter_dir / "chapter-01.md"), str(docs_dir / "images"))
+    assert result["missing"] == [] and len(result["found"]) == 1
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_finalize_markdown_splits_and_verifies_chapter_files(tmp_path, images_dir):
+    """Test that finalize_markdown splits when requested and verifies the chapter files too."""
+    import argparse
+    docs_dir = tmp_path / "docs"
+    shutil.copytree(images_dir, docs_dir / "images")
+    image_name = sorted((docs_dir / "images").iterdir())[0].name
+    md_path = docs_dir / "guide.md"
+    md_path.write_text(f"# A\n![図](images/{image_name})\n# B\n![なし](images/missing.png)\n",
+                       encoding="utf-8")
+    args = argparse.Namespace(no_optimize=True, verify=True, split_chapters=True)
+    metrics = {}
+    
+    convert_pdf_to_md.finalize_markdown(
+        str(md_path), {"image_dir": str(docs_dir / "images")}, args, metrics,
+        convert_pdf_to_md.should_split_chapters({}, args))
+    
+    assert metrics["chapters"] == 2
+    assert [f.name for f in convert_pdf_to_md.list_chapter_files(md_path)] == [
+        "chapter-01.md", "chapter-02.md", "index.md"]
+    assert not convert_pdf_to_md.should_split_chapters({}, argparse.Namespace())
+    assert convert_pdf_to_md.should_split_chapters({"split_chapters": True}, argparse.Namespace())
+
+
+# ----------------------------------------------------------------------------
+# Category AH: Paragraph Deduplication Tests
+# ----------------------------------------------------------------------------
+
+@pytest.fixture
+def dedup_config(tmp_path):
+    """Create two guide versions that share one of their paragraphs."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    (docs_dir / "new.md").write_text("# 価値基準\n\n確約 と 勇気。\n\n新しい段落。\n", encoding="utf-8")
+    (docs_dir / "old.md").write_text("# 価値基準\n\n確約と\n勇気。\n\n\n古い段落です。\n", encoding="utf-8")
+    return {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache"), "pdfs": [
+        {"name": "New", "version": "2020", "output_filename": "new.md"},
+        {"name": "Old", "version": "2017", "output_filename": "old.md"}]}
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_paragraph_hash_ignores_whitespace_and_width():
+    """Test that paragraphs differing only in whitespace or full-width forms share a hash."""
+    assert convert_pdf_to_md.paragraph_hash("スクラム 2020") == convert_pdf_to_md.paragraph_hash("スクラム\n２０２０")
+    assert convert_pdf_to_md.paragraph_hash("確約") != convert_pdf_to_md.paragraph_hash("勇気")
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_paragraph_store_deduplicates_and_reports_ratios(dedup_config):
+    """Test that shared paragraphs are stored once and duplication ratios are byte-weighted."""
+    store = convert_pdf_to_md.build_paragraph_store(dedup_config)
+    stats = convert_pdf_to_md.paragraph_duplication(store)
+    
+    # Oldest version first; the first occurrence is kept as the representative text
+    assert list(store["documents"]) == ["old.md", "new.md"]
+    assert len(store["paragraphs"]) == 4
+    assert convert_pdf_to_md.reconstruct_document(store, "old.md") == "# 価値基準\n\n確約と\n勇気。\n\n古い段落です。\n"
+    old_bytes = len("# 価値基準".encode()) + len("確約と\n勇気。".encode())
+    assert stats["documents"]["old.md"]["shared_bytes"] == old_bytes
+    assert stats["pairs"]["old.md"]["new.md"] == pytest.approx(
+        old_bytes / stats["documents"]["old.md"]["bytes"])
+    assert stats["store_bytes"] < stats["corpus_bytes"]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_export_corpus_writes_paragraphs_then_documents(dedup_config):
+    """Test that the compact corpus lists each paragraph once followed by document sequences."""
+    stats = convert_pdf_to_md.export_corpus(dedup_config)
+    
+    records = [json.loads(line) for line in Path(stats["path"]).read_text(encoding="utf-8").splitlines()]
+    paragraphs = [r for r in records if r["type"] == "paragraph"]
+    documents = [r for r in records if r["type"] == "document"]
+    assert records[:len(paragraphs)] == paragraphs
+    assert paragraphs[0]["documents"] == ["2017", "2020"]
+    assert [d["file"] for d in documents] == ["old.md", "new.md"]
+    texts = {p["hash"]: p["text"] for p in paragraphs}
+    assert [texts[h] for h in documents[1]["paragraphs"]] == ["# 価値基準", "確約と\n勇気。", "新しい段落。"]
+
+
+# ----------------------------------------------------------------------------
+# Category AI: Near-Duplicate Section Detection Tests
+# ----------------------------------------------------------------------------
+
+NEAR_DUPLICATE_BODY = ("スクラムチームは、プロダクトオーナー、開発チーム、スクラムマスターで構成される。"
+                       "スクラムチームは自己組織化されており、機能横断的である。")
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_minhash_estimate_tracks_jaccard():
+    """Test that the fraction of equal MinHash values approximates the Jaccard similarity."""
+    first = convert_pdf_to_md.section_shingles(NEAR_DUPLICATE_BODY)
+    second = convert_pdf_to_md.section_shingles(NEAR_DUPLICATE_BODY.replace("開発チーム", "開発者"))
+    
+    signatures = convert_pdf_to_md.minhash_signatures([first, second, first])
+    jaccard = len(first & second) / len(first | second)
+    assert (signatures[0] == signatures[2]).all()
+    assert (signatures[0] == signatures[1]).mean() == pytest.approx(jaccard, abs=0.15)
+    # Whitespace and full-width forms do not change the shingles
+    assert convert_pdf_to_md.section_shingles("スクラム　２０２０") == convert_pdf_to_md.section_shingles("スクラム 2020")
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_lsh_parameters_follow_threshold():
+    """Test that a higher threshold selects fewer, wider bands and the product stays fixed."""
+    low = convert_pdf_to_md.lsh_parameters(128, 0.5)
+    high = convert_pdf_to_md.lsh_parameters(128, 0.9)
+    assert low[0] * low[1] == high[0] * high[1] == 128
+    assert high[0] < low[0]
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_near_duplicates_pairs_sections_across_versions(tmp_path):
+    """Test that edited sections match across versions but not within the same document."""
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    edited = NEAR_DUPLICATE_BODY.replace("機能横断的", "機能横断型")
+    (docs_dir / "old.md").write_text(
+        f"# チーム\n\n{NEAR_DUPLICATE_BODY}\n\n# 再掲\n\n{NEAR_DUPLICATE_BODY}\n", encoding="utf-8")
+    (docs_dir / "new.md").write_text(
+        f"# 概要\n\n## スクラムチーム\n\n{edited}\n\n# 作成物\n\nプロダクトバックログは、プロダクトの改善に必要なものを創発的に並べた一覧である。\n",
+        encoding="utf-8")
+    config = {"output_dir": str(docs_dir), "cache_dir": str(tmp_path / "cache"), "pdfs": [
+        {"name": "Old", "version": "2017", "output_filename": "old.md"},
+        {"name": "New", "version": "2020", "output_filename": "new.md"}]}
+    
+    result = convert_pdf_to_md.near_duplicate_mode(config, threshold=0.7)
+    
+    assert len(result["pairs"]) == 2
+    for pair in result["pairs"]:
+        assert (pair["a"]["file"], pair["b"]["file"]) == ("old.md", "new.md")
+        assert pair["b"]["path"] == "概要 > スクラムチーム"
+        assert 0.7 <= pair["jaccard"] < 1 and not pair["exact"]
+    saved = json.loads((tmp_path / "cache" / "similarity" / "near_duplicates.json").read_text(encoding="utf-8"))
+    assert saved["pairs"] == result["pairs"]
+    
+    # The dedup report picks up the saved pairs that paragraph hashing treats as distinct
+    stats = convert_pdf_to_md.dedup_report(config)
+    assert stats["near_duplicates"] == {"2017|2020": 2}
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+@pytest.mark.parametrize("value", ["0", "-0.5", "1.5", "abc"])
+def test_near_duplicate_threshold_rejects_values_outside_unit_interval(value, capsys):
+    """Test that the Jaccard threshold must lie in (0, 1] on the command line and in the API."""
+    with patch.object(sys, "argv", ["convert_pdf_to_md.py", "--near-duplicates",
+                                    "--near-duplicate-threshold", value]):
+        with pytest.raises(SystemExit) as exc_info:
+            convert_pdf_to_md.main()
+    assert exc_info.value.code == 2
+    assert "--near-duplicate-threshold" in capsys.readouterr().err
+    assert convert_pdf_to_md.parse_jaccard_threshold("1") == 1.0
+    with pytest.raises(ValueError):
+        convert_pdf_to_md.find_near_duplicates({}, threshold=0)
+
+
+# ----------------------------------------------------------------------------
+# Category AJ: Static Site Build Tests
+# ----------------------------------------------------------------------------
+
+PNG_1X1 = bytes.fromhex("89504e470d0a1a0a0000000d4948445200000003000000020806000000"
+                        "0000000000000000")
+
+
+@pytest.fixture
+def site_config(tmp_path):
+    """Create a docs directory with two guides, a shared image and a site directory."""
+    docs_dir = tmp_path / "docs"
+    (docs_dir / "images").mkdir(parents=True)
+    (docs_dir / "images" / "logo.png").write_bytes(PNG_1X1)
+    (docs_dir / "guide.md").write_text(
+        "# スクラム\n\n![ロゴ](images/logo.png)\n\n## 価値基準\n\n- 確約\n  - 勇気\n- 集中\n\n"
+        "| 英語 | 日本語 |\n|---|---:|\n| Focus | 集中 |\n\n[2017年版](old.md#スクラム) と **透明性** <sup>1</sup>\n",
+        encoding="utf-8")
+    (docs_dir / "old.md").write_text("# スクラム\n\n![ロゴ](images/logo.png)\n\n検査と適応。\n", encoding="utf-8")
+    return {"output_dir": str(docs_dir), "site_dir": str(tmp_path / "site"),
+            "cache_dir": str(tmp_path / "cache"), "pdfs": [
+        {"name": "Scrum Guide 2020", "output_filename": "guide.md"}]}
+
+
+@pytest.mark.phase3
+@pytest.mark.unit
+def test_render_markdown_html_covers_converter_output():
+    """Test that headings, nested lists, tables, links and inline HTML render to compact HTML."""
+    body, anchors = convert_pdf_to_md.render_markdown_html(
+        "# <span id=\"page-1-0\"></span>目次\n\n## 価値 基準\n\n## 価値 基準\n\n- a\n  - b\n- c\n\n1. x\n\n"
+        "| A | B |\n|:-:|--:|\n| 1 | 2 |\n\n[次](next.md#top) a < b **強調** <sup>1</sup>\n\n```\n<tag>\n```\n")
+    
+    assert anchors == ["page-1-0", "価値-基準", "価値-基準-2"]
+    assert '<h1><span id="page-1-0"></span>目次</h1><h2 id="価値-基準">' in body
+    assert "<ul><li>a<ul><li>b</li></ul></li><li>c</li></ul><ol><li>x</li></ol>" in body
+    assert '<th style="text-align:center">A</th><th style="text-align:right">B</th>' in body
+    assert '<p><a href="next.html#top">次</a> a &lt; b <strong>強調</strong> <sup>1</sup></p>' in body
+    assert "<pre><code>&lt;tag&gt;</code></pre>" in body
+    assert "\n<" not in body
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_build_site_search_anchors_skip_blockquoted_headings(site_config):
+    """Test that a heading inside a blockquote does not shift later search results' anchors."""
+    docs_dir = Path(site_config["output_dir"])
+    (docs_dir / "old.md").unlink()
+    (docs_dir / "guide.md").write_text("# A\n\ntext\n\n> ## Quoted\n\n## B\n\nbody b\n", encoding="utf-8")
+    
+    convert_pdf_to_md.build_site(site_config)
+    
+    site_dir = Path(site_config["site_dir"])
+    search = json.loads((site_dir / "search-index.json").read_text(encoding="utf-8"))
+    assert [[anchor, path] for _, anchor, path, _ in search["sections"]] == [["a", "A"], ["b", "A > B"]]
+    page = (site_dir / "guide.html").read_text(encoding="utf-8")
+    assert '<blockquote><h2 id="quoted">Quoted</h2></blockquote><h2 id="b">B</h2>' in page
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_build_site_writes_pages_assets_and_search_index(site_config):
+    """Test that pages share a hashed stylesheet, images are deduplicated and sections are indexed."""
+    stats = convert_pdf_to_md.build_site(site_config)
+    site_dir = Path(site_config["site_dir"])
+    
+    assert sorted(stats["built"]) == ["guide.md", "old.md"]
+    page = (site_dir / "guide.html").read_text(encoding="utf-8")
+    assert "<title>Scrum Guide 2020</title>" in page
+    stylesheet = re.search(r'href="(style\.[0-9a-f]+\.css)"', page).group(1)
+    assert (site_dir / stylesheet).exists()
+    images = list((site_dir / "images").iterdir())
+    assert len(images) == 1
+    assert f'<img src="images/{images[0].name}" width="3" height="2" loading="lazy"' in page
+    
+    search = json.loads((site_dir / "search-index.json").read_text(encoding="utf-8"))
+    assert [p["file"] for p in search["pages"]] == ["guide.html", "old.html"]
+    assert [0, "価値基準", "スクラム > 価値基準",
+            "価値基準 確約 勇気 集中 英語 日本語 focus 集中 2017年版 と 透明性 1"] in search["sections"]
+    assert "search-index.json" in (site_dir / "index.html").read_text(encoding="utf-8")
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_build_site_rebuilds_only_changed_pages(site_config):
+    """Test that a second build skips unchanged pages and picks up edited markdown and images."""
+    convert_pdf_to_md.build_site(site_config)
+    docs_dir = Path(site_config["output_dir"])
+    
+    assert convert_pdf_to_md.build_site(site_config)["built"] == []
+    
+    (docs_dir / "old.md").write_text("# スクラム\n\n経験主義。\n", encoding="utf-8")
+    stats = convert_pdf_to_md.build_site(site_config)
+    assert stats["built"] == ["old.md"]
+    assert stats["unchanged"] == 1
+    
+    (docs_dir / "images" / "logo.png").write_bytes(PNG_1X1 + b"\0")
+    assert convert_pdf_to_md.build_site(site_config)["built"] == ["guide.md"]
+    # The unchanged page keeps its search entries; the old image is no longer published
+    search = json.loads((Path(site_config["site_dir"]) / "search-index.json").read_text(encoding="utf-8"))
+    assert [1, "スクラム", "スクラム", "スクラム 経験主義。"] in search["sections"]
+    assert len(list((Path(site_config["site_dir"]) / "images").iterdir())) == 1
+
+
+@pytest.mark.phase3
+@pytest.mark.integration
+def test_refresh_site_updates_custom_dir_and_title_changes(site_config, tmp_path):
+    """Test that a site built into an explicit directory is refreshed, including renamed titles."""
+    custom_dir = tmp_path / "www"
+    convert_pdf_to_md.build_site(site_config, custom_dir)
+    
+    site_config["pdfs"][0]["name"] = "Scrum Guide 2020 (rev.)"
+    convert_pdf_to_md.refresh_site(site_config)
+    
+    # The default site dir was never built and stays absent
+    assert not Path(site_config["site_dir"]).exists()
+    assert "<title>Scrum Guide 2020 (rev.)</title>" in (custom_dir / "guide.html").read_text(encoding="utf-8")
+    assert "Scrum Guide 2020 (rev.)" in (custom_dir / "index.html").read_text(encoding="utf-8")
+    search = json.loads((custom_dir / "search-index.json").read_text(encoding="utf-8"))
+    assert {"file": "guide.html", "title": "Scrum Guide 2020 (rev.)"} in search["pages"]
+    assert convert_pdf_to_md.build_site(site_config, custom_dir)["built"] == []